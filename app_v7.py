@@ -1,19 +1,14 @@
 # app.py
 import os
 import streamlit as st
-import smtplib
-from email.message import EmailMessage
-from PyPDF2 import PdfMerger
 import psycopg2
-import pandas as pd
-from oauth2client.service_account import ServiceAccountCredentials
-import gspread
-from dotenv import load_dotenv
 from datetime import datetime
-from fpdf import FPDF
 import time
-from streamlit_extras.stylable_container import stylable_container
+# PDF (fpdf/PyPDF2), Google Sheets, SMTP and streamlit-extras are imported
+# where they are used so the login page does not wait for them.
 import bcrypt
+import migrate
+from clinical import analyze_numerical_vitals, analyze_subjective_answers
 
 # Set page config
 st.set_page_config(
@@ -126,29 +121,36 @@ GOOGLE_SHEET_NAME = st.secrets["GOOGLE_SHEET_NAME"]
 GOOGLE_SERVICE_ACCOUNT_INFO = st.secrets["GOOGLE_SERVICE_ACCOUNT_JSON"]
 
 # -------------------------
-# Google Sheets Setup
+# Google Sheets Setup (lazy: nothing happens until the first write)
 # -------------------------
 
-sheet = None
-sheet_init_error = None
-
-try:
+@st.cache_resource(show_spinner=False)
+def get_sheets_client():
+    """Authorize the service account on first use; cached for the process."""
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
     scope = [
         "https://spreadsheets.google.com/feeds",
         "https://www.googleapis.com/auth/drive"
     ]
-
     creds = ServiceAccountCredentials.from_json_keyfile_dict(
         GOOGLE_SERVICE_ACCOUNT_INFO,
         scope
     )
+    return gspread.authorize(creds)
+
 
-    client = gspread.authorize(creds)
-    sheet = client.open(GOOGLE_SHEET_NAME).sheet1
+@st.cache_resource(show_spinner=False)
+def get_sheet():
+    return get_sheets_client().open(GOOGLE_SHEET_NAME).sheet1
 
-except Exception as e:
-    sheet = None
-    sheet_init_error = str(e)
+
+def sheets_available():
+    try:
+        get_sheet()
+        return True
+    except Exception:
+        return False
 
 # -------------------------
 # Database Connection (Supabase)
@@ -209,186 +211,12 @@ def comments_to_paragraph(comments):
     return ", ".join(comments[:-1]) + ", and " + comments[-1]
 
 
-def analyze_numerical_vitals(data):
-    comments = []
-    # BMI
-    bmi = data.get('bmi')
-    if bmi is not None:
-        try:
-            bmi = float(bmi)
-            if bmi < 18.5:
-                comments.append("The patient is underweight")
-            elif 25 <= bmi <= 29.9:
-                comments.append("The patient is overweight")
-            elif bmi >= 30:
-                comments.append("The patient is obese")
-        except Exception:
-            pass
-
-    # Blood Pressure
-    systolic = data.get('systolic_blood_pressure')
-    diastolic = data.get('diastolic_blood_pressure')
-    if systolic is not None and diastolic is not None:
-        try:
-            systolic_val = int(systolic)
-            diastolic_val = int(diastolic)
-            if systolic_val < 90 or diastolic_val < 60:
-                comments.append("The patient has low blood pressure")
-            elif systolic_val > 120 or diastolic_val > 80:
-                comments.append("The patient has high blood pressure")
-        except Exception:
-            comments.append("Invalid blood pressure reading")
-
-    # Temperature (assume °F)
-    temperature = data.get('temperature')
-    try:
-        if temperature is not None:
-            temperature = float(temperature)
-            if temperature < 97.8:
-                comments.append("The patient has a low body temperature")
-            elif temperature > 99.1:
-                comments.append("The patient has a fever")
-    except Exception:
-        comments.append("Invalid temperature reading")
-
-    # SpO2
-    spo2 = data.get('o2_level')
-    try:
-        if spo2 is not None:
-            spo2_val = float(str(spo2).replace('%', '').strip())
-            if spo2_val < 94:
-                comments.append("The patient has low SpO2 (possible hypoxemia)")
-    except Exception:
-        comments.append("Invalid SpO2 reading")
-
-    # Pulse
-    pulse = data.get('pulse_rate')
-    try:
-        if pulse is not None:
-            pulse_val = float(pulse)
-            if pulse_val < 60:
-                comments.append("The patient has bradycardia (low pulse rate)")
-            elif pulse_val > 100:
-                comments.append("The patient has tachycardia (high pulse rate)")
-    except Exception:
-        comments.append("Invalid pulse rate reading")
-
-    return comments
-
-
-def analyze_subjective_answers(data):
-    comments = []
-    hair_loss = data.get('hair_loss')
-    if hair_loss == "Yes, severe hair loss":
-        comments.append("The doctor needs to urgently look at the patient's hair condition.")
-    elif hair_loss in ["Yes, mild hair loss", "Yes, moderate hair loss"]:
-        comments.append("Deeper inspection is required for the patient's hair condition.")
-
-    nail_changes = data.get('nail_changes')
-    if nail_changes == "Yes, dark streaks":
-        comments.append("The doctor needs to urgently look at the patient's nail condition.")
-    elif nail_changes in ["Yes, white spots", "Yes, yellowing"]:
-        comments.append("Deeper inspection is required for the patient's nail condition.")
-
-    urine_color = data.get('urine_color')
-    if urine_color == "Brownish/red (seek medical attention)":
-        comments.append("The doctor needs to urgently look at the patient's urinary condition.")
-    elif urine_color == "Dark yellow":
-        comments.append("Urinary condition may depict an underlying symptom.")
-
-    oral_health = data.get('oral_health')
-    if oral_health in ["Bleeding gums", "Frequent mouth ulcers"]:
-        comments.append("The doctor needs to urgently look at the patient's mouth condition.")
-    elif oral_health in ["Bad breath", "Tooth pain or sensitivity"]:
-        comments.append("Mouth condition may depict an underlying symptom.")
-
-    return comments
-
-
 # -------------------------
 # PDF generation (kept your original layout but safer fetching)
+# The PDF class is shared with app_v8 in report_pdf, imported on first use.
 # -------------------------
-class PDF(FPDF):
-    def header(self):
-        self.set_draw_color(0, 0, 0)
-        self.rect(5, 5, 200, 287)
-        logo_path = "assets/kgp_logo.png"
-        if os.path.exists(logo_path):
-            self.image(logo_path, 10, 8, 25)
-        self.set_font('Times', 'B', 16)
-        self.set_xy(0, 10)
-        self.cell(0, 10, "Indian Institute of Technology Kharagpur", 0, 1, 'C')
-        self.set_font('Times', 'B', 14)
-        self.cell(0, 10, "Solar-Powered Mobile Health Measurement Device", 0, 1, 'C')
-        self.ln(8)
-
-    def footer(self):
-        self.set_y(-20)
-        self.set_font('Times', 'I', 10)
-        self.cell(0, 10, '~ End of Report ~', 0, 0, 'C')
-
-    def patient_info(self, left_info, right_info):
-        self.set_font('Times', '', 10)
-        initial_y = self.get_y()
-        self.multi_cell(95, 7, "\n".join([f"{k}: {v}" for k, v in left_info.items()]), 0, 'L')
-        self.set_y(initial_y)
-        self.set_x(105)
-        self.multi_cell(95, 7, "\n".join([f"{k}: {v}" for k, v in right_info.items()]), 0, 'L')
-        self.line(10, self.get_y(), 200, self.get_y())
-        self.ln(6)
-
-    def add_dates(self, left_date_info, right_date_info):
-        self.set_font('Times', '', 10)
-        initial_y = self.get_y()
-        self.multi_cell(95, 7, "\n".join([f"{k}: {v}" for k, v in left_date_info.items()]), 0, 'L')
-        self.set_y(initial_y)
-        self.set_x(105)
-        self.multi_cell(95, 7, "\n".join([f"{k}: {v}" for k, v in right_date_info.items()]), 0, 'L')
-        self.ln(6)
-        self.line(10, self.get_y(), 200, self.get_y())
-
-    def chapter_title(self, title):
-        self.set_font('Times', 'B', 12)
-        self.cell(0, 8, title, 0, 1, 'L')
-        self.ln(4)
-
-    def test_table_1(self, test_info):
-        self.set_font('Times', 'B', 10)
-        col_widths = [60, 40, 50, 40]
-        headers = ['VITALS', 'RESULT', 'REF. RANGE', 'UNIT']
-        for i, header in enumerate(headers):
-            self.cell(col_widths[i], 7, header, 1, 0, 'C')
-        self.ln()
-        self.set_font('Times', '', 9)
-        for test in test_info:
-            self.cell(col_widths[0], 7, test['description'], 1)
-            self.cell(col_widths[1], 7, str(test.get('result', '')), 1)
-            self.cell(col_widths[2], 7, test.get('range', ''), 1)
-            self.cell(col_widths[3], 7, test.get('unit', ''), 1)
-            self.ln()
-
-    def test_table_2(self, test_info):
-        self.set_font('Times', 'B', 10)
-        col_widths = [20, 120, 50]
-        headers = ['Sl.No', 'QUESTIONS', 'RESPONSE']
-        for i, header in enumerate(headers):
-            self.cell(col_widths[i], 7, header, 1, 0, 'C')
-        self.ln()
-        self.set_font('Times', '', 9)
-        for i, test in enumerate(test_info):
-            self.cell(col_widths[0], 7, str(i + 1) + '.', 1, align='C')
-            self.cell(col_widths[1], 7, test.get('description', ''), 1)
-            self.cell(col_widths[2], 7, str(test.get('result', '')), 1)
-            self.ln()
-
-    def add_comments(self, comments):
-        self.set_font('Times', 'B', 12)
-        self.cell(0, 10, 'Comments:', 0, 1)
-        self.set_font('Times', '', 11)
-        self.multi_cell(0, 6, comments)
-
-
 def create_medical_report(data):
+    from report_pdf import PDF
     os.makedirs("generated_files", exist_ok=True)
     pdf = PDF()
     pdf.add_page()
@@ -467,13 +295,14 @@ def save_to_google_sheets(data, sheet_name=None):
     Saves data to a Google Sheet.
     If sheet_name is provided, it will use that sheet, otherwise uses the default sheet.
     """
-    if not sheet:
-        st.error("Google Sheets not properly initialized. Check your credentials.")
-        return False
-        
     try:
         # Get the worksheet (use the default sheet if no specific sheet name provided)
-        worksheet = sheet if not sheet_name else client.open(GOOGLE_SHEET_NAME).worksheet(sheet_name)
+        worksheet = get_sheet() if not sheet_name else get_sheets_client().open(GOOGLE_SHEET_NAME).worksheet(sheet_name)
+    except Exception as e:
+        st.error(f"Google Sheets not properly initialized. Check your credentials. ({e})")
+        return False
+
+    try:
         
         # Get all records to check if the data already exists
         try:
@@ -645,9 +474,11 @@ def register_user(username, password):
         return False, f"Error during registration: {str(e)}"
 
 
-def init_db():
+@st.cache_resource(show_spinner=False)
+def _init_schema():
+    """Create and migrate the tables once per server process."""
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -692,7 +523,16 @@ def init_db():
             )
         """)
         conn.commit()
+        # Bring the schema up to date (compact storage, views, ...)
+        migrate.apply_migrations(conn, log=None)
+    finally:
         conn.close()
+
+
+def init_db():
+    # a failure is not cached, so the next rerun tries again
+    try:
+        _init_schema()
     except Exception as e:
         st.error(f"DB init error: {e}")
 
@@ -1132,10 +972,6 @@ def report_generation_page():
             st.session_state['report_id'] = next_report_id
             st.rerun()
 
-    # Show Google Sheets init error if any
-    if sheet_init_error:
-        st.warning(f"Google Sheets init failed: {sheet_init_error}. Sheet features will be disabled.")
-
     final_pdf_path = None
     # Main form with improved layout
     with st.form(key="input_form"):
@@ -1210,6 +1046,7 @@ def report_generation_page():
             })
             
             # File uploader with better styling
+            from streamlit_extras.stylable_container import stylable_container
             with stylable_container(
                 key="file_uploader",
                 css_styles="""
@@ -1274,6 +1111,7 @@ def report_generation_page():
                             final_output = output_file
                             if uploaded_pdf is not None:
                                 st.write("🔄 Merging with uploaded PDF...")
+                                from PyPDF2 import PdfMerger
                                 merger = PdfMerger()
                                 merger.append(output_file)
                                 uploaded_path = "generated_files/uploaded.pdf"
@@ -1349,7 +1187,7 @@ def report_generation_page():
                                     st.session_state.show_email_modal = True
                         
                         # Optionally save to Google Sheet
-                        if sheet is not None:
+                        if sheets_available():
                             try:
                                 save_to_google_sheets(data)
                             except Exception as e:
@@ -1361,6 +1199,8 @@ def report_generation_page():
                                     if not SMTP_USER or not SMTP_PASS:
                                         st.warning("SMTP credentials not set in environment; skipped sending email.")
                                     else:
+                                        import smtplib
+                                        from email.message import EmailMessage
                                         msg = EmailMessage()
                                         msg["Subject"] = "Medical Diagnostic Report"
                                         msg["From"] = SMTP_USER
@@ -1421,6 +1261,8 @@ def report_generation_page():
                                             if st.form_submit_button("✉️ Send Email"):
                                                 if recipient:
                                                     try:
+                                                        import smtplib
+                                                        from email.message import EmailMessage
                                                         msg = EmailMessage()
                                                         msg["Subject"] = f"Medical Report - {data.get('patient_name', '')}"
                                                         msg["From"] = SMTP_USER
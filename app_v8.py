@@ -1,15 +1,26 @@
+import html
 import os
+import shutil
+import socket
+import tempfile
+import uuid
 import streamlit as st
-import smtplib
-from email.message import EmailMessage
-from PyPDF2 import PdfMerger
 import psycopg2
-from oauth2client.service_account import ServiceAccountCredentials
-import gspread
 from datetime import datetime
-from fpdf import FPDF
 import time
 import bcrypt
+import migrate
+import metrics
+import profiling
+import shared_store
+import baseline
+import findings
+import rules
+import triage
+from clinical import parse_date, calculate_bmi, bmi_category
+
+# Only what the login page needs is imported above. PDF, Sheets, SMTP and
+# sensor-trace modules are imported inside the functions that use them.
 
 st.set_page_config(
     page_title="MedReport IIT KGP",
@@ -88,25 +99,36 @@ SMTP_USER = st.secrets["SMTP_USER"]
 SMTP_PASS = st.secrets["SMTP_PASS"]
 GOOGLE_SHEET_NAME = st.secrets["GOOGLE_SHEET_NAME"]
 GOOGLE_SERVICE_ACCOUNT_INFO = st.secrets["GOOGLE_SERVICE_ACCOUNT_JSON"]
-
-# ── Google Sheets ──
-sheet = None
-sheet_init_error = None
-try:
+METRICS_PORT = os.environ.get("METRICS_PORT") or st.secrets.get("METRICS_PORT")
+ADMIN_USERS = set(st.secrets.get("ADMIN_USERS", []))
+DB_SSLMODE = st.secrets.get("DB_SSLMODE", "require")  # "disable" for a local test server
+SHARED_STORE = os.environ.get("SHARED_STORE") or st.secrets.get("SHARED_STORE")  # multi-replica mode
+ARCHIVE_DIR = "generated_files/archive"  # blob store for the report archive when SHARED_STORE is unset
+
+# ── Stage metrics (Prometheus text format on METRICS_PORT; off when unset) ──
+@st.cache_resource(show_spinner=False)
+def start_metrics():
+    if METRICS_PORT: metrics.start_server(int(METRICS_PORT))
+
+# ── Google Sheets (authorized on first use, once per process) ──
+@st.cache_resource(show_spinner=False)
+def get_sheet():
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
     scope = ["https://spreadsheets.google.com/feeds","https://www.googleapis.com/auth/drive"]
     creds = ServiceAccountCredentials.from_json_keyfile_dict(GOOGLE_SERVICE_ACCOUNT_INFO, scope)
-    client = gspread.authorize(creds)
-    sheet = client.open(GOOGLE_SHEET_NAME).sheet1
-except Exception as e:
-    sheet_init_error = str(e)
+    return gspread.authorize(creds).open(GOOGLE_SHEET_NAME).sheet1
 
 # ── DB ──
+@metrics.timed("get_db")
 def get_db():
-    return psycopg2.connect(DB_URL, sslmode="require")
+    return psycopg2.connect(DB_URL, sslmode=DB_SSLMODE)
 
-def init_db():
+@st.cache_resource(show_spinner=False)
+def _init_schema():
+    conn = get_db()
     try:
-        conn = get_db(); cur = conn.cursor()
+        cur = conn.cursor()
         cur.execute("""CREATE TABLE IF NOT EXISTS users (
             id SERIAL PRIMARY KEY, username VARCHAR(50) UNIQUE NOT NULL,
             password VARCHAR(255) NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
@@ -121,10 +143,142 @@ def init_db():
             oral_health TEXT, urine_color TEXT, hair_loss TEXT, nail_changes TEXT,
             cataract TEXT, disabilities TEXT, hemoglobin_level NUMERIC(5,2),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
-        conn.commit(); conn.close()
+        conn.commit(); migrate.apply_migrations(conn,log=None)
+        if SHARED_STORE: profiling.use_database(get_db,f"{socket.gethostname()}:{os.getpid()}")  # armed state and captures seen by every replica
+        import partitions
+        partitions.schedule(conn)  # next months' partitions, and the move after migration 013
+    finally: conn.close()
+
+def init_db():
+    # cached once per process; a failure is not cached and is retried next run
+    try: _init_schema()
     except Exception as e:
         st.error(f"DB init error: {e}")
 
+# ── Report archive (content-addressed, see archive.py) ──
+@st.cache_resource(show_spinner=False)
+def get_archive():
+    import archive
+    store=get_store() if SHARED_STORE else shared_store.DirStore(ARCHIVE_DIR)
+    return archive.Archive(store,get_db)
+
+@metrics.timed("archive_report")
+def archive_report(vid,pdf_path,uploaded_pdf):
+    # keyed by visit: report IDs can repeat (MAX()+1 outside SHARED_STORE mode)
+    if vid is None: raise RuntimeError("the visit was not saved")
+    arc=get_archive()
+    with open(pdf_path,"rb") as f: arc.put(vid,"report",f.read(),"medical_report.pdf")
+    if uploaded_pdf:
+        arc.put(vid,"upload",uploaded_pdf.getvalue(),uploaded_pdf.name)
+        enqueue_job("extract",{"visit_id":vid})  # text for search, read off the submit path
+
+# ── Shared state (multi-replica mode, see shared_store.py; off when SHARED_STORE is unset) ──
+@st.cache_resource(show_spinner=False)
+def get_store():
+    conn=get_db()
+    try: shared_store.sync_sequences(conn)
+    finally: conn.close()
+    return shared_store.open_store(SHARED_STORE,get_db)
+
+@st.cache_resource(show_spinner=False)
+def _job_worker():
+    def sheets(p):
+        if not save_to_google_sheets(p["data"]): raise RuntimeError("Google Sheets sync failed")
+    def email(p):
+        pdf=get_archive().get(p["visit_id"])
+        if pdf is None: raise RuntimeError(f"visit {p['visit_id']} has no archived report")
+        with tempfile.TemporaryDirectory() as d:
+            path=os.path.join(d,"medical_report.pdf")
+            with open(path,"wb") as f: f.write(pdf)
+            send_email(p["recipient"],p["subject"],p["body"],path)
+    def extract(p):
+        import search
+        conn=get_db()
+        try: search.index_upload(conn,get_archive(),p["visit_id"])
+        finally: conn.close()
+    def reanalyze(p):
+        if findings.reanalyze(get_db) is None: raise RuntimeError("another re-analysis is running")
+    def dedupe(p):
+        import dedupe
+        conn=get_db()
+        try: dedupe.find(conn)
+        finally: conn.close()
+    def repartition(p):
+        import partitions
+        if partitions.move(get_db,log=None) is None: raise RuntimeError("another partition move is running")
+        conn=get_db()
+        try: partitions.maintain(conn); partitions.schedule(conn,partitions.EVERY)
+        finally: conn.close()
+    return shared_store.start_worker(get_db,{"sheets":sheets,"email":email,"extract":extract,
+                                             "reanalyze":reanalyze,"dedupe":dedupe,"partitions":repartition},
+                                     f"{socket.gethostname()}:{os.getpid()}")
+
+@st.cache_resource(show_spinner=False)
+def get_worklist():
+    return triage.Worklist(get_db).start()
+
+@st.cache_resource(show_spinner="Building cohort index…")
+def get_cohorts():
+    import cohort
+    idx=cohort.CohortIndex(get_db); idx.refresh()
+    return idx
+
+@st.cache_resource(show_spinner=False)
+def _jobs_state():
+    return {"started":False}
+
+def start_jobs(queued=False):
+    # the worker thread starts once this process queues a job or finds jobs waiting (scheduled, or another replica's)
+    state=_jobs_state()
+    if state["started"]: return
+    try:
+        if not queued:
+            conn=get_db()
+            try:
+                cur=conn.cursor(); cur.execute("SELECT EXISTS (SELECT 1 FROM jobs WHERE status IN ('pending','running'))")
+                if not cur.fetchone()[0]: return
+            finally: conn.close()
+        _job_worker(); state["started"]=True
+    except Exception as e: st.error(f"Job worker not started: {e}")
+
+def session_key():
+    # kept in the URL, so a reconnect that lands on another replica keeps its IDs and report
+    k=st.query_params.get("s")
+    if not k: k=uuid.uuid4().hex; st.query_params["s"]=k
+    return k
+
+def reserved_ids():
+    conn=get_db()
+    try:
+        rid,pid=shared_store.reserve_ids(conn.cursor(),session_key()); conn.commit()
+        return rid,pid
+    finally: conn.close()
+
+def enqueue_job(kind,payload):
+    conn=get_db()
+    try: shared_store.enqueue(conn,kind,payload)
+    finally: conn.close()
+    start_jobs(queued=True)
+
+def report_pdf_bytes(vid,fp=None):
+    try:
+        pdf=get_archive().get(vid)
+        if pdf is not None or SHARED_STORE: return pdf
+    except Exception:
+        if SHARED_STORE: raise
+    # single-replica fallback while the archive is unreachable
+    if fp and os.path.exists(fp):
+        with open(fp,"rb") as f: return f.read()
+    return None
+
+def restore_report(rid):
+    """Success screen state for a report submitted through another replica."""
+    data=shared_store.get_json(get_store(),f"reports/{rid}.json")
+    if data:
+        st.session_state.report_generated=True
+        st.session_state.report_data=data
+        st.session_state.final_pdf=None
+
 def get_next_patient_id():
     try:
         conn = get_db(); cur = conn.cursor()
@@ -139,6 +293,7 @@ def get_next_report_id():
         n = cur.fetchone()[0]; conn.close(); return n or 1001
     except: return 1001
 
+@metrics.timed("authenticate")
 def authenticate(username, password):
     try:
         conn = get_db(); cur = conn.cursor()
@@ -158,181 +313,58 @@ def register_user(username, password):
         conn.commit(); conn.close(); return True,"Account created!"
     except Exception as e: return False,str(e)
 
-# ── Utilities ──
-def parse_date(d):
-    if not d: return None
-    if isinstance(d, datetime): return d.date()
-    for fmt in ("%Y-%m-%d","%d-%m-%Y","%d/%m/%Y"):
-        try: return datetime.strptime(d,fmt).date()
-        except: pass
-    return None
+# ── PDF (fpdf/PyPDF2 load on first use) ──
+@metrics.timed("create_medical_report")
+def create_medical_report(data,workdir="generated_files"):
+    import report_pdf
+    return report_pdf.create_medical_report(data,os.path.join(workdir,"medical_report.pdf"))
 
-def calculate_bmi(weight, height):
-    try:
-        w,h = float(weight),float(height)
-        return round(w/(h/100)**2,1) if h else None
-    except: return None
-
-def bmi_category(bmi):
-    if bmi is None: return "—","muted"
-    b = float(bmi)
-    if b < 18.5: return "Underweight","warn"
-    if b < 25: return "Normal","ok"
-    if b < 30: return "Overweight","warn"
-    return "Obese","danger"
-
-def analyze_numerical_vitals(data):
-    c = []
-    bmi = data.get('bmi')
-    if bmi:
-        b = float(bmi)
-        if b < 18.5: c.append("The patient is underweight")
-        elif b >= 25 and b < 30: c.append("The patient is overweight")
-        elif b >= 30: c.append("The patient is obese")
-    s,d = data.get('systolic_blood_pressure'),data.get('diastolic_blood_pressure')
-    if s and d:
-        if int(s)<90 or int(d)<60: c.append("The patient has low blood pressure")
-        elif int(s)>120 or int(d)>80: c.append("The patient has high blood pressure")
-    t = data.get('temperature')
-    if t:
-        tv = float(t)
-        if tv<97.8: c.append("The patient has a low body temperature")
-        elif tv>99.1: c.append("The patient has a fever")
-    sp = data.get('o2_level')
-    if sp and float(str(sp).replace('%','').strip())<94:
-        c.append("The patient has low SpO2 (possible hypoxemia)")
-    p = data.get('pulse_rate')
-    if p:
-        pv = float(p)
-        if pv<60: c.append("The patient has bradycardia (low pulse rate)")
-        elif pv>100: c.append("The patient has tachycardia (high pulse rate)")
-    return c
-
-def analyze_subjective_answers(data):
-    c = []
-    hl = data.get('hair_loss','')
-    if hl=="Yes, severe hair loss": c.append("The doctor needs to urgently look at the patient's hair condition.")
-    elif "mild" in hl or "moderate" in hl: c.append("Deeper inspection is required for the patient's hair condition.")
-    nc = data.get('nail_changes','')
-    if nc=="Yes, dark streaks": c.append("The doctor needs to urgently look at the patient's nail condition.")
-    elif nc in ["Yes, white spots","Yes, yellowing"]: c.append("Deeper inspection is required for the patient's nail condition.")
-    uc = data.get('urine_color','')
-    if "Brownish" in uc: c.append("The doctor needs to urgently look at the patient's urinary condition.")
-    elif uc=="Dark yellow": c.append("Urinary condition may depict an underlying symptom.")
-    oh = data.get('oral_health','')
-    if oh in ["Bleeding gums","Frequent mouth ulcers"]: c.append("The doctor needs to urgently look at the patient's mouth condition.")
-    elif oh in ["Bad breath","Tooth pain or sensitivity"]: c.append("Mouth condition may depict an underlying symptom.")
-    return c
-
-# ── PDF ──
-class PDF(FPDF):
-    def header(self):
-        self.set_draw_color(0,0,0); self.rect(5,5,200,287)
-        if os.path.exists("assets/kgp_logo.png"): self.image("assets/kgp_logo.png",10,8,25)
-        self.set_font('Times','B',16); self.set_xy(0,10)
-        self.cell(0,10,"Indian Institute of Technology Kharagpur",0,1,'C')
-        self.set_font('Times','B',14)
-        self.cell(0,10,"Solar-Powered Mobile Health Measurement Device",0,1,'C'); self.ln(8)
-    def footer(self):
-        self.set_y(-20); self.set_font('Times','I',10)
-        self.cell(0,10,'~ End of Report ~',0,0,'C')
-    def patient_info(self,l,r):
-        self.set_font('Times','',10); iy=self.get_y()
-        self.multi_cell(95,7,"\n".join(f"{k}: {v}" for k,v in l.items()),0,'L')
-        self.set_y(iy); self.set_x(105)
-        self.multi_cell(95,7,"\n".join(f"{k}: {v}" for k,v in r.items()),0,'L')
-        self.line(10,self.get_y(),200,self.get_y()); self.ln(6)
-    def add_dates(self,l,r):
-        self.set_font('Times','',10); iy=self.get_y()
-        self.multi_cell(95,7,"\n".join(f"{k}: {v}" for k,v in l.items()),0,'L')
-        self.set_y(iy); self.set_x(105)
-        self.multi_cell(95,7,"\n".join(f"{k}: {v}" for k,v in r.items()),0,'L')
-        self.ln(6); self.line(10,self.get_y(),200,self.get_y())
-    def chapter_title(self,t):
-        self.set_font('Times','B',12); self.cell(0,8,t,0,1,'L'); self.ln(4)
-    def test_table_1(self,rows):
-        self.set_font('Times','B',10); cw=[60,40,50,40]
-        for i,h in enumerate(['VITALS','RESULT','REF. RANGE','UNIT']): self.cell(cw[i],7,h,1,0,'C')
-        self.ln(); self.set_font('Times','',9)
-        for r in rows:
-            self.cell(cw[0],7,r['description'],1); self.cell(cw[1],7,str(r.get('result','')),1)
-            self.cell(cw[2],7,r.get('range',''),1); self.cell(cw[3],7,r.get('unit',''),1); self.ln()
-    def test_table_2(self,rows):
-        self.set_font('Times','B',10); cw=[20,120,50]
-        for i,h in enumerate(['Sl.No','QUESTIONS','RESPONSE']): self.cell(cw[i],7,h,1,0,'C')
-        self.ln(); self.set_font('Times','',9)
-        for i,r in enumerate(rows):
-            self.cell(cw[0],7,str(i+1)+'.',1,align='C')
-            self.cell(cw[1],7,r.get('description',''),1); self.cell(cw[2],7,str(r.get('result','')),1); self.ln()
-    def add_comments(self,text):
-        self.set_font('Times','B',12); self.cell(0,10,'Comments:',0,1)
-        self.set_font('Times','',11); self.multi_cell(0,6,text)
-
-def create_medical_report(data):
-    os.makedirs("generated_files",exist_ok=True)
-    pdf=PDF(); pdf.add_page()
-    pdf.add_dates({'Collection Date':data.get('collection_date','')},{'Report Date':data.get('report_date','')})
-    pdf.patient_info(
-        {'Name':data.get('patient_name',''),'Age':data.get('patient_age',''),
-         'Gender':data.get('patient_gender',''),'Referred By':data.get('patient_referee','')},
-        {'Contact':data.get('patient_phone',''),'Patient ID':str(data.get('patient_ID','')),
-         'Report ID':str(data.get('report_ID',''))})
-    pdf.chapter_title('Body Vitals')
-    bmi=data.get('bmi') or calculate_bmi(data.get('weight'),data.get('height'))
-    data['bmi']=bmi
-    pdf.test_table_1([
-        {'description':'Weight','result':f"{data.get('weight','')} kg",'range':'-','unit':'kg'},
-        {'description':'Height','result':f"{data.get('height','')} cm",'range':'-','unit':'cm'},
-        {'description':'BMI','result':bmi or '','range':'18.5-24.9','unit':'kg/m²'},
-        {'description':'SpO2','result':data.get('o2_level',''),'range':'94-100%','unit':'%'},
-        {'description':'Temperature','result':f"{data.get('temperature','')}°F",'range':'97.8-99.1','unit':'°F'},
-        {'description':'Pulse Rate','result':f"{data.get('pulse_rate','')} bpm",'range':'60-100','unit':'bpm'},
-        {'description':'Systolic BP','result':data.get('systolic_blood_pressure',''),'range':'90-140','unit':'mmHg'},
-        {'description':'Diastolic BP','result':data.get('diastolic_blood_pressure',''),'range':'60-140','unit':'mmHg'},
-        {'description':'Hemoglobin','result':f"{data.get('hemoglobin_level','')} g/dL",'range':'12.0-15.5','unit':'g/dL'},
-    ])
-    pdf.chapter_title('General Health Questions')
-    pdf.test_table_2([
-        {'description':"Can you see clearly without glasses?",'result':data.get('vision','')},
-        {'description':"Do you experience difficulty in breathing?",'result':data.get('breathing','')},
-        {'description':"Do you have any difficulty in hearing?",'result':data.get('hearing','')},
-        {'description':"Do you have any visible skin conditions?",'result':data.get('skin_condition','')},
-        {'description':"Do you experience any mouth conditions?",'result':data.get('oral_health','')},
-        {'description':"What is your usual urine colour?",'result':data.get('urine_color','')},
-        {'description':"Have you noticed significant hair loss recently?",'result':data.get('hair_loss','')},
-        {'description':"Have you noticed any unusual changes in your nail colour?",'result':data.get('nail_changes','')},
-        {'description':"Have you been diagnosed with or noticed signs of cataract?",'result':data.get('cataract','')},
-        {'description':"Do you have any physical disabilities?",'result':data.get('disabilities','')},
-    ])
-    all_c = analyze_numerical_vitals(data)+analyze_subjective_answers(data)
-    if all_c: pdf.add_comments(". ".join(all_c)+".")
-    out="generated_files/medical_report.pdf"; pdf.output(out); return out
+@metrics.timed("merge_pdf")
+def merge_pdf(report_path,upload_bytes,workdir="generated_files"):
+    import report_pdf
+    return report_pdf.merge_pdf(report_path,upload_bytes,os.path.join(workdir,"uploaded.pdf"),
+                                os.path.join(workdir,"merged_report.pdf"))
 
+@metrics.timed("save_response")
 def save_response(data):
     conn=None
     try:
         conn=get_db(); cur=conn.cursor()
-        pid=get_next_patient_id(); rid=get_next_report_id()
-        cols=["patient_id","report_id","collection_date","report_date","patient_name",
-              "patient_age","patient_gender","patient_referee","patient_phone","weight","height",
-              "bmi","pulse_rate","systolic_blood_pressure","diastolic_blood_pressure","o2_level",
-              "temperature","vision","breathing","hearing","skin_condition","oral_health",
-              "urine_color","hair_loss","nail_changes","cataract","disabilities","hemoglobin_level"]
+        rs=rules.current()
+        if findings.ensure(conn,rs): enqueue_job("reanalyze",{"digest":rs.digest})  # rules changed
+        if SHARED_STORE: rid,pid=shared_store.take_ids(cur,session_key())
+        else: pid=None; rid=get_next_report_id()  # patient ids come from patient_id_seq
+        # a returning patient (same phone and name) keeps their patient_id; see migrations/012
+        cur.execute("SELECT patient_upsert(%s,%s,answer_code('patient_gender',%s),%s)",
+                    (data.get('patient_phone'),data.get('patient_name'),data.get('patient_gender'),pid))
+        pid=cur.fetchone()[0]
+        cols=["patient_id","report_id","collection_date","report_date","patient_age","patient_referee",
+              "weight","height","bmi","pulse_rate","systolic_blood_pressure","diastolic_blood_pressure",
+              "o2_level","temperature","disabilities","hemoglobin_level"]
+        answers=["vision","breathing","hearing","skin_condition","oral_health","urine_color","hair_loss",
+                 "nail_changes","cataract"]
         vals=[pid,rid]
         for c in cols[2:]:
             if c in ("collection_date","report_date"): vals.append(parse_date(data.get(c)))
             else: vals.append(data.get(c))
+        vals+=[data.get(a) for a in answers]
         data['patient_ID']=pid; data['report_ID']=rid
-        sql=f"INSERT INTO responses ({', '.join(cols)}) VALUES ({', '.join(['%s']*len(cols))})"
-        cur.execute(sql,tuple(vals)); conn.commit()
+        marks=['%s']*len(cols)+[f"answer_code('{a}',%s)" for a in answers]
+        sql=f"INSERT INTO visits ({', '.join(cols+[a+'_code' for a in answers])}) VALUES ({', '.join(marks)}) RETURNING id"
+        cur.execute(sql,tuple(vals)); vid=cur.fetchone()[0]
+        found=rs.evaluate(data); findings.store(cur,vid,rs,found)
+        triage.push(cur,vid,found,data.get('patient_name'))
+        data['baseline_comments']=baseline.observe(cur,vid,data); conn.commit()
+        data['visit_ID']=vid
     except Exception as e:
         if conn: conn.rollback(); raise
     finally:
         if conn: conn.close()
 
+@metrics.timed("save_to_google_sheets")
 def save_to_google_sheets(data):
-    if not sheet: return False
     try:
+        sheet=get_sheet()
         records=sheet.get_all_records()
         if not records: sheet.append_row(list(data.keys())); records=[]
         headers=list(records[0].keys()) if records else list(data.keys())
@@ -340,7 +372,10 @@ def save_to_google_sheets(data):
         sheet.append_row(row); return True
     except: return False
 
+@metrics.timed("send_email")
 def send_email(recipient,subject,body,attachment_path,fname="medical_report.pdf"):
+    import smtplib
+    from email.message import EmailMessage
     msg=EmailMessage(); msg["Subject"]=subject; msg["From"]=SMTP_USER; msg["To"]=recipient
     msg.set_content(body)
     with open(attachment_path,"rb") as f:
@@ -350,8 +385,11 @@ def send_email(recipient,subject,body,attachment_path,fname="medical_report.pdf"
 
 def full_reset():
     auth=st.session_state.get('authenticated',False)
+    user=st.session_state.get('username')
     st.session_state.clear()
+    if "report" in st.query_params: del st.query_params["report"]
     st.session_state.authenticated=auth
+    st.session_state.username=user
     st.session_state.current_page="generate_report"
 
 # ── LOGIN PAGE ──
@@ -369,7 +407,7 @@ def login_page():
     _,col,_ = st.columns([1,1.3,1])
     with col:
         st.markdown("<div style='height:1.25rem'></div>",unsafe_allow_html=True)
-        tab = st.radio("",["Sign In","Create Account"],horizontal=True,label_visibility="collapsed")
+        tab = st.radio("Account",["Sign In","Create Account"],horizontal=True,label_visibility="collapsed")
 
         if tab=="Sign In":
             with st.form("login_form"):
@@ -380,6 +418,7 @@ def login_page():
                 if st.form_submit_button("Sign In →",type="primary",use_container_width=True):
                     if authenticate(u,p):
                         st.session_state.authenticated=True
+                        st.session_state.username=u
                         st.session_state.current_page="generate_report"
                         st.balloons(); st.rerun()
                     else:
@@ -419,6 +458,16 @@ def render_sidebar(data_snapshot=None):
             full_reset(); st.rerun()
         if st.button("↺  Refresh",use_container_width=True,type="secondary"):
             st.rerun()
+        if st.button("🗂  Report History",use_container_width=True,type="secondary"):
+            st.session_state.current_page="history"; st.rerun()
+        if st.button("🔎  Search",use_container_width=True,type="secondary"):
+            st.session_state.current_page="search"; st.rerun()
+        if st.button("🚨  Triage",use_container_width=True,type="secondary"):
+            st.session_state.current_page="triage"; st.rerun()
+        if st.button("👥  Cohorts",use_container_width=True,type="secondary"):
+            st.session_state.current_page="cohorts"; st.rerun()
+        if st.button("🧬  Duplicates",use_container_width=True,type="secondary"):
+            st.session_state.current_page="duplicates"; st.rerun()
         st.markdown("---")
         if data_snapshot:
             bmi=data_snapshot.get('bmi'); cat,_=bmi_category(bmi)
@@ -436,6 +485,13 @@ def render_sidebar(data_snapshot=None):
                     <span style="color:#8fa8c8;font-size:.75rem;">SpO₂</span>
                     <span style="color:#0fd9a0;font-weight:700;font-size:.9rem;">{spo2}%</span></div>
             </div>""",unsafe_allow_html=True)
+        if is_admin():
+            st.markdown("---")
+            st.markdown("<p style='color:#8fa8c8 !important;font-size:.7rem;font-weight:600;letter-spacing:.8px;text-transform:uppercase;'>Admin</p>",unsafe_allow_html=True)
+            if st.button("🔬  Profile Next Submit",use_container_width=True,type="secondary"):
+                profiling.arm_next(); st.toast("The next submitted report will be profiled.")
+            if st.button("📊  Profiles",use_container_width=True,type="secondary"):
+                st.session_state.current_page="profiles"; st.rerun()
         st.markdown("---")
         st.markdown("<p style='color:#8fa8c8 !important;font-size:.7rem;font-weight:600;letter-spacing:.8px;text-transform:uppercase;'>Support</p>",unsafe_allow_html=True)
         st.markdown("<p style='color:#8fa8c8 !important;font-size:.78rem;'>support@iitkharagpur.ac.in</p>",unsafe_allow_html=True)
@@ -443,6 +499,237 @@ def render_sidebar(data_snapshot=None):
         if st.button("🚪  Logout",use_container_width=True,type="secondary"):
             st.session_state.authenticated=False; st.session_state.current_page="login"; st.rerun()
 
+def is_admin():
+    return st.session_state.get('authenticated') and st.session_state.get('username') in ADMIN_USERS
+
+# ── PROFILES (admin) ──
+def profiles_page():
+    render_sidebar()
+    st.markdown("## 🔬 Submission Profiles")
+    state=profiling.status()
+    c1,c2=st.columns([1,1])
+    with c1:
+        every=st.number_input("Profile every Nth submit (0 = off)",min_value=0,step=1,value=state["every"])
+        if every!=state["every"]: profiling.set_every(every)
+    with c2:
+        st.markdown("<div style='height:1.8rem'></div>",unsafe_allow_html=True)
+        if st.button("Profile next submit",disabled=state["next"]): profiling.arm_next(); st.rerun()
+    if state["next"]: st.info("Armed: the next submitted report will be profiled.")
+    res=profiling.results()
+    if not res:
+        st.caption("No profiles captured yet."); return
+    pick=st.selectbox("Report",res,format_func=lambda r:f"Report {r['report_id']} · {r['at']} · {r['wall_s']} s · peak {r['peak_kb']} KB"+(f" · {r['replica']}" if r.get("replica") else ""))
+    if pick["path"]: st.caption(f"Raw profile: {pick['path']} (open with snakeviz or pstats)")
+    else: st.download_button("Download raw profile (snakeviz or pstats)",profiling.raw(pick["report_id"]) or b"",f"{pick['report_id']}.prof")
+    st.markdown("#### Top functions (cumulative time)")
+    st.dataframe(pick["functions"],use_container_width=True,hide_index=True)
+    st.markdown("#### Top allocations")
+    st.dataframe(pick["allocations"],use_container_width=True,hide_index=True)
+
+# ── REPORT HISTORY ──
+def history_pdf(response_id):
+    """Archived PDF for the visit, or a fresh render (archived for next time)."""
+    try:
+        pdf=get_archive().get(response_id)
+        if pdf is not None: return pdf
+    except Exception: pass
+    import history
+    conn=get_db()
+    try: data=history.visit(conn,response_id)
+    finally: conn.close()
+    if data is None: return None
+    with tempfile.TemporaryDirectory(prefix="history_") as d:
+        with open(create_medical_report(data,d),"rb") as f: pdf=f.read()
+    try: get_archive().put(response_id,"report",pdf,"medical_report.pdf")
+    except Exception: pass
+    return pdf
+
+def report_history_page():
+    import history
+    render_sidebar()
+    st.markdown('<p class="page-title">🗂 Report History</p>',unsafe_allow_html=True)
+    st.markdown('<p class="page-subtitle">Past visits, newest first.</p>',unsafe_allow_html=True)
+    conn=get_db()
+    try: refs=history.referees(conn)
+    except Exception: refs=[]
+    finally: conn.close()
+    with st.form("history_filters"):
+        f1,f2,f3,f4,f5=st.columns([1,1,1.6,1,.9])
+        start=f1.date_input("From",value=None)
+        end=f2.date_input("To",value=None)
+        referee=f3.selectbox("Referred By",["All"]+refs)
+        gender=f4.selectbox("Gender",["All","Male","Female","Other"])
+        with f5:
+            st.markdown("<div style='height:1.9rem'></div>",unsafe_allow_html=True)
+            urgent=st.checkbox("Urgent only")
+        if st.form_submit_button("Apply filters",type="primary"):
+            st.session_state.hist_filters=dict(start=start,end=end,urgent=urgent,
+                referee=None if referee=="All" else referee,gender=None if gender=="All" else gender)
+            st.session_state.hist_pages=[None]; st.session_state.pop("hist_pdf",None)
+    filters=st.session_state.setdefault("hist_filters",{})
+    pages=st.session_state.setdefault("hist_pages",[None])  # keyset cursor of each page visited so far
+    conn=get_db()
+    try: rows,nxt=history.page(conn,pages[-1],**filters)
+    finally: conn.close()
+    if not rows:
+        st.info("No reports match these filters."); return
+    cols=[1,2.2,1,1.8,.9,.9,1.3]
+    for c,h in zip(st.columns(cols),["Collected","Patient","Age/Sex","Referred By","Report","Patient ID",""]):
+        c.markdown(f"**{h}**")
+    ready=st.session_state.get("hist_pdf")
+    for r in rows:
+        c=st.columns(cols)
+        c[0].write(r.collection_date.strftime("%d %b %Y"))
+        flag=' <span class="badge badge-red">Urgent</span>' if r.urgent else ""
+        c[1].markdown(f"{html.escape(r.patient_name or '—')}{flag}",unsafe_allow_html=True)
+        c[2].write(f"{r.patient_age if r.patient_age is not None else '—'}/{(r.patient_gender or '—')[:1]}")
+        c[3].write(r.patient_referee or "—")
+        c[4].write(str(r.report_id or "—")); c[5].write(str(r.patient_id or "—"))
+        with c[6]:
+            if ready and ready[0]==r.id:
+                st.download_button("⬇️ Save PDF",data=ready[1],key=f"hist_save_{r.id}",mime="application/pdf",
+                    file_name=f"report_{r.report_id}_{(r.patient_name or 'patient').replace(' ','_')}.pdf")
+            elif r.report_id and st.button("📄 PDF",key=f"hist_pdf_{r.id}"):
+                with st.spinner("Preparing PDF…"):
+                    pdf=history_pdf(r.id)
+                if pdf: st.session_state.hist_pdf=(r.id,pdf); st.rerun()
+                else: st.error("Report not found.")
+    n1,n2,n3=st.columns([1,4,1])
+    if len(pages)>1 and n1.button("← Newer"):
+        pages.pop(); st.session_state.pop("hist_pdf",None); st.rerun()
+    n2.caption(f"Page {len(pages)}")
+    if nxt and n3.button("Older →"):
+        pages.append(nxt); st.session_state.pop("hist_pdf",None); st.rerun()
+
+# ── SEARCH ──
+def search_page():
+    import search
+    render_sidebar()
+    st.markdown('<p class="page-title">🔎 Search Notes & Attachments</p>',unsafe_allow_html=True)
+    st.markdown('<p class="page-subtitle">Words, "exact phrases", -excluded words, or alternatives with <strong>or</strong>.</p>',unsafe_allow_html=True)
+    q=st.text_input("Search",key="search_q",placeholder="e.g. diabetic or \"walking stick\"",label_visibility="collapsed")
+    if not q.strip(): return
+    conn=get_db()
+    try:
+        t0=time.perf_counter(); rows=search.search(conn,q); ms=(time.perf_counter()-t0)*1000
+    finally: conn.close()
+    st.caption(f"{len(rows)} matches in {ms:.0f} ms" + (" (best 50 shown)" if len(rows)==50 else ""))
+    ready=st.session_state.get("hist_pdf")
+    for r in rows:
+        c1,c2=st.columns([5,1.2])
+        with c1:
+            st.markdown(f"**{r.patient_name or '—'}** · {r.collection_date or '—'} · Report {r.report_id or '—'}")
+            if r.note: st.markdown(f"<div style='color:#6b7a99;font-size:.85rem;'>📝 {r.note}</div>",unsafe_allow_html=True)
+            if r.attachment: st.markdown(f"<div style='color:#6b7a99;font-size:.85rem;'>📎 {r.attachment}</div>",unsafe_allow_html=True)
+        with c2:
+            if ready and ready[0]==r.id:
+                st.download_button("⬇️ Save PDF",data=ready[1],key=f"search_save_{r.id}",mime="application/pdf",
+                    file_name=f"report_{r.report_id}_{(r.patient_name or 'patient').replace(' ','_')}.pdf")
+            elif r.report_id and st.button("📄 PDF",key=f"search_pdf_{r.id}"):
+                with st.spinner("Preparing PDF…"):
+                    pdf=history_pdf(r.id)
+                if pdf: st.session_state.hist_pdf=(r.id,pdf); st.rerun()
+                else: st.error("Report not found.")
+
+# ── TRIAGE ──
+def triage_page():
+    render_sidebar()
+    st.markdown('<p class="page-title">🚨 Triage</p>',unsafe_allow_html=True)
+    st.markdown('<p class="page-subtitle">Visits with urgent findings, highest priority and longest wait first.</p>',unsafe_allow_html=True)
+    triage_list(get_worklist())
+
+@st.fragment(run_every=2)
+def triage_list(wl):
+    # redrawn from the in-memory worklist; the listener thread keeps it current
+    user=st.session_state.get("username")
+    st.caption(f"{wl.count} open" + (" (first 50 shown)" if wl.count>50 else ""))
+    for r in wl.items(50):
+        c1,c2,c3=st.columns([5,1,1])
+        with c1:
+            mins=int(wl.waited(r)//60)
+            wait=f"{mins//60} h {mins%60} min" if mins>=60 else f"{mins} min"
+            who=f" · with {r.claimed_by}" if r.claimed_by else ""
+            st.markdown(f"**{r.patient_name or '—'}** · priority {r.score} · waiting {wait}{who}")
+            st.markdown(f"<div style='color:#6b7a99;font-size:.85rem;'>{html.escape(r.summary)}</div>",unsafe_allow_html=True)
+        if r.claimed_by!=user and c2.button("Take",key=f"tri_claim_{r.response_id}",disabled=bool(r.claimed_by)):
+            conn=get_db()
+            try: triage.claim(conn,r.response_id,user)
+            finally: conn.close()
+        if c3.button("Done",key=f"tri_done_{r.response_id}"):
+            conn=get_db()
+            try: triage.resolve(conn,r.response_id,user)
+            finally: conn.close()
+
+# ── COHORTS ──
+def cohort_page():
+    import cohort
+    render_sidebar()
+    st.markdown('<p class="page-title">👥 Cohorts</p>',unsafe_allow_html=True)
+    st.markdown('<p class="page-subtitle">Pick any answers or ranges: choices in one field are alternatives, fields are combined.</p>',unsafe_allow_html=True)
+    idx=get_cohorts()
+    if time.monotonic()-idx.refreshed>30: idx.refresh()
+    label=lambda c: c.replace("patient_","").replace("_"," ").capitalize()
+    picks={}
+    cols=st.columns(3)
+    for i,c in enumerate([*cohort.ANSWERS,*cohort.TEXT,*cohort.BANDS]):
+        opts=[v for v,n in idx.values(c) if n]
+        picks[c]=cols[i%3].multiselect(label(c),opts,key=f"coh_{c}")
+    excl=st.multiselect("Exclude visits with",[f"{label(c)}: {v}" for c in cohort.ANSWERS for v,n in idx.values(c) if n],key="coh_excl")
+    t0=time.perf_counter()
+    sel=idx.all()
+    for c,vals in picks.items():
+        if not vals: continue
+        if c in cohort.BANDS:
+            labels=[cohort.band_label(cohort.BANDS[c],b) for b in range(len(cohort.BANDS[c])+1)]
+            sel=sel&idx.bands(c,[labels.index(v) for v in vals])
+        else: sel=sel&idx.any(c,*vals)
+    for item in excl:
+        name,v=item.split(": ",1)
+        c=next(c for c in cohort.ANSWERS if label(c)==name)
+        sel=sel&~idx.any(c,v)
+    n=sel.count(); ms=(time.perf_counter()-t0)*1000
+    m1,m2,m3=st.columns(3)
+    m1.metric("Visits",f"{n:,}"); m2.metric("Share",f"{n/idx.n:.2%}" if idx.n else "—")
+    m3.metric("Computed in",f"{ms:.1f} ms")
+    st.caption(f"New visits are added every 30 s. Edits, deletions and merges show after the hourly rebuild (last one {(time.monotonic()-idx.built)/60:.0f} min ago).")
+    by=[(v,(sel&idx.any("patient_referee",v)).count()) for v,_ in idx.values("patient_referee")]
+    by=[(v,k) for v,k in by if k]
+    if by:
+        import pandas as pd
+        st.markdown("**By referee**")
+        st.bar_chart(pd.DataFrame(by,columns=["Referee","Visits"]).set_index("Referee"))
+
+# ── DUPLICATES ──
+def duplicates_page():
+    import dedupe
+    render_sidebar()
+    st.markdown('<p class="page-title">🧬 Duplicates</p>',unsafe_allow_html=True)
+    st.markdown('<p class="page-subtitle">Patients that look like the same person. Merging moves their visits to the oldest record.</p>',unsafe_allow_html=True)
+    user=st.session_state.get("username")
+    if st.button("Find duplicates",type="secondary"):
+        enqueue_job("dedupe",{}); st.info("Search queued; proposals appear here when it finishes.")
+    conn=get_db()
+    try: groups=dedupe.pending(conn,20)
+    finally: conn.close()
+    if not groups: st.caption("No pending proposals."); return
+    for canonical,rows in groups:
+        with st.container(border=True):
+            st.dataframe([{"Patient":r.patient_id,"Match":"kept" if r.score is None else f"{r.score:.2f} · {r.reasons}",
+                           "Date":r.collection_date,"Name":r.patient_name,"Phone":r.patient_phone,"Age":r.patient_age,
+                           "Gender":r.patient_gender,"Referee":r.patient_referee} for r in rows],
+                         hide_index=True,use_container_width=True)
+            c1,c2,_=st.columns([1,1,4])
+            if c1.button("Merge",key=f"dup_merge_{canonical}",type="primary"):
+                conn=get_db()
+                try: n=dedupe.accept(conn,canonical,user)
+                finally: conn.close()
+                st.toast(f"{n} visits moved to patient {canonical}"); st.rerun()
+            if c2.button("Not the same",key=f"dup_reject_{canonical}"):
+                conn=get_db()
+                try: dedupe.reject(conn,canonical,user)
+                finally: conn.close()
+                st.rerun()
+
 # ── SUCCESS SCREEN ──
 def success_screen(data):
     render_sidebar()
@@ -460,13 +747,13 @@ def success_screen(data):
     c4.metric("Pulse",f"{data.get('pulse_rate','—')} bpm")
     st.markdown("---")
     fp=st.session_state.get('final_pdf')
+    pdf=report_pdf_bytes(data.get('visit_ID'),fp)
     col_dl,col_em,col_new=st.columns([2,1.5,1.5])
     with col_dl:
-        if fp and os.path.exists(fp):
-            with open(fp,"rb") as f:
-                st.download_button("⬇️  Download PDF Report",data=f,
-                    file_name=f"report_{data.get('patient_name','patient').replace(' ','_')}.pdf",
-                    mime="application/pdf",type="primary",use_container_width=True)
+        if pdf:
+            st.download_button("⬇️  Download PDF Report",data=pdf,
+                file_name=f"report_{data.get('patient_name','patient').replace(' ','_')}.pdf",
+                mime="application/pdf",type="primary",use_container_width=True)
     with col_em:
         if st.button("📧  Email Report",use_container_width=True,type="secondary"):
             st.session_state.show_email_modal=True
@@ -483,7 +770,10 @@ def success_screen(data):
                 if st.form_submit_button("Send ✉️",type="primary"):
                     if recipient:
                         try:
-                            send_email(recipient,f"Medical Report – {data.get('patient_name','')}",note,fp)
+                            subject=f"Medical Report – {data.get('patient_name','')}"
+                            if SHARED_STORE:
+                                enqueue_job("email",{"recipient":recipient,"subject":subject,"body":note,"visit_id":data.get('visit_ID')})
+                            else: send_email(recipient,subject,note,fp)
                             st.success(f"✅ Report sent to {recipient}")
                             st.session_state.show_email_modal=False
                         except Exception as e: st.error(f"Email failed: {e}")
@@ -492,9 +782,60 @@ def success_screen(data):
                 if st.form_submit_button("Cancel"):
                     st.session_state.show_email_modal=False; st.rerun()
 
+# ── SUBMIT PIPELINE ──
+def process_submission(data,cuff_file,uploaded_pdf,email,prog):
+    """Save, render, merge, sync and mail one submitted report. Returns the local PDF path (None when SHARED_STORE is set: the PDF is only in the archive)."""
+    cuff=None
+    if cuff_file:
+        prog.progress(10,"Estimating blood pressure…")
+        import sensor_store, oscillometry
+        try:
+            cuff=sensor_store.capture_from_bytes(cuff_file.getvalue(),"cuff_pressure")
+            if not oscillometry.apply_to_data(data,cuff.samples,cuff.sample_rate):
+                st.warning("Could not estimate BP from the cuff trace; using manual values.")
+        except Exception as e: st.warning(f"Cuff trace unreadable: {e}")
+    prog.progress(20,"Saving to database…")
+    try: save_response(data)
+    except Exception as e: st.warning(f"DB save failed: {e}")
+    if cuff is not None:
+        try:
+            if SHARED_STORE: sensor_store.put_capture(get_store(),data['report_ID'],"cuff_pressure",cuff.samples,cuff.sample_rate,cuff.start_time)
+            else: sensor_store.attach_capture(data['report_ID'],"cuff_pressure",cuff.samples,cuff.sample_rate,cuff.start_time)
+        except Exception as e: st.warning(f"Could not store cuff trace: {e}")
+    # per-submit scratch directory in multi-replica mode; the result goes to the shared store
+    workdir=tempfile.mkdtemp(prefix="report_") if SHARED_STORE else "generated_files"
+    prog.progress(50,"Generating PDF…")
+    out=create_medical_report(data,workdir)
+    prog.progress(75,"Finalising…")
+    if uploaded_pdf:
+        out=merge_pdf(out,uploaded_pdf.getbuffer(),workdir)
+    if SHARED_STORE:
+        prog.progress(85,"Archiving…")
+        try:
+            archive_report(data.get('visit_ID'),out,uploaded_pdf)
+            shared_store.put_json(get_store(),f"reports/{data['report_ID']}.json",data)
+        finally: shutil.rmtree(workdir,ignore_errors=True)
+        enqueue_job("sheets",{"data":data})
+        if email and SMTP_USER:
+            enqueue_job("email",{"recipient":email,"subject":"Medical Diagnostic Report",
+                                 "body":"Please find your report attached.","visit_id":data['visit_ID']})
+        st.query_params["report"]=str(data['report_ID'])
+        return None
+    prog.progress(85,"Archiving…")
+    try: archive_report(data.get('visit_ID'),out,uploaded_pdf)
+    except Exception as e: st.warning(f"Could not archive the report: {e}")
+    prog.progress(88,"Syncing…")
+    save_to_google_sheets(data)
+    if email and SMTP_USER:
+        try: send_email(email,"Medical Diagnostic Report","Please find your report attached.",out)
+        except: pass
+    return out
+
 # ── MAIN FORM PAGE ──
 def report_generation_page():
     inject_css()
+    if SHARED_STORE and not st.session_state.get('report_generated') and st.query_params.get("report"):
+        restore_report(st.query_params["report"])
     if st.session_state.get('report_generated') and st.session_state.get('report_data'):
         success_screen(st.session_state['report_data']); return
     render_sidebar()
@@ -517,8 +858,9 @@ def report_generation_page():
         d1,d2,d3,d4=st.columns(4)
         with d1: collection_date=st.date_input("Collection Date",value=datetime.now().date())
         with d2: report_date=st.date_input("Report Date",value=datetime.now().date())
-        with d3: report_ID=int(st.number_input("Report ID",0,value=get_next_report_id()))
-        with d4: patient_ID=int(st.number_input("Patient ID",0,value=get_next_patient_id()))
+        next_rid,next_pid=reserved_ids() if SHARED_STORE else (get_next_report_id(),get_next_patient_id())
+        with d3: report_ID=int(st.number_input("Report ID",0,value=next_rid))
+        with d4: patient_ID=int(st.number_input("Patient ID",0,value=next_pid))
 
         st.markdown("<hr style='border-color:#dde3f0;margin:1rem 0 1.25rem;'>",unsafe_allow_html=True)
 
@@ -537,6 +879,7 @@ def report_generation_page():
         with v4:
             o2_level=st.number_input("SpO₂ (%)",0,100,98)
             hemoglobin=st.number_input("Hemoglobin (g/dL)",0.0,30.0,12.5,step=0.1)
+        cuff_file=st.file_uploader("Cuff pressure trace (optional – overrides manual BP)",type=["msc"])
         live_bmi=calculate_bmi(weight,height)
         cat,cls=bmi_category(live_bmi)
         badge_map={"ok":"badge-green","warn":"badge-yellow","danger":"badge-red","muted":"badge-blue"}
@@ -595,27 +938,12 @@ def report_generation_page():
         }
         prog=st.progress(0,"Starting…")
         try:
-            prog.progress(20,"Saving to database…")
-            try: save_response(data)
-            except Exception as e: st.warning(f"DB save failed: {e}")
-            prog.progress(50,"Generating PDF…")
-            out=create_medical_report(data)
-            prog.progress(75,"Finalising…")
-            if uploaded_pdf:
-                merger=PdfMerger(); merger.append(out)
-                up_path="generated_files/uploaded.pdf"
-                os.makedirs("generated_files",exist_ok=True)
-                with open(up_path,"wb") as f: f.write(uploaded_pdf.getbuffer())
-                merger.append(up_path)
-                merged="generated_files/merged_report.pdf"
-                merger.write(merged); merger.close(); out=merged
-            prog.progress(88,"Syncing…")
-            if sheet:
-                try: save_to_google_sheets(data)
-                except: pass
-            if email and SMTP_USER:
-                try: send_email(email,"Medical Diagnostic Report","Please find your report attached.",out)
-                except: pass
+            if profiling.should_profile():
+                with profiling.capture() as cap:
+                    out=process_submission(data,cuff_file,uploaded_pdf,email,prog)
+                cap.save(data['report_ID'])
+            else:
+                out=process_submission(data,cuff_file,uploaded_pdf,email,prog)
             prog.progress(100,"Done!")
             time.sleep(0.3); prog.empty()
             st.session_state.report_generated=True
@@ -629,7 +957,7 @@ def report_generation_page():
 if "authenticated" not in st.session_state: st.session_state.authenticated=False
 if "current_page" not in st.session_state: st.session_state.current_page="login"
 
-inject_css(); init_db()
+inject_css(); start_metrics(); init_db(); start_jobs()
 
 page=st.session_state.current_page
 if page=="login": login_page()
@@ -637,5 +965,29 @@ elif page=="generate_report":
     if not st.session_state.authenticated:
         st.session_state.current_page="login"; st.rerun()
     else: report_generation_page()
+elif page=="history":
+    if not st.session_state.authenticated:
+        st.session_state.current_page="login"; st.rerun()
+    else: report_history_page()
+elif page=="search":
+    if not st.session_state.authenticated:
+        st.session_state.current_page="login"; st.rerun()
+    else: search_page()
+elif page=="triage":
+    if not st.session_state.authenticated:
+        st.session_state.current_page="login"; st.rerun()
+    else: triage_page()
+elif page=="cohorts":
+    if not st.session_state.authenticated:
+        st.session_state.current_page="login"; st.rerun()
+    else: cohort_page()
+elif page=="duplicates":
+    if not st.session_state.authenticated:
+        st.session_state.current_page="login"; st.rerun()
+    else: duplicates_page()
+elif page=="profiles":
+    if not is_admin():
+        st.session_state.current_page="generate_report"; st.rerun()
+    else: profiles_page()
 else:
     st.session_state.current_page="login"; st.rerun()
\ No newline at end of file
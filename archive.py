@@ -0,0 +1,238 @@
+import functools
+import hashlib
+import os
+import sys
+import zlib
+
+import psycopg2
+
+try:
+    import zstandard
+except ImportError:  # optional; blobs are deflate-compressed without it
+    zstandard = None
+
+# -------------------------
+# Report archive (see migrations/005_archive.sql)
+# -------------------------
+# Every delivered report PDF and uploaded attachment is kept, addressed by the
+# SHA-256 of its content: identical files (the same lab PDF attached to many
+# reports, an unchanged re-render) are stored once and reference-counted.
+# Blob bytes go to an object store from shared_store (a directory, or the
+# artifacts table), compressed with zstd when available and deflate otherwise;
+# archive_entries maps a visit (visits.id, migration 020) + role to the blob. Blobs nothing refers to
+# any more are removed by gc() after a grace period.
+
+ARCHIVE_LOCK = 727002  # pg_advisory_xact_lock(ARCHIVE_LOCK, response_id) serializes writes per visit
+MIN_SAVING = 0.05      # keep a blob uncompressed unless compression saves at least this fraction
+
+
+def _key(digest):
+    return f"blobs/{digest[:2]}/{digest}"
+
+
+def compress(data):
+    """(codec, stored bytes) for `data`; 'raw' when compressing does not pay off."""
+    if zstandard is not None:
+        codec, packed = "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    else:
+        codec, packed = "deflate", zlib.compress(data, 6)
+    if len(packed) > len(data) * (1 - MIN_SAVING):
+        return "raw", bytes(data)
+    return codec, packed
+
+
+def decompress(codec, packed):
+    if codec == "raw":
+        return packed
+    if codec == "deflate":
+        return zlib.decompress(packed)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("blob is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(packed)
+    raise ValueError(f"unknown codec {codec!r}")
+
+
+class Archive:
+    """
+    Content-addressed report archive. `store` is a shared_store object store,
+    `connect` returns a new DB-API connection to the database holding the index.
+    """
+
+    def __init__(self, store, connect, cache_size=64):
+        self.store = store
+        self.connect = connect
+        # blobs never change under a hash, so decoded content can be cached freely
+        self._blob = functools.lru_cache(maxsize=cache_size)(self._load)
+
+    def _load(self, digest, codec):
+        packed = self.store.get(_key(digest))
+        if packed is None:
+            raise LookupError(f"archive blob {digest} is missing from the object store")
+        data = decompress(codec, packed)
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"archive blob {digest} is corrupt")
+        return data
+
+    def put(self, response_id, role, data, filename=None):
+        """Archive `data` as the visit's `role` file, replacing any earlier one. Returns the hash."""
+        data = bytes(data)
+        digest = hashlib.sha256(data).hexdigest()
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (ARCHIVE_LOCK, response_id))
+            cur.execute("SELECT hash FROM archive_entries WHERE response_id = %s AND role = %s",
+                        (response_id, role))
+            row = cur.fetchone()
+            old = row[0] if row else None
+            if old == digest:
+                cur.execute("UPDATE archive_entries SET filename = COALESCE(%s, filename) "
+                            "WHERE response_id = %s AND role = %s", (filename, response_id, role))
+                conn.commit()
+                return digest
+            # known content: just take a reference (the row lock keeps gc() off it)
+            cur.execute("UPDATE archive_blobs SET refcount = refcount + 1, released_at = NULL "
+                        "WHERE hash = %s RETURNING hash", (digest,))
+            if cur.fetchone() is None:
+                codec, packed = compress(data)
+                cur.execute("""
+                    INSERT INTO archive_blobs (hash, codec, size, stored_size, refcount)
+                    VALUES (%s, %s, %s, %s, 1)
+                    ON CONFLICT (hash) DO UPDATE SET refcount = archive_blobs.refcount + 1, released_at = NULL
+                    RETURNING (xmax = 0)""", (digest, codec, len(data), len(packed)))
+                if cur.fetchone()[0]:  # inserted here, not by a concurrent put of the same content
+                    self.store.put(_key(digest), packed, "application/octet-stream")
+            cur.execute("""
+                INSERT INTO archive_entries (response_id, role, hash, filename) VALUES (%s, %s, %s, %s)
+                ON CONFLICT (response_id, role) DO UPDATE SET hash = EXCLUDED.hash,
+                    filename = EXCLUDED.filename, created_at = CURRENT_TIMESTAMP""",
+                        (response_id, role, digest, filename))
+            if old:
+                _release(cur, old)
+            conn.commit()
+            return digest
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def get(self, response_id, role="report"):
+        """The archived bytes, or None when the visit has no such file."""
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT b.hash, b.codec FROM archive_entries e JOIN archive_blobs b USING (hash) "
+                        "WHERE e.response_id = %s AND e.role = %s", (response_id, role))
+            row = cur.fetchone()
+        finally:
+            conn.close()
+        return self._blob(*row) if row else None
+
+    def entries(self, response_id):
+        """[(role, filename, size, hash)] archived for a visit."""
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT e.role, e.filename, b.size, e.hash FROM archive_entries e "
+                        "JOIN archive_blobs b USING (hash) WHERE e.response_id = %s ORDER BY e.role",
+                        (response_id,))
+            return cur.fetchall()
+        finally:
+            conn.close()
+
+    def remove(self, response_id, role=None):
+        """Drop a visit's entries (all roles unless given); their blobs become garbage once unreferenced."""
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (ARCHIVE_LOCK, response_id))
+            cur.execute("DELETE FROM archive_entries WHERE response_id = %s AND (%s IS NULL OR role = %s) "
+                        "RETURNING hash", (response_id, role, role))
+            for (digest,) in cur.fetchall():
+                _release(cur, digest)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def gc(self, grace="1 hour", batch=500):
+        """Delete blobs unreferenced for longer than `grace`. Returns (blobs, stored bytes) freed."""
+        freed = stored = 0
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            while True:
+                # rows stay locked until the objects are gone, so a concurrent put of the
+                # same content waits and then re-creates the blob instead of losing it
+                cur.execute("""
+                    SELECT hash, stored_size FROM archive_blobs
+                    WHERE refcount = 0 AND released_at < CURRENT_TIMESTAMP - %s::interval
+                    LIMIT %s FOR UPDATE SKIP LOCKED""", (grace, batch))
+                rows = cur.fetchall()
+                if not rows:
+                    conn.commit()
+                    break
+                for digest, size in rows:
+                    self.store.delete(_key(digest))
+                    stored += size
+                cur.execute("DELETE FROM archive_blobs WHERE hash = ANY(%s)", ([r[0] for r in rows],))
+                conn.commit()
+                freed += len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return freed, stored
+
+
+def _release(cur, digest):
+    cur.execute("UPDATE archive_blobs SET refcount = refcount - 1, "
+                "released_at = CASE WHEN refcount = 1 THEN CURRENT_TIMESTAMP END WHERE hash = %s", (digest,))
+
+
+def stats(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT (SELECT count(*) FROM archive_entries),
+               count(*), COALESCE(sum(size), 0), COALESCE(sum(stored_size), 0),
+               count(*) FILTER (WHERE refcount = 0),
+               (SELECT COALESCE(sum(b.size), 0) FROM archive_entries e JOIN archive_blobs b USING (hash))
+        FROM archive_blobs""")
+    entries, blobs, size, stored, garbage, logical = cur.fetchone()
+    return {"entries": entries, "blobs": blobs, "garbage_blobs": garbage,
+            "logical_bytes": int(logical), "unique_bytes": int(size), "stored_bytes": int(stored)}
+
+
+def check(conn):
+    """Blobs whose refcount disagrees with the entries pointing at them: [(hash, refcount, actual)]."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT b.hash, b.refcount, count(e.hash) FROM archive_blobs b
+        LEFT JOIN archive_entries e USING (hash) GROUP BY b.hash, b.refcount
+        HAVING b.refcount <> count(e.hash)""")
+    return cur.fetchall()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    import shared_store
+    load_dotenv()
+    dsn = os.environ["DATABASE_URL"]
+    spec = os.environ.get("SHARED_STORE") or "dir:generated_files/archive"
+    conn = psycopg2.connect(dsn)
+    args = sys.argv[1:]
+    if "--check" in args:
+        bad = check(conn)
+        print(bad or "refcounts ok")
+        sys.exit(1 if bad else 0)
+    elif "--gc" in args:
+        grace = args[args.index("--gc") + 1] if len(args) > args.index("--gc") + 1 else "1 hour"
+        arc = Archive(shared_store.open_store(spec, lambda: psycopg2.connect(dsn)), lambda: psycopg2.connect(dsn))
+        print("blobs freed: %s, bytes freed: %s" % arc.gc(grace))
+    else:
+        print(stats(conn))
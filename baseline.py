@@ -0,0 +1,231 @@
+import csv
+import hashlib
+import io
+import math
+import os
+import re
+import sys
+import time
+import uuid
+
+import psycopg2
+
+import dbstream
+import rules
+
+# -------------------------
+# Per-patient vital baselines (table in migrations/010_baselines.sql)
+# -------------------------
+# The rule thresholds are the same for everyone; a pulse of 95 is normal in
+# general but not for a patient who has measured 62 at every visit. Each
+# patient keeps Welford's running (count, mean, M2) per vital. On save,
+# a reading more than Z standard deviations from the patient's own mean
+# (after MIN_VISITS earlier readings) becomes a report comment, and the
+# reading is then folded into the baseline: one row read and written.
+#
+# Patients are matched by normalised phone number and name, as patient_id
+# is new for every visit. Visits without both are not tracked.
+#
+#   python baseline.py              patients with a baseline
+#   python baseline.py --backfill   rebuild every baseline from the stored visits
+
+VITALS = ("bmi", "weight", "temperature", "pulse_rate", "systolic_blood_pressure",
+          "diastolic_blood_pressure", "o2_level", "hemoglobin_level")  # append only: stats are stored by position
+LABELS = {"bmi": "BMI", "weight": "Weight", "temperature": "Temperature", "pulse_rate": "Pulse rate",
+          "systolic_blood_pressure": "Systolic pressure", "diastolic_blood_pressure": "Diastolic pressure",
+          "o2_level": "SpO2", "hemoglobin_level": "Hemoglobin"}
+# spread below which a difference is measurement noise, however steady the patient's history
+MIN_SD = {"bmi": 0.5, "weight": 1.5, "temperature": 0.5, "pulse_rate": 5.0, "systolic_blood_pressure": 8.0,
+          "diastolic_blood_pressure": 6.0, "o2_level": 1.5, "hemoglobin_level": 0.5}
+Z = 3.0
+MIN_VISITS = 3
+BATCH = 100_000  # rows per backfill batch
+BACKFILL_LOCK = 727005  # pg_try_advisory_lock key: one backfill at a time
+
+
+def patient_key(phone, name):
+    """UUID identifying a patient by phone (last 10 digits) and name (letters only), or None."""
+    phone = re.sub(r"\D", "", str(phone or ""))[-10:]
+    name = re.sub(r"[^a-z]", "", str(name or "").lower())
+    if len(phone) < 7 or not name:
+        return None
+    return uuid.UUID(bytes=hashlib.md5(f"{phone}:{name}".encode()).digest())
+
+
+def empty():
+    return [0.0] * (3 * len(VITALS))
+
+
+def unusual(stats, data):
+    """Comments for the readings in `data` that are out of line with `stats`."""
+    out = []
+    for i, v in enumerate(VITALS):
+        x = rules.number(data.get(v))
+        n, mean, m2 = stats[3 * i:3 * i + 3]
+        if x is None or n < MIN_VISITS:
+            continue
+        sd = max(math.sqrt(m2 / n), MIN_SD[v])
+        if abs(x - mean) > Z * sd:
+            out.append(f"{LABELS[v]} of {x:g} is unusual for this patient "
+                       f"(usually {mean:.1f} ± {sd:.1f} over {int(n)} visits)")
+    return out
+
+
+def update(stats, data):
+    """Fold the readings in `data` into `stats` (Welford's update, in place)."""
+    for i, v in enumerate(VITALS):
+        x = rules.number(data.get(v))
+        if x is None:
+            continue
+        n, mean, m2 = stats[3 * i:3 * i + 3]
+        n += 1
+        d = x - mean
+        mean += d / n
+        stats[3 * i:3 * i + 3] = n, mean, m2 + d * (x - mean)
+    return stats
+
+
+def observe(cur, response_id, data):
+    """
+    Check a new visit against its patient's baseline and fold it in (in the
+    caller's transaction). Returns the comments for unusual readings.
+    """
+    key = patient_key(data.get("patient_phone"), data.get("patient_name"))
+    if key is None:
+        return []
+    cur.execute("SELECT stats FROM vital_baselines WHERE patient_key = %s FOR UPDATE", (str(key),))
+    row = cur.fetchone()
+    stats = list(row[0]) if row else empty()
+    stats += [0.0] * (3 * len(VITALS) - len(stats))  # vitals added since the row was written
+    flags = unusual(stats, data)
+    cur.execute("INSERT INTO vital_baselines (patient_key, stats, last_response_id) VALUES (%s, %s, %s) "
+                "ON CONFLICT (patient_key) DO UPDATE SET stats = EXCLUDED.stats, "
+                "last_response_id = EXCLUDED.last_response_id, updated_at = CURRENT_TIMESTAMP",
+                (str(key), update(stats, data), response_id))
+    return flags
+
+
+# ── Backfill ──
+def _partial(df):
+    """Per-patient (n, mean, M2) of each vital for one batch, indexed by patient key."""
+    import pandas as pd
+    phone = df["patient_phone"].fillna("").astype(str).str.replace(r"\D", "", regex=True).str[-10:]
+    name = df["patient_name"].fillna("").astype(str).str.lower().str.replace(r"[^a-z]", "", regex=True)
+    ok = (phone.str.len() >= 7) & (name.str.len() > 0)
+    df = df[ok].assign(key=(phone[ok] + ":" + name[ok]).to_numpy())
+    g = df.groupby("key")
+    cols = {"last": g["id"].max()}
+    for v in VITALS:
+        x = pd.to_numeric(df[v], errors="coerce").where(lambda s: s != 0)
+        gx = x.groupby(df["key"])
+        cols[f"n_{v}"] = gx.count().astype(float)
+        cols[f"mean_{v}"] = gx.mean().fillna(0.0)
+        cols[f"m2_{v}"] = (gx.var(ddof=0) * cols[f"n_{v}"]).fillna(0.0)
+    return pd.DataFrame(cols)
+
+
+def _merge(a, b):
+    """Combine two partials (Chan et al.'s parallel variance), vectorized over patients."""
+    import pandas as pd
+    if a is None:
+        return b
+    keys = a.index.union(b.index)
+    a, b = a.reindex(keys, fill_value=0.0), b.reindex(keys, fill_value=0.0)
+    out = {"last": a["last"].combine(b["last"], max)}
+    for v in VITALS:
+        na, nb = a[f"n_{v}"], b[f"n_{v}"]
+        n = na + nb
+        d = b[f"mean_{v}"] - a[f"mean_{v}"]
+        safe = n.where(n > 0, 1.0)
+        out[f"n_{v}"] = n
+        out[f"mean_{v}"] = a[f"mean_{v}"] + d * nb / safe
+        out[f"m2_{v}"] = a[f"m2_{v}"] + b[f"m2_{v}"] + d * d * na * nb / safe
+    return pd.DataFrame(out)
+
+
+def backfill(connect, log=print):
+    """
+    Rebuild every baseline from the stored visits. The history is aggregated
+    in batches without locks; the table is then swapped in one short
+    transaction that also folds in visits saved meanwhile (logged while
+    this runs, migrations/017). Returns patients written, or
+    None when another backfill holds the lock.
+    """
+    import pandas as pd
+    t0 = time.perf_counter()
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (BACKFILL_LOCK,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return None
+        cur.execute("DELETE FROM baseline_backfill_log")
+        cur.execute("INSERT INTO baseline_backfill_running DEFAULT VALUES ON CONFLICT DO NOTHING")
+        conn.commit()
+        # a visit saved by a transaction already under way may not be logged: wait for those
+        # to end, so each visit is either committed before the scan's snapshot or logged
+        cur.execute("SELECT pg_current_snapshot()::text")
+        started = cur.fetchone()[0]
+        conn.commit()
+        while True:
+            cur.execute("SELECT count(*) FROM pg_snapshot_xip(%s::pg_snapshot) x "
+                        "WHERE pg_xact_status(x) = 'in progress'", (started,))
+            busy = cur.fetchone()[0]
+            conn.commit()
+            if not busy:
+                break
+            time.sleep(0.1)
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cur.execute("SELECT pg_current_snapshot()::text")
+        snapshot = cur.fetchone()[0]
+        cols = ["id", "patient_phone", "patient_name", *VITALS]
+        acc, rows = None, 0
+        for batch in dbstream.batches(conn, f"SELECT {', '.join(cols)} FROM responses_compact", size=BATCH):
+            acc = _merge(acc, _partial(pd.DataFrame(batch, columns=cols)))
+            rows += len(batch)
+        conn.commit()
+        if acc is None:
+            acc = _partial(pd.DataFrame([], columns=cols))
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        stats = acc[[f"{s}_{v}" for v in VITALS for s in ("n", "mean", "m2")]].to_numpy()
+        for key, last, s in zip(acc.index, acc["last"].to_numpy(), stats):
+            w.writerow((uuid.UUID(bytes=hashlib.md5(key.encode()).digest()),
+                        "{" + ",".join(f"{x:.7g}" for x in s) + "}", int(last)))
+        buf.seek(0)
+        if log:
+            log(f"{rows} visits -> {len(acc)} patients in {time.perf_counter() - t0:.1f} s")
+        # a visit saved from here on observe()s itself once the lock is released
+        cur.execute("LOCK TABLE vital_baselines IN EXCLUSIVE MODE")
+        cur.execute("TRUNCATE vital_baselines")
+        cur.copy_expert("COPY vital_baselines (patient_key, stats, last_response_id) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute("SELECT id, patient_phone, patient_name, " + ", ".join(VITALS) +
+                    " FROM responses_compact WHERE id IN (SELECT response_id FROM baseline_backfill_log "
+                    "WHERE NOT pg_visible_in_snapshot(xid, %s::pg_snapshot)) ORDER BY id", (snapshot,))
+        late = cur.fetchall()
+        for r in late:
+            observe(cur, r[0], dict(zip(cols, r)))
+        conn.commit()
+        cur.execute("DELETE FROM baseline_backfill_running")
+        cur.execute("DELETE FROM baseline_backfill_log")
+        cur.execute("SELECT pg_advisory_unlock(%s)", (BACKFILL_LOCK,))
+        conn.commit()
+    finally:
+        conn.close()
+    if log:
+        log(f"{len(acc)} baselines written ({len(late)} visits saved meanwhile) in {time.perf_counter() - t0:.1f} s")
+    return len(acc)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    dsn = os.environ["DATABASE_URL"]
+    if "--backfill" in sys.argv[1:]:
+        if backfill(lambda: psycopg2.connect(dsn)) is None:
+            print("another backfill is running")
+    else:
+        cur = psycopg2.connect(dsn).cursor()
+        cur.execute("SELECT count(*), max(updated_at) FROM vital_baselines")
+        print("%s patients, last updated %s" % cur.fetchone())
@@ -0,0 +1,60 @@
+"""Time to first paint of the login page, measured in fresh interpreters.
+
+Each sample starts a new Python process, imports Streamlit's AppTest and runs
+the app script once with throw-away secrets, which renders the login page.
+The database URL points at a closed port so init_db fails fast instead of
+waiting on the network. With real Google credentials the old module-level
+Sheets login would add a network round trip on top of these numbers.
+
+Run from the repository root:
+    python benchmarks/bench_cold_start.py [app_v8.py app_v7.py ...]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES = 5
+
+CHILD = r"""
+import time, sys
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t_st = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=60)
+at.secrets["DATABASE_URL"] = "postgresql://bench@127.0.0.1:1/bench"
+at.secrets["SMTP_HOST"] = "127.0.0.1"
+at.secrets["SMTP_PORT"] = "1"
+at.secrets["SMTP_USER"] = ""
+at.secrets["SMTP_PASS"] = ""
+at.secrets["GOOGLE_SHEET_NAME"] = "bench"
+at.secrets["GOOGLE_SERVICE_ACCOUNT_JSON"] = {"type": "service_account"}
+at.run()
+t1 = time.perf_counter()
+mods = len(sys.modules)
+print(f"RESULT {t_st - t0:.4f} {t1 - t_st:.4f} {mods} {int(bool(at.exception))}")
+"""
+
+
+def sample(app):
+    stdout = subprocess.run([sys.executable, "-c", CHILD, app], cwd=ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    # the app may print on its own; the sample is the tagged line
+    out = next(line for line in stdout.splitlines() if line.startswith("RESULT ")).split()[1:]
+    return float(out[0]), float(out[1]), int(out[2]), out[3] == "1"
+
+
+def main():
+    apps = sys.argv[1:] or ["app_v8.py"]
+    print(f"{'app':<28}{'streamlit import':>18}{'first paint':>14}{'modules':>10}")
+    for app in apps:
+        runs = [sample(app) for _ in range(SAMPLES)]
+        st_imp = statistics.median(r[0] for r in runs)
+        paint = statistics.median(r[1] for r in runs)
+        flag = "  (script raised)" if any(r[3] for r in runs) else ""
+        print(f"{os.path.basename(app):<28}{st_imp * 1e3:>15.0f} ms{paint * 1e3:>11.0f} ms{runs[0][2]:>10}{flag}")
+
+
+if __name__ == "__main__":
+    main()
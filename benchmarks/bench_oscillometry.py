@@ -0,0 +1,36 @@
+"""Accuracy and latency of the oscillometric BP estimator on synthetic cuff traces.
+
+Run from the repository root:  python benchmarks/bench_oscillometry.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import oscillometry  # noqa: E402
+
+CASES = [(100, 65, 95), (110, 70, 50), (120, 80, 72), (140, 90, 60), (170, 100, 80)]
+SEEDS = range(10)
+
+
+def main():
+    errs_s, errs_d, times = [], [], []
+    for systolic, diastolic, hr in CASES:
+        for seed in SEEDS:
+            pressure, fs = oscillometry.synthetic_trace(systolic, diastolic, hr, seed=seed)
+            t0 = time.perf_counter()
+            est = oscillometry.estimate_blood_pressure(pressure, fs)
+            times.append(time.perf_counter() - t0)
+            errs_s.append(est["systolic_blood_pressure"] - systolic)
+            errs_d.append(est["diastolic_blood_pressure"] - diastolic)
+    errs_s, errs_d, times = np.array(errs_s), np.array(errs_d), np.array(times) * 1e3
+    print(f"traces: {times.size}")
+    print(f"systolic  error mean {errs_s.mean():+.2f}  sd {errs_s.std():.2f}  max |{np.abs(errs_s).max()}| mmHg")
+    print(f"diastolic error mean {errs_d.mean():+.2f}  sd {errs_d.std():.2f}  max |{np.abs(errs_d).max()}| mmHg")
+    print(f"latency   p50 {np.percentile(times, 50):.2f} ms  p99 {np.percentile(times, 99):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Partitions of visits read by each Grafana panel query, and its time.
+
+Runs the dashboard queries that read visits (through the responses and
+responses_compact views) on the database in DATABASE_URL, with Grafana's
+$__timeFilter(column) expanded to the given range (default: the last 30
+days), and counts the partitions each one actually scanned:
+    DATABASE_URL=postgresql://... python benchmarks/bench_partitions.py [FROM [TO]]
+"""
+import json
+import os
+import re
+import sys
+import time
+from datetime import date, timedelta
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.bench_responses_schema import grafana_queries  # noqa: E402
+
+READS_VISITS = re.compile(r"\bFROM\s+(responses|responses_compact|visits)\b", re.I)
+
+
+def scanned(plan):
+    """Names of the relations a plan (EXPLAIN ANALYZE JSON) scanned at least once."""
+    found = set()
+    if plan.get("Relation Name") and plan.get("Actual Loops", 0) > 0:
+        found.add(plan["Relation Name"])
+    for sub in plan.get("Plans", []):
+        found |= scanned(sub)
+    return found
+
+
+def main():
+    lo = date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else date.today() - timedelta(days=30)
+    hi = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else date.today()
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    cur = conn.cursor()
+    cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'visits'::regclass")
+    parts = {r[0] for r in cur.fetchall()}
+    if not parts:
+        sys.exit("visits is not partitioned (migration 013 and partitions.py --move)")
+    print(f"{len(parts)} partitions; time filter {lo} .. {hi}")
+    for title, sql in grafana_queries():
+        if not READS_VISITS.search(sql):
+            continue
+        # as Grafana expands the macro for a date column
+        sql = re.sub(r"\$__timeFilter\(([^)]*)\)",
+                     lambda m: f"{m.group(1)} BETWEEN '{lo}T00:00:00Z' AND '{hi}T23:59:59Z'", sql)
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql)
+        used = scanned(cur.fetchone()[0][0]["Plan"]) & parts
+        t0 = time.perf_counter(); cur.execute(sql); cur.fetchall()
+        ms = (time.perf_counter() - t0) * 1e3
+        print(f"  {title:<40}{ms:>10.2f} ms  {len(used):>3} of {len(parts)} partitions  {json.dumps(sorted(used))}")
+    conn.rollback(); conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""End-to-end latency and throughput of the report submit pipeline.
+
+Drives the real save_response, create_medical_report, merge_pdf,
+save_to_google_sheets and send_email from app_v8.py, in the order
+process_submission calls them, against local stand-ins (see standins.py):
+a throw-away Postgres schema with the app's migrations, an in-memory
+worksheet and an SMTP sink on 127.0.0.1. Each stand-in adds a configurable delay per round trip so
+remote services can be approximated.
+
+save_response runs with the real rules, findings, triage and baseline
+modules; jobs it queues are only counted. Runs N submissions at each
+concurrency level on a thread pool (Streamlit serves sessions on threads of
+one process), prints percentiles per stage and writes everything to JSON.
+--compare prints the change against an older file. A stage that fails stops
+the run with its traceback, so no latency of a failing stage is published.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py [-n 40] [--concurrency 1,4]
+        [--db-latency 0.002] [--sheets-latency 0.15] [--smtp-latency 0.02]
+        [--upload-pages 4] [--out FILE] [--compare FILE]
+The database is DATABASE_URL; the bench schema is dropped afterwards.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import baseline  # noqa: E402
+import findings  # noqa: E402
+import metrics  # noqa: E402
+import migrate  # noqa: E402
+import rules  # noqa: E402
+import shared_store  # noqa: E402
+import standins  # noqa: E402
+import triage  # noqa: E402
+from clinical import parse_date, calculate_bmi  # noqa: E402
+
+APP = os.path.join(ROOT, "app_v8.py")
+SCHEMA = "bench_pipeline"
+STAGES = ["save_response", "create_medical_report", "merge_pdf", "save_to_google_sheets", "send_email"]
+FUNCTIONS = STAGES + ["get_next_patient_id", "get_next_report_id"]
+PERCENTILES = (50, 95, 99)
+
+
+def submission(rng, i):
+    w, h = rng.uniform(45, 95), rng.uniform(145, 190)
+    return {
+        "patient_name": f"Patient {i}", "patient_age": rng.randint(18, 85),
+        "patient_gender": rng.choice(["Male", "Female", "Other"]), "patient_phone": f"98{i:08d}",
+        "email": "patient@example.com", "patient_referee": f"Dr. {rng.randint(1, 40)}",
+        "collection_date": "2024-06-01", "report_date": "2024-06-02",
+        "report_ID": 0, "patient_ID": 0,
+        "weight": round(w, 1), "height": round(h, 1), "bmi": calculate_bmi(w, h),
+        "temperature": round(rng.uniform(97, 101), 1), "pulse_rate": rng.randint(55, 110),
+        "systolic_blood_pressure": rng.randint(95, 165), "diastolic_blood_pressure": rng.randint(60, 105),
+        "o2_level": rng.randint(88, 100), "hemoglobin_level": round(rng.uniform(9, 16), 1),
+        "vision": rng.choice(["Clear", "Blurry", "Needs Glasses"]),
+        "breathing": rng.choice(["Normal", "Slight Difficulty", "Labored"]),
+        "hearing": rng.choice(["Normal", "Mild Loss", "Significant Loss"]),
+        "skin_condition": rng.choice(["Clear", "Mild Issues", "Severe Issues"]),
+        "oral_health": rng.choice(["No issues", "Bleeding gums", "Tooth pain or sensitivity"]),
+        "urine_color": rng.choice(["Pale yellow", "Clear", "Dark yellow"]),
+        "hair_loss": rng.choice(["No", "Yes, mild hair loss"]),
+        "nail_changes": rng.choice(["No", "Yes, white spots"]),
+        "cataract": rng.choice(["No", "Yes"]), "disabilities": "",
+    }
+
+
+def upload_pdf(pages):
+    """A text-only PDF standing in for the lab report users attach."""
+    from fpdf import FPDF
+    pdf = FPDF()
+    pdf.set_font("Times", size=10)
+    for p in range(pages):
+        pdf.add_page()
+        for line in range(50):
+            pdf.cell(0, 5, f"Lab result page {p + 1} line {line + 1}: value {line * 1.7:.1f}",
+                     new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+
+class JobQueue:
+    """enqueue_job stand-in: counts the jobs the pipeline queues (no worker runs them)."""
+
+    def __init__(self):
+        self.kinds = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, kind, payload):
+        with self._lock:
+            self.kinds[kind] = self.kinds.get(kind, 0) + 1
+
+
+def build(args):
+    """Bind the app functions to the stand-ins. Returns (functions, sheet, sink, jobs, cleanup)."""
+    dsn = os.environ["DATABASE_URL"]
+    conn = standins.connect_postgres(dsn)
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path TO {SCHEMA}")
+    conn.commit()
+    migrate.apply_migrations(conn._conn, log=None)
+    conn.close()
+
+    def get_db():
+        return standins.connect_postgres(dsn, SCHEMA, args.db_latency)
+
+    def cleanup():
+        c = standins.connect_postgres(dsn)
+        c.cursor().execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        c.commit(); c.close()
+
+    sheet = standins.FakeWorksheet(args.sheets_latency)
+    sink = standins.SMTPSink(args.smtp_latency).start()
+    jobs = JobQueue()
+    env = {"metrics": metrics, "parse_date": parse_date, "get_db": get_db,
+           "get_sheet": lambda: sheet, "SMTP_HOST": "127.0.0.1", "SMTP_PORT": sink.port,
+           "SMTP_USER": "bench@localhost", "SMTP_PASS": "", "SHARED_STORE": None, "os": os,
+           "rules": rules, "findings": findings, "triage": triage, "baseline": baseline,
+           "shared_store": shared_store, "enqueue_job": jobs, "session_key": lambda: "bench"}
+    return standins.load_app_functions(APP, FUNCTIONS, env), sheet, sink, jobs, cleanup
+
+
+def submit(fns, data, upload):
+    """
+    One submission; returns ({stage: seconds}, [(failed stage, traceback)]).
+    PDFs go to a scratch directory per submission, as in SHARED_STORE mode
+    (the shared generated_files/ of single-replica mode is loadtest_app's subject).
+    """
+    times, failed = {}, []
+    out = None
+    scratch = tempfile.mkdtemp(prefix="submit_", dir=".")
+    for stage in STAGES:
+        t0 = time.perf_counter()
+        try:
+            if stage == "save_response":
+                fns[stage](data)
+            elif stage == "create_medical_report":
+                out = fns[stage](data, scratch)
+            elif stage == "merge_pdf":
+                out = fns[stage](out, upload, scratch)
+            elif stage == "save_to_google_sheets":
+                if not fns[stage](data):
+                    failed.append((stage, "returned False"))
+            else:
+                fns[stage](data["email"], "Medical Diagnostic Report", "Please find your report attached.", out)
+        except Exception:
+            failed.append((stage, traceback.format_exc()))
+        times[stage] = time.perf_counter() - t0
+    times["total"] = sum(times.values())
+    shutil.rmtree(scratch, ignore_errors=True)
+    return times, failed
+
+
+def summarize(samples):
+    a = np.asarray(samples) * 1e3
+    out = {f"p{p}_ms": round(float(np.percentile(a, p)), 2) for p in PERCENTILES}
+    out["mean_ms"] = round(float(a.mean()), 2)
+    return out
+
+
+def run_level(fns, concurrency, n, upload, seed):
+    rng = random.Random(seed)
+    batch = [submission(rng, i) for i in range(n)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda d: submit(fns, d, upload), batch))
+    wall = time.perf_counter() - t0
+    errors, first = {}, {}
+    for _, failed in results:
+        for s, tb in failed:
+            errors[s] = errors.get(s, 0) + 1
+            first.setdefault(s, tb)
+    if errors:
+        s = next(iter(first))
+        raise SystemExit(f"concurrency {concurrency}: failed stages {errors} of {n} submissions; "
+                         f"no results written. First {s} failure:\n{first[s]}")
+    ids = [d["report_ID"] for d in batch]
+    return {
+        "concurrency": concurrency, "submissions": n, "wall_s": round(wall, 3),
+        "throughput_per_s": round(n / wall, 2),
+        "stages": {s: summarize([r[0][s] for r in results]) for s in STAGES + ["total"]},
+        "duplicate_report_ids": len(ids) - len(set(ids)),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_level(r):
+    print(f"\nconcurrency {r['concurrency']}: {r['submissions']} submissions in {r['wall_s']} s "
+          f"-> {r['throughput_per_s']}/s"
+          + (f"  duplicate report IDs {r['duplicate_report_ids']}" if r["duplicate_report_ids"] else ""))
+    print(f"  {'stage':<24}" + "".join(f"{'p%d' % p:>10}" for p in PERCENTILES) + f"{'mean':>10}")
+    for stage, s in r["stages"].items():
+        print(f"  {stage:<24}" + "".join(f"{s['p%d_ms' % p]:>7.1f} ms" for p in PERCENTILES)
+              + f"{s['mean_ms']:>7.1f} ms")
+
+
+def compare(result, path):
+    with open(path) as f:
+        old = {r["concurrency"]: r for r in json.load(f)["levels"]}
+    print(f"\nchange against {path}:")
+    for r in result["levels"]:
+        o = old.get(r["concurrency"])
+        if not o:
+            continue
+        tp = (r["throughput_per_s"] / o["throughput_per_s"] - 1) * 100
+        p95 = r["stages"]["total"]["p95_ms"] - o["stages"]["total"]["p95_ms"]
+        print(f"  concurrency {r['concurrency']}: throughput {tp:+.1f}%, total p95 {p95:+.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("-n", type=int, default=40, help="submissions per concurrency level")
+    ap.add_argument("--concurrency", default="1,4")
+    ap.add_argument("--db-latency", type=float, default=0.002, help="seconds per DB round trip")
+    ap.add_argument("--sheets-latency", type=float, default=0.15, help="seconds per Sheets API call")
+    ap.add_argument("--smtp-latency", type=float, default=0.02, help="seconds per SMTP reply")
+    ap.add_argument("--upload-pages", type=int, default=4, help="pages in the attached PDF")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="JSON results path (default benchmarks/results/pipeline-<time>.json)")
+    ap.add_argument("--compare", help="earlier JSON results to compare against")
+    args = ap.parse_args()
+    if not os.environ.get("DATABASE_URL"):
+        sys.exit("bench_pipeline needs Postgres: set DATABASE_URL "
+                 "(save_response writes the migrated schema, which has no SQLite version)")
+
+    metrics.enabled = False
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    shutil.copytree(os.path.join(ROOT, "assets"), os.path.join(workdir, "assets"))
+    fns, sheet, sink, jobs, cleanup = build(args)
+    upload = upload_pdf(args.upload_pages)
+    cwd = os.getcwd()
+    os.chdir(workdir)  # the renderer writes to generated_files/ relative to the cwd
+    try:
+        with standins.plain_smtp():
+            levels = []
+            for c in (int(x) for x in args.concurrency.split(",")):
+                levels.append(run_level(fns, c, args.n, upload, args.seed))
+                print_level(levels[-1])
+    finally:
+        os.chdir(cwd)
+        sink.shutdown()
+        cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "benchmark": "pipeline", "at": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "levels": levels,
+        "standins": {"sheet_calls": sheet.calls, "sheet_rows": len(sheet.rows),
+                     "mails": sink.messages, "mail_bytes": sink.bytes, "jobs_queued": jobs.kinds},
+    }
+    out = args.out or os.path.join(ROOT, "benchmarks", "results",
+                                   time.strftime("pipeline-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nresults written to {out}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Table size and Grafana query time of `responses` before and after the migrations.
+
+Works in a throw-away schema of the database in DATABASE_URL:
+    DATABASE_URL=postgresql://... python benchmarks/bench_responses_schema.py [rows]
+"""
+import os
+import re
+import sys
+import time
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import migrate  # noqa: E402
+import partitions  # noqa: E402
+
+SCHEMA = "bench_responses_schema"
+GRAFANA_SQL = os.path.join(ROOT, "SQL-Queries-for-Grafana-dashboard.txt")
+
+FILL = """
+INSERT INTO responses (patient_id, report_id, collection_date, report_date, patient_name,
+    patient_age, patient_gender, patient_referee, patient_phone, weight, height, bmi,
+    pulse_rate, systolic_blood_pressure, diastolic_blood_pressure, o2_level, temperature,
+    vision, breathing, hearing, skin_condition, oral_health, urine_color, hair_loss,
+    nail_changes, cataract, disabilities, hemoglobin_level)
+SELECT i, 1000 + i, d, d, 'Patient ' || i, 18 + i %% 60,
+    (ARRAY['Male','Female','Other'])[1 + i %% 3], 'Dr. ' || (i %% 40), '98' || lpad((i %% 100000000)::text, 8, '0'),
+    50 + i %% 40, 150 + i %% 35, round((50 + i %% 40) / ((150 + i %% 35) / 100.0) ^ 2, 1),
+    60 + i %% 45, 100 + i %% 50, 60 + i %% 35, 90 + i %% 11, 97 + (i %% 30) / 10.0,
+    (ARRAY['Clear','Blurry','Needs Glasses'])[1 + i %% 3],
+    (ARRAY['Normal','Slight Difficulty','Labored'])[1 + i %% 3],
+    (ARRAY['Normal','Mild Loss','Significant Loss'])[1 + i %% 3],
+    (ARRAY['Clear','Mild Issues','Severe Issues'])[1 + i %% 3],
+    (ARRAY['No issues','Bleeding gums','Bad breath','Frequent mouth ulcers','Tooth pain or sensitivity'])[1 + i %% 5],
+    (ARRAY['Pale yellow','Clear','Dark yellow','Brownish/red (seek medical attention)'])[1 + i %% 4],
+    (ARRAY['No','Yes, mild hair loss','Yes, moderate hair loss','Yes, severe hair loss'])[1 + i %% 4],
+    (ARRAY['No','Yes, white spots','Yes, yellowing','Yes, dark streaks'])[1 + i %% 4],
+    (ARRAY['No','Yes'])[1 + i %% 2], '', 10 + (i %% 60) / 10.0
+FROM generate_series(1, %s) AS i, LATERAL (SELECT DATE '2024-01-01' + (i %% 700)) AS x(d)
+"""
+
+# Panels whose dashboard SQL was rewritten for the migrated schema; the
+# "before" run times the original query instead. Gauge and stat panels used
+# to sort responses for the newest row (see legacy_sql).
+LEGACY_QUERIES = {
+    "Response Counts by Category": """
+        SELECT 'Vision' AS category, vision AS response, COUNT(*) AS count FROM responses GROUP BY vision
+        UNION ALL SELECT 'Hearing', hearing, COUNT(*) FROM responses GROUP BY hearing
+        UNION ALL SELECT 'Skin Condition', skin_condition, COUNT(*) FROM responses GROUP BY skin_condition
+        UNION ALL SELECT 'Oral Health', oral_health, COUNT(*) FROM responses GROUP BY oral_health
+        ORDER BY category, count DESC""",
+    "Age Distribution": "SELECT patient_age AS age, patient_gender AS gender FROM responses",
+    "Visits per Day": "SELECT collection_date AS time, COUNT(*) FROM responses GROUP BY 1 ORDER BY 1",
+    "Visits per Referee": """
+        SELECT patient_referee, COUNT(*) AS visits FROM responses
+        GROUP BY 1 ORDER BY visits DESC LIMIT 20""",
+}
+
+
+def legacy_sql(title, sql):
+    if title in LEGACY_QUERIES:
+        return LEGACY_QUERIES[title]
+    return sql.replace("FROM latest_vitals", "FROM responses ORDER BY collection_date DESC LIMIT 1")
+
+
+def grafana_queries():
+    """(title, sql) for each panel query in the dashboard SQL file."""
+    with open(GRAFANA_SQL, encoding="utf-8") as f:
+        text = f.read()
+    out = []
+    for chunk in text.split(";"):
+        lines = [l.strip() for l in chunk.strip().splitlines()]
+        sql = "\n".join(l for l in lines if l and not l.startswith("--"))
+        if not sql:
+            continue
+        # title = first line of the comment block sitting directly above the SQL
+        head = lines[:next(i for i, l in enumerate(lines) if l and not l.startswith("--"))]
+        block = head[len(head) - head[::-1].index(""):] if "" in head else head
+        titles = [l.lstrip("- ").strip() for l in block if not l.lstrip("- ").startswith("=")]
+        out.append((titles[0] if titles else sql[:30], sql))
+    return out
+
+
+def measure(cur, label, legacy=False, repeat=5):
+    cur.execute("ANALYZE")
+    cur.execute("SELECT sum(pg_total_relation_size(c.oid))::bigint FROM pg_class c "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE n.nspname = %s AND c.relkind = 'r' "
+                "AND (c.relname IN ('responses', 'responses_compact', 'visits', 'patients') OR c.relispartition)",
+                (SCHEMA,))
+    size = cur.fetchone()[0]
+    print(f"\n== {label}: table size {size / 1e6:.1f} MB")
+    for title, sql in grafana_queries():
+        if legacy:
+            sql = legacy_sql(title, sql)
+        sql = re.sub(r"\$__timeFilter\([^)]*\)", "TRUE", sql)  # Grafana macro
+        try:
+            best = float("inf")
+            for _ in range(repeat):
+                t0 = time.perf_counter(); cur.execute(sql); cur.fetchall()
+                best = min(best, time.perf_counter() - t0)
+            print(f"  {title:<40}{best * 1e3:>10.2f} ms")
+        except psycopg2.Error as e:
+            cur.connection.rollback(); cur.execute(f"SET search_path TO {SCHEMA}")
+            print(f"  {title:<40}{'error: ' + e.pgerror.splitlines()[0]:>10}")
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA}")
+    try:
+        migrate.apply_migrations(conn, log=None, target="000_base_schema")
+        cur.execute(FILL, (rows,)); conn.commit()
+        measure(cur, f"before ({rows:,} rows)", legacy=True)
+        applied = migrate.apply_migrations(conn, log=None)
+        partitions.move(lambda: psycopg2.connect(os.environ["DATABASE_URL"], options=f"-c search_path={SCHEMA}"),
+                        log=None)
+        cur.execute("SELECT rollups_refresh()"); conn.commit()
+        measure(cur, f"after {', '.join(applied)}")
+    finally:
+        conn.rollback()
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"); conn.commit(); conn.close()
+
+
+if __name__ == "__main__":
+    main()
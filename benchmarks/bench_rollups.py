@@ -0,0 +1,94 @@
+"""Rollups against a full recompute after inserts, deletes, updates and late commits.
+
+Works in a throw-away schema of the database in DATABASE_URL:
+    DATABASE_URL=postgresql://... python benchmarks/bench_rollups.py [rows] [rounds]
+
+Each round inserts visits through the responses view, deletes some, edits the
+counted columns of others (date, across months too, referee, age, answers,
+patient), changes patients' gender, and commits one insert from a second connection after a refresh has
+already run. Then it refreshes and runs rollups.verify(). Last, the first
+months are archived and verified once more. Exits 1 on any difference.
+"""
+import os
+import sys
+import time
+from datetime import date
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import migrate  # noqa: E402
+import partitions  # noqa: E402
+import rollups  # noqa: E402
+from benchmarks.bench_responses_schema import FILL  # noqa: E402
+
+SCHEMA = "bench_rollups"
+ARCHIVE_BEFORE = date(2024, 4, 1)   # FILL dates start on 2024-01-01
+
+EDITS = [
+    "UPDATE visits SET collection_date = collection_date + 1 WHERE id IN (SELECT id FROM visits ORDER BY random() LIMIT %(k)s)",
+    "UPDATE visits SET collection_date = collection_date + 40 WHERE id IN (SELECT id FROM visits ORDER BY random() LIMIT %(k)s)",
+    "UPDATE visits SET patient_referee = 'Dr. ' || (id %% 7) WHERE id IN (SELECT id FROM visits ORDER BY random() LIMIT %(k)s)",
+    "UPDATE visits SET patient_age = patient_age + 10 WHERE id IN (SELECT id FROM visits ORDER BY random() LIMIT %(k)s)",
+    """UPDATE visits SET vision_code = (SELECT code FROM answer_codes WHERE question = 'vision' ORDER BY random() LIMIT 1),
+                         cataract_code = NULL
+       WHERE id IN (SELECT id FROM visits ORDER BY random() LIMIT %(k)s)""",
+    """UPDATE visits SET patient_id = (SELECT id FROM patients ORDER BY random() LIMIT 1)
+       WHERE id IN (SELECT id FROM visits ORDER BY random() LIMIT %(k)s)""",
+    "UPDATE visits SET weight = weight + 1 WHERE id IN (SELECT id FROM visits ORDER BY random() LIMIT %(k)s)",
+    "DELETE FROM responses WHERE id IN (SELECT id FROM visits ORDER BY random() LIMIT %(k)s)",
+    # changes no visit: past visits keep the gender they were recorded with
+    """UPDATE patients SET gender_code = (SELECT code FROM answer_codes WHERE question = 'patient_gender'
+                                         ORDER BY random() LIMIT 1)
+       WHERE id IN (SELECT patient_id FROM visits ORDER BY random() LIMIT %(k)s)""",
+]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    connect = lambda: psycopg2.connect(os.environ["DATABASE_URL"], options=f"-c search_path={SCHEMA}")  # noqa: E731
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    conn.cursor().execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    conn.commit(); conn.close()
+    conn, late = connect(), connect()
+    cur = conn.cursor()
+    failed = False
+    try:
+        migrate.apply_migrations(conn, log=None, target="000_base_schema")
+        cur.execute(FILL, (rows,)); conn.commit()
+        migrate.apply_migrations(conn, log=None)
+        partitions.move(connect, log=None)
+        print(f"{rows:,} visits; verify after migration: {rollups.verify(conn)}")
+        k = max(rows // 1000, 1)
+        for r in range(rounds):
+            cur.execute(FILL, (k,))
+            for sql in EDITS:
+                cur.execute(sql, {"k": k})
+            conn.commit()
+            # begun before the refresh, committed after it
+            late.cursor().execute(FILL, (1,))
+            t0 = time.perf_counter()
+            n, _ = rollups.refresh(conn)
+            ms = (time.perf_counter() - t0) * 1e3
+            late.commit()
+            n_late, _ = rollups.refresh(conn)
+            diffs = rollups.verify(conn)
+            failed |= any(diffs.values())
+            print(f"  round {r + 1}: {n} changes folded in {ms:.1f} ms, then {n_late} committed late; "
+                  f"differences {diffs}")
+        # detached months stay counted in the rollups
+        archived = partitions.archive(conn, ARCHIVE_BEFORE)
+        diffs = rollups.verify(conn)
+        failed |= any(diffs.values())
+        print(f"  archived {len(archived)} months; differences {diffs}")
+    finally:
+        late.close()
+        conn.rollback()
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"); conn.commit(); conn.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Bytes per visit and load time: binary sensor captures vs CSV.
+
+Run from the repository root:  python benchmarks/bench_sensor_store.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sensor_store  # noqa: E402
+
+VISITS = 50
+# channel -> (sample rate Hz, seconds recorded)
+CHANNELS = {"ppg": (100.0, 60), "cuff_pressure": (100.0, 40), "temperature": (1.0, 60)}
+
+
+def synthetic_visit(rng):
+    out = {}
+    for ch, (fs, secs) in CHANNELS.items():
+        t = np.arange(int(fs * secs)) / fs
+        if ch == "ppg":
+            x = 2000 + 400 * np.sin(2 * np.pi * 1.2 * t) + rng.normal(0, 20, t.size)
+        elif ch == "cuff_pressure":
+            x = np.linspace(180, 40, t.size) + 2 * np.sin(2 * np.pi * 1.2 * t)
+        else:
+            x = 98.4 + rng.normal(0, 0.05, t.size)
+        out[ch] = (x, fs)
+    return out
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    rng = np.random.default_rng(0)
+    visits = [synthetic_visit(rng) for _ in range(VISITS)]
+    with tempfile.TemporaryDirectory() as root:
+        bin_root = os.path.join(root, "bin"); csv_root = os.path.join(root, "csv")
+        os.makedirs(csv_root)
+        for rid, visit in enumerate(visits, start=1001):
+            for ch, (x, fs) in visit.items():
+                sensor_store.attach_capture(rid, ch, x, fs, root=bin_root)
+                pd.DataFrame({"t": np.arange(x.size) / fs, ch: x}).to_csv(
+                    os.path.join(csv_root, f"{rid}_{ch}.csv"), index=False)
+
+        def size(folder):
+            return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(folder) for f in fs)
+
+        def load_bin():
+            for rid in range(1001, 1001 + VISITS):
+                for cap in sensor_store.load_visit(rid, root=bin_root).values():
+                    cap.samples.sum()
+
+        def load_csv():
+            for rid in range(1001, 1001 + VISITS):
+                for ch in CHANNELS:
+                    pd.read_csv(os.path.join(csv_root, f"{rid}_{ch}.csv"))[ch].to_numpy().sum()
+
+        bin_bytes, csv_bytes = size(bin_root) / VISITS, size(csv_root) / VISITS
+        t_bin, t_csv = timed(load_bin) / VISITS, timed(load_csv) / VISITS
+        print(f"{'format':<8}{'bytes/visit':>14}{'load ms/visit':>16}")
+        print(f"{'binary':<8}{bin_bytes:>14,.0f}{t_bin * 1e3:>16.3f}")
+        print(f"{'csv':<8}{csv_bytes:>14,.0f}{t_csv * 1e3:>16.3f}")
+        print(f"binary is {csv_bytes / bin_bytes:.1f}x smaller and {t_csv / t_bin:.1f}x faster to load")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Concurrent multi-operator load test of app_v8 through Streamlit's AppTest.
+
+Each simulated operator is an AppTest session in its own process (AppTest
+swaps process-wide state such as the Runtime singleton and st.secrets on
+every run, so sessions cannot share an interpreter). The processes share the
+working directory and the database, as sessions of one server, or several
+server replicas, do. A session opens the app, signs in, then repeatedly fills in the
+form, submits it and starts a new report. Per step it records latency,
+exceptions, st.error and st.warning messages. After the run it checks for
+the concurrency hazards of the current code:
+
+    ID collisions   two submissions given the same report or patient ID
+                    (IDs come from MAX()+1), in the session state and in the DB
+    clobbered PDFs  the PDF a session is offered does not carry its own patient,
+                    because sessions share the generated_files/*.pdf paths
+
+Needs a Postgres in DATABASE_URL (a throw-away schema is created and dropped).
+Google Sheets is served by an in-memory worksheet and mail by a local SMTP
+sink, each with a configurable delay so blocking calls show up in the
+submit latency.
+
+Run from the repository root:
+    DATABASE_URL=postgresql://... python benchmarks/loadtest_app.py
+        [--sessions 4] [--iterations 3] [--sheets-latency 0.15] [--smtp-latency 0.05]
+        [--sslmode disable] [--shared-store postgres|dir:PATH] [--out FILE]
+"""
+import argparse
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import multiprocessing as mp
+import time
+from collections import Counter
+
+import bcrypt
+import numpy as np
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import migrate  # noqa: E402
+import standins  # noqa: E402
+
+APP = os.path.join(ROOT, "app_v8.py")
+SCHEMA = "loadtest_app"
+PASSWORD = "loadtest"
+SUBMIT = "🚀  Generate Medical Report"
+PERCENTILES = (50, 95, 99)
+
+
+def with_search_path(dsn, schema):
+    sep = "&" if "?" in dsn else "?"
+    return f"{dsn}{sep}options=-csearch_path%3D{schema}"
+
+
+def setup_db(dsn, users):
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA}")
+    cur.execute("""CREATE TABLE users (
+        id SERIAL PRIMARY KEY, username VARCHAR(50) UNIQUE NOT NULL,
+        password VARCHAR(255) NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt()).decode()
+    cur.executemany("INSERT INTO users (username, password) VALUES (%s, %s)", [(u, hashed) for u in users])
+    conn.commit()
+    migrate.apply_migrations(conn, log=None)
+    conn.close()
+
+
+def db_collisions(dsn):
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute(f"SET search_path TO {SCHEMA}")
+    out = {}
+    for col in ("report_id", "patient_id"):
+        cur.execute(f"SELECT count(*) FROM (SELECT {col} FROM responses GROUP BY 1 HAVING count(*) > 1) d")
+        out[col] = cur.fetchone()[0]
+    cur.execute("SELECT count(*) FROM responses")
+    out["rows"] = cur.fetchone()[0]
+    cur.execute("SELECT status, count(*) FROM jobs GROUP BY 1")  # multi-replica mode only
+    out["jobs"] = dict(cur.fetchall())
+    conn.close()
+    return out
+
+
+def _labelled(widgets, label):
+    for w in widgets:
+        if w.label == label:
+            return w
+    raise LookupError(f"no widget labelled {label!r}")
+
+
+def _pdf_text(path, visit_id, arc):
+    import io
+    from PyPDF2 import PdfReader
+    src = io.BytesIO(arc.get(visit_id)) if arc else path  # only archived in multi-replica mode
+    return PdfReader(src).pages[0].extract_text()
+
+
+class Session:
+    def __init__(self, n, user, secrets, iterations, archive=None):
+        self.n, self.user, self.secrets, self.iterations = n, user, secrets, iterations
+        self.archive = archive
+        self.steps = []        # (step, seconds, [problems])
+        self.submissions = []  # dicts, one per submit
+
+    def _step(self, name, at):
+        t0 = time.perf_counter()
+        try:
+            at.run()
+            problems = [str(e.value) for e in at.exception]
+        except Exception as e:  # AppTest timeout or a crash in the harness
+            problems = [f"{type(e).__name__}: {e}"]
+        dt = time.perf_counter() - t0
+        problems += [e.value for e in at.error] + [w.value for w in at.warning]
+        self.steps.append((name, dt, problems))
+        return not problems
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+        at = AppTest.from_file(APP, default_timeout=300)
+        for k, v in self.secrets.items():
+            at.secrets[k] = v
+        if not self._step("open", at):
+            return self
+        _labelled(at.text_input, "Username").input(self.user)
+        _labelled(at.text_input, "Password").input(PASSWORD)
+        _labelled(at.button, "Sign In →").click()
+        self._step("login", at)
+        if not at.session_state["authenticated"]:
+            return self
+        for i in range(self.iterations):
+            name = f"Loadtest S{self.n:03d} V{i:03d}"
+            try:
+                _labelled(at.text_input, "Full Name *").input(name)
+                _labelled(at.text_input, "Email (for delivery)").input(f"s{self.n}@loadtest.local")
+                _labelled(at.button, SUBMIT).click()
+            except LookupError as e:  # the previous run died before the form rendered
+                self.steps.append(("submit", 0.0, [str(e)]))
+                break
+            ok = self._step("submit", at)
+            if ok and "report_data" in at.session_state:
+                data, path = at.session_state["report_data"], at.session_state["final_pdf"]
+                try:
+                    own = name in _pdf_text(path, data.get("visit_ID"), self.archive)
+                except Exception:
+                    own = False
+                self.submissions.append({"session": self.n, "patient": name, "path": path,
+                                         "report_id": data.get("report_ID"),
+                                         "patient_id": data.get("patient_ID"), "own_pdf": own})
+            try:
+                _labelled(at.button, "＋  New Report").click()
+            except LookupError as e:
+                self.steps.append(("new_report", 0.0, [str(e)]))
+                break
+            self._step("new_report", at)
+        return self
+
+
+def operate(n, user, secrets, iterations, sheets_latency, workdir, start):
+    """Process entry point: one session. Returns (steps, submissions, sheet rows)."""
+    importlib.import_module("streamlit.testing.v1")  # import cost stays out of "open"
+    os.chdir(workdir)  # the app writes generated_files/ relative to the cwd
+    sheet = standins.FakeWorksheet(sheets_latency)
+    arc = None
+    if secrets.get("SHARED_STORE"):
+        import archive, shared_store
+        connect = lambda: psycopg2.connect(secrets["DATABASE_URL"])  # noqa: E731
+        arc = archive.Archive(shared_store.open_store(secrets["SHARED_STORE"], connect), connect)
+    start.wait()
+    with standins.fake_google_sheets(sheet), standins.plain_smtp():
+        s = Session(n, user, secrets, iterations, arc).run()
+    return s.steps, s.submissions, len(sheet.rows)
+
+
+def summarize(steps):
+    out = {}
+    for name in dict.fromkeys(s[0] for s in steps):
+        rows = [s for s in steps if s[0] == name]
+        a = np.array([s[1] for s in rows]) * 1e3
+        errs = [p for s in rows for p in s[2]]
+        out[name] = {"count": len(rows), **{f"p{p}_ms": round(float(np.percentile(a, p)), 1) for p in PERCENTILES},
+                     "error_rate": round(sum(1 for s in rows if s[2]) / len(rows), 3),
+                     "errors": dict(Counter(errs).most_common(5))}
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--sessions", type=int, default=4)
+    ap.add_argument("--iterations", type=int, default=3, help="reports per session")
+    ap.add_argument("--sheets-latency", type=float, default=0.15)
+    ap.add_argument("--smtp-latency", type=float, default=0.05)
+    ap.add_argument("--sslmode", default="disable", help="DB_SSLMODE passed to the app")
+    ap.add_argument("--shared-store", help="run the app in multi-replica mode (SHARED_STORE value)")
+    ap.add_argument("--out", help="JSON results path (default benchmarks/results/loadtest-<time>.json)")
+    args = ap.parse_args()
+
+    dsn = os.environ["DATABASE_URL"]
+    users = [f"operator{i}" for i in range(args.sessions)]
+    setup_db(dsn, users)
+    sink = standins.SMTPSink(args.smtp_latency).start()
+    secrets = {"DATABASE_URL": with_search_path(dsn, SCHEMA), "DB_SSLMODE": args.sslmode,
+               "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(sink.port), "SMTP_USER": "loadtest@localhost",
+               "SMTP_PASS": "", "GOOGLE_SHEET_NAME": "loadtest",
+               "GOOGLE_SERVICE_ACCOUNT_JSON": {"type": "service_account"}}
+    if args.shared_store:
+        secrets["SHARED_STORE"] = args.shared_store
+
+    workdir = tempfile.mkdtemp(prefix="loadtest_app_")
+    shutil.copytree(os.path.join(ROOT, "assets"), os.path.join(workdir, "assets"))
+    ctx = mp.get_context("spawn")
+    t0 = time.perf_counter()
+    try:
+        with ctx.Manager() as manager, ctx.Pool(args.sessions) as pool:
+            start = manager.Barrier(args.sessions)
+            sessions = pool.starmap(operate, [(n, users[n], secrets, args.iterations, args.sheets_latency,
+                                               workdir, start) for n in range(args.sessions)])
+    finally:
+        wall = time.perf_counter() - t0
+        sink.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    subs = [s for _, submissions, _ in sessions for s in submissions]
+    report_ids = Counter(s["report_id"] for s in subs)
+    patient_ids = Counter(s["patient_id"] for s in subs)
+    paths = Counter(s["path"] for s in subs if s["path"])  # no local path when only archived
+    result = {
+        "benchmark": "loadtest_app", "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "wall_s": round(wall, 2), "submissions": len(subs),
+        "steps": summarize([st for steps, _, _ in sessions for st in steps]),
+        "hazards": {
+            "duplicate_report_ids": sum(c - 1 for c in report_ids.values() if c > 1),
+            "duplicate_patient_ids": sum(c - 1 for c in patient_ids.values() if c > 1),
+            "db_duplicate_ids": db_collisions(dsn),
+            "clobbered_pdfs": sum(1 for s in subs if not s["own_pdf"]),
+            "sessions_sharing_a_pdf_path": {p: len({s["session"] for s in subs if s["path"] == p})
+                                            for p in paths},
+        },
+        "standins": {"sheet_rows": sum(r for _, _, r in sessions), "mails": sink.messages},
+    }
+
+    print(f"{args.sessions} sessions x {args.iterations} reports: {len(subs)} submitted in {wall:.1f} s")
+    print(f"  {'step':<12}{'n':>5}" + "".join(f"{'p%d' % p:>10}" for p in PERCENTILES) + f"{'errors':>9}")
+    for name, s in result["steps"].items():
+        print(f"  {name:<12}{s['count']:>5}" + "".join(f"{s['p%d_ms' % p]:>7.0f} ms" for p in PERCENTILES)
+              + f"{s['error_rate'] * 100:>8.0f}%")
+        for msg, n in s["errors"].items():
+            print(f"      {n} x {msg[:100]}")
+    h = result["hazards"]
+    print(f"  duplicate report IDs {h['duplicate_report_ids']}, duplicate patient IDs "
+          f"{h['duplicate_patient_ids']}, in the DB {h['db_duplicate_ids']}")
+    print(f"  PDFs showing another session's patient: {h['clobbered_pdfs']} of {len(subs)}")
+    for p, n in h["sessions_sharing_a_pdf_path"].items():
+        if n > 1:
+            print(f"  {n} sessions wrote {p}")
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results",
+                                   time.strftime("loadtest-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {out}")
+
+    conn = psycopg2.connect(dsn)
+    conn.cursor().execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
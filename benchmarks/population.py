@@ -0,0 +1,336 @@
+"""Synthetic `responses` rows for load tests and dashboard sizing.
+
+Everything is sampled with NumPy a chunk at a time: patients with 1 + Poisson
+visits spread over the date range, vitals drawn from per-patient baselines
+that depend on age and gender (height, BMI, blood pressure rising with age
+and BMI, lower hemoglobin in women), and questionnaire answers whose
+prevalence follows age where it should (glasses, hearing loss, cataract).
+The answer options are the ones the app_v8 form offers.
+
+Output is a pure function of the seed and the row count: chunk i draws from
+its own generator seeded with (seed, i), so the chunk size is fixed.
+
+    python benchmarks/population.py ROWS [--seed 0] [--format csv|ndjson|db]
+        [--out FILE] [--start 2023-01-01] [--days 730] [--schema NAME]
+
+csv/ndjson go to --out (default stdout) in the column layout of `responses`.
+--format db COPYs into the schema built by init_db/migrate.py in
+DATABASE_URL, continuing after the largest patient/report IDs. The rows are
+logged for the rollup job (rollups.py) like any other insert.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+CHUNK = 200_000
+VISITS_MEAN = 1.8       # visits per patient
+GAP_DAYS = 120          # mean days between a patient's visits
+
+COLUMNS = ["patient_id", "report_id", "collection_date", "report_date", "patient_name",
+           "patient_age", "patient_gender", "patient_referee", "patient_phone", "weight", "height",
+           "bmi", "pulse_rate", "systolic_blood_pressure", "diastolic_blood_pressure", "o2_level",
+           "temperature", "vision", "breathing", "hearing", "skin_condition", "oral_health",
+           "urine_color", "hair_loss", "nail_changes", "cataract", "disabilities", "hemoglobin_level"]
+
+# same options, in the same order, as the app_v8 form
+OPTIONS = {
+    "patient_gender": ["Male", "Female", "Other"],
+    "vision": ["Clear", "Blurry", "Needs Glasses"],
+    "breathing": ["Normal", "Slight Difficulty", "Labored"],
+    "hearing": ["Normal", "Mild Loss", "Significant Loss"],
+    "skin_condition": ["Clear", "Mild Issues", "Severe Issues"],
+    "oral_health": ["No issues", "Bleeding gums", "Bad breath", "Frequent mouth ulcers",
+                    "Tooth pain or sensitivity"],
+    "urine_color": ["Pale yellow", "Clear", "Dark yellow", "Brownish/red (seek medical attention)"],
+    "hair_loss": ["No", "Yes, mild hair loss", "Yes, moderate hair loss", "Yes, severe hair loss"],
+    "nail_changes": ["No", "Yes, white spots", "Yes, yellowing", "Yes, dark streaks"],
+    "cataract": ["No", "Yes"],
+}
+# age-independent answer prevalence
+PREVALENCE = {
+    "skin_condition": [0.75, 0.22, 0.03],
+    "oral_health": [0.55, 0.15, 0.12, 0.06, 0.12],
+    "urine_color": [0.60, 0.20, 0.18, 0.02],
+    "hair_loss": [0.70, 0.20, 0.08, 0.02],
+    "nail_changes": [0.82, 0.10, 0.06, 0.02],
+}
+
+FIRST_MALE = np.array(["Aarav", "Rahul", "Amit", "Suresh", "Rajesh", "Sanjay", "Arjun", "Vikram",
+                       "Anil", "Deepak", "Manoj", "Rohit", "Sourav", "Pallab", "Abhijit", "Ravi"])
+FIRST_FEMALE = np.array(["Priya", "Anjali", "Sunita", "Pooja", "Neha", "Kavita", "Rekha", "Asha",
+                         "Meera", "Shreya", "Ananya", "Rina", "Mousumi", "Lakshmi", "Geeta", "Divya"])
+LAST = np.array(["Kumar", "Sharma", "Das", "Biswas", "Ghosh", "Mondal", "Roy", "Singh", "Patel",
+                 "Banerjee", "Chatterjee", "Mukherjee", "Sahoo", "Naik", "Mahato", "Reddy"])
+REFEREES = np.array([f"Dr. {n}" for n in ["Sen", "Bose", "Paul", "Saha", "Dutta", "Pal", "Kar", "Nath",
+                                           "Rao", "Iyer", "Mishra", "Verma", "Gupta", "Jana", "Maity",
+                                           "Bera", "Hazra", "Dey", "Sinha", "Khan"]])
+REFEREE_P = 1 / np.arange(1, len(REFEREES) + 1)
+REFEREE_P /= REFEREE_P.sum()
+DISABILITIES = np.array(["Uses a walking stick", "Low vision", "Wheelchair user",
+                         "Partial hearing loss, left ear", "Diabetic, on medication",
+                         "Hypertension, on medication"])
+
+
+def _sig(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def _draw(rng, m, probs):
+    """m categorical draws; probs is (options,) or (m, options)."""
+    probs = np.asarray(probs, dtype=float)
+    cum = np.cumsum(probs, axis=-1)
+    cum[..., -1] = 1.0
+    u = rng.random(m)
+    if cum.ndim == 1:
+        return np.searchsorted(cum, u, side="right").astype(np.int8)
+    return (u[:, None] >= cum).sum(axis=1).astype(np.int8)
+
+
+def _answer(idx, question):
+    return pd.Categorical.from_codes(idx, OPTIONS[question])
+
+
+def chunk(seed, i, m, start, days, patient_base, report_base):
+    """m rows of chunk i. Returns (DataFrame in COLUMNS order, patients used)."""
+    rng = np.random.default_rng([seed, i])
+
+    # patients and their visits
+    visits = 1 + rng.poisson(VISITS_MEAN - 1, size=m)
+    ends = np.cumsum(visits)
+    k = int(np.searchsorted(ends, m)) + 1
+    visits = visits[:k]
+    visits[-1] -= ends[k - 1] - m
+    starts = np.concatenate(([0], np.cumsum(visits)[:-1]))
+    pat = np.repeat(np.arange(k), visits)
+
+    gender = _draw(rng, k, [0.49, 0.49, 0.02])
+    age0 = np.clip(rng.gamma(3.0, 12.5, k), 1, 95)
+    gap = rng.exponential(GAP_DAYS, m)
+    gap[starts] = 0
+    cs = np.cumsum(gap)
+    offset = cs - np.repeat(cs[starts], visits)
+    span = offset[starts + visits - 1]
+    # squeeze histories longer than the period, then place each one inside it
+    squeeze = np.minimum(1.0, (days - 1) * rng.uniform(0.5, 1.0, k) / np.maximum(span, 1))
+    offset = (offset * squeeze[pat]).astype(np.int64)
+    span = offset[starts + visits - 1]
+    first_day = (rng.random(k) * (days - span)).astype(np.int64)
+    day = first_day[pat] + offset
+    age = age0[pat] + (day - first_day[pat]) / 365.25
+    g = gender[pat]
+    male, female = g == 0, g == 1
+
+    # per-patient baselines
+    adult_h = np.where(gender == 0, rng.normal(165, 7, k),
+                       np.where(gender == 1, rng.normal(152, 6, k), rng.normal(158, 8, k)))
+    bmi_z = rng.normal(0, 1, k)
+    bp_off = rng.normal(0, 10, k)
+    hb_off = rng.normal(0, 1.0, k)
+    fem_first = rng.integers(0, len(FIRST_FEMALE), k)
+    male_first = rng.integers(0, len(FIRST_MALE), k)
+    first = np.where(gender == 1, FIRST_FEMALE[fem_first], FIRST_MALE[male_first])
+    names = np.char.add(np.char.add(first, " "), LAST[rng.integers(0, len(LAST), k)])
+    phones = rng.integers(6_000_000_000, 10_000_000_000, k).astype(str)
+    referee = rng.choice(len(REFEREES), k, p=REFEREE_P)
+
+    # vitals at each visit
+    grow = np.clip(0.45 + 0.55 * age / 18, None, 1.0)
+    height = adult_h[pat] * grow + rng.normal(0, 0.5, m)
+    bmi_mu = np.where(age < 18, 15.5 + 0.2 * age, 20.5 + 0.09 * (np.minimum(age, 55) - 18))
+    bmi = bmi_mu * np.exp(0.15 * bmi_z[pat] + rng.normal(0, 0.02, m))
+    weight = np.round(bmi * (height / 100) ** 2, 1)
+    height = np.round(height, 1)
+    bmi = np.round(weight / (height / 100) ** 2, 1)
+    sys_bp = (108 + 0.55 * np.maximum(age - 18, 0) + 4 * male + 0.9 * (bmi - 22)
+              - 12 * (age < 12) + bp_off[pat] + rng.normal(0, 6, m))
+    dia_bp = np.minimum(68 + 0.22 * np.maximum(age - 18, 0) + 0.5 * (bmi - 22)
+                        + 0.5 * bp_off[pat] + rng.normal(0, 5, m), sys_bp - 20)
+    pulse = 76 + 18 * (age < 12) - 0.04 * age + rng.normal(0, 9, m)
+    o2 = np.clip(98.3 - 0.03 * np.maximum(age - 50, 0) - rng.exponential(0.8, m), 82, 100)
+    fever = rng.random(m) < 0.04
+    temp = 98.1 + rng.normal(0, 0.4, m) + fever * rng.uniform(1.2, 4.0, m)
+    hb = np.where(male, 14.6, np.where(female, 11.9, 13.2)) + hb_off[pat] + rng.normal(0, 0.4, m)
+
+    # questionnaire
+    glasses = 0.08 + 0.55 * _sig((age - 45) / 8)
+    hearing_mild = 0.04 + 0.25 * _sig((age - 60) / 7)
+    hearing_sig = 0.01 + 0.08 * _sig((age - 70) / 6)
+    labored = 0.015 + 0.04 * _sig((age - 65) / 6)
+    cataract = 0.005 + 0.45 * _sig((age - 65) / 6)
+    answers = {
+        "vision": _draw(rng, m, np.stack([1 - glasses - 0.1, np.full(m, 0.1), glasses], 1)),
+        "breathing": _draw(rng, m, np.stack([0.9 - labored, np.full(m, 0.1), labored], 1)),
+        "hearing": _draw(rng, m, np.stack([1 - hearing_mild - hearing_sig, hearing_mild, hearing_sig], 1)),
+        "cataract": (rng.random(m) < cataract).astype(np.int8),
+    }
+    for q, p in PREVALENCE.items():
+        answers[q] = _draw(rng, m, p)
+    disab = np.where(rng.random(m) < 0.03, DISABILITIES[rng.integers(0, len(DISABILITIES), m)], "")
+
+    collection = np.datetime64(start, "D") + day
+    df = pd.DataFrame({
+        "patient_id": patient_base + pat + 1,
+        "report_id": report_base + np.arange(m) + 1,
+        "collection_date": collection,
+        "report_date": collection + rng.integers(0, 3, m),
+        "patient_name": names[pat],
+        "patient_age": age.astype(np.int16),
+        "patient_gender": _answer(g, "patient_gender"),
+        "patient_referee": REFEREES[referee][pat],
+        "patient_phone": phones[pat],
+        "weight": weight, "height": height, "bmi": bmi,
+        "pulse_rate": np.round(pulse).astype(np.int16),
+        "systolic_blood_pressure": np.round(sys_bp).astype(np.int16),
+        "diastolic_blood_pressure": np.round(dia_bp).astype(np.int16),
+        "o2_level": np.round(o2).astype(np.int16),
+        "temperature": np.round(temp, 1),
+        **{q: _answer(answers[q], q) for q in ["vision", "breathing", "hearing", "skin_condition",
+                                               "oral_health", "urine_color", "hair_loss",
+                                               "nail_changes", "cataract"]},
+        "disabilities": disab,
+        "hemoglobin_level": np.round(hb, 1),
+    })
+    return df, k
+
+
+def generate(rows, seed=0, start="2023-01-01", days=730, patient_base=0, report_base=1000):
+    """Yield DataFrames of at most CHUNK rows, `rows` in total."""
+    i = 0
+    while rows > 0:
+        m = min(CHUNK, rows)
+        df, k = chunk(seed, i, m, start, days, patient_base, report_base)
+        yield df
+        patient_base += k
+        report_base += m
+        rows -= m
+        i += 1
+
+
+# ── Writers ──
+def write_csv(chunks, f):
+    for i, df in enumerate(chunks):
+        df.to_csv(f, header=i == 0, index=False)
+        yield len(df)
+
+
+def write_ndjson(chunks, f):
+    for df in chunks:
+        df = df.assign(collection_date=df.collection_date.dt.strftime("%Y-%m-%d"),
+                       report_date=df.report_date.dt.strftime("%Y-%m-%d"))
+        f.write(df.to_json(orient="records", lines=True))
+        yield len(df)
+
+
+def id_bases(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(patient_id), 0), COALESCE(MAX(report_id), 1000) FROM responses")
+    return cur.fetchone()
+
+
+def copy_into(conn, chunks):
+    """
+    COPY the chunks into the responses table, or into responses_compact with
+    answers already coded when migration 001 has been applied (into patients
+    and visits after 012). One transaction; the per-row latest_vitals
+    trigger is suspended and the row recomputed once at the end. Into
+    partitioned visits (013) the rows land in visits_default and are moved to
+    monthly partitions at the end.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('responses_compact') IS NOT NULL, to_regclass('latest_vitals') IS NOT NULL, "
+                "to_regclass('patients') IS NOT NULL, "
+                "EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('visits') AND relkind = 'p')")
+    compact, latest, patients, partitioned = cur.fetchone()
+    visits = "visits" if patients else "responses_compact"
+    codes = {}
+    if compact:
+        for q, opts in OPTIONS.items():
+            cur.execute("SELECT answer_code(%s, a) FROM unnest(%s::text[]) WITH ORDINALITY AS t(a, n) ORDER BY n",
+                        (q, opts))
+            codes[q] = np.array([r[0] for r in cur.fetchall()], dtype=np.int16)
+    if latest:
+        cur.execute(f"ALTER TABLE {visits} DISABLE TRIGGER latest_vitals_write")
+    try:
+        for df in chunks:
+            if compact:
+                df = df.rename(columns={"patient_gender": "gender_code"})
+                df["gender_code"] = codes["patient_gender"][df.gender_code.cat.codes]
+                for q in OPTIONS:
+                    if q != "patient_gender":
+                        df[q] = codes[q][df[q].cat.codes]
+                        df = df.rename(columns={q: q + "_code"})
+                table = "responses_compact"
+                if patients:  # a chunk holds each of its patients' visits, so each patient is new here
+                    pat = df.drop_duplicates("patient_id")[["patient_id", "gender_code", "patient_name", "patient_phone"]]
+                    buf = io.StringIO()
+                    pat.to_csv(buf, header=False, index=False)
+                    buf.seek(0)
+                    cur.copy_expert("COPY patients (id, gender_code, name, phone) FROM STDIN WITH (FORMAT csv)", buf)
+                    df = df.drop(columns=["gender_code", "patient_name", "patient_phone"])
+                    table = "visits"
+            else:
+                table = "responses"
+            buf = io.StringIO()
+            df.to_csv(buf, header=False, index=False)
+            buf.seek(0)
+            cur.copy_expert(f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+            yield len(df)
+        if latest:
+            cur.execute(f"ALTER TABLE {visits} ENABLE TRIGGER latest_vitals_write")
+            cur.execute("SELECT latest_vitals_refresh()")
+        if partitioned:
+            cur.execute("SELECT visits_maintain()")
+        if patients:
+            cur.execute("SELECT patients_assign_keys()")
+            cur.execute("SELECT setval('patient_id_seq', GREATEST((SELECT max(id) FROM patients), "
+                        "(SELECT last_value FROM patient_id_seq)))")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("rows", type=int)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--format", choices=["csv", "ndjson", "db"], default="csv")
+    ap.add_argument("--out", default="-")
+    ap.add_argument("--start", default="2023-01-01", help="first collection date")
+    ap.add_argument("--days", type=int, default=730, help="length of the collection period")
+    ap.add_argument("--schema", help="schema to load into (db format)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    conn = f = None
+    if args.format == "db":
+        import psycopg2
+        conn = psycopg2.connect(os.environ["DATABASE_URL"],
+                                options=f"-c search_path={args.schema}" if args.schema else None)
+        pbase, rbase = id_bases(conn)
+        sink = copy_into(conn, generate(args.rows, args.seed, args.start, args.days, pbase, rbase))
+    else:
+        f = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+        writer = write_csv if args.format == "csv" else write_ndjson
+        sink = writer(generate(args.rows, args.seed, args.start, args.days), f)
+    done = 0
+    try:
+        for n in sink:
+            done += n
+            rate = done / (time.perf_counter() - t0) * 60
+            print(f"\r{done:,} rows  ({rate / 1e6:.2f} M rows/min)", end="", file=sys.stderr)
+    finally:
+        if f is not None and f is not sys.stdout:
+            f.close()
+        if conn is not None:
+            conn.close()
+    print(file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
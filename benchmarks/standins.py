@@ -0,0 +1,201 @@
+"""Local stand-ins for the services the report pipeline talks to.
+
+    connect_postgres                   database connections with a per round trip delay
+    FakeWorksheet                      the gspread worksheet calls save_to_google_sheets makes
+    fake_google_sheets()               route the app's gspread login to a FakeWorksheet
+    SMTPSink, plain_smtp()             a local SMTP server and a client that skips STARTTLS/AUTH
+    load_app_functions                 the real functions from an app script, bound to the above
+
+The app scripts run Streamlit code at import, so load_app_functions compiles
+only the requested top-level functions from the file and executes them in a
+namespace the caller fills with stand-ins. The function bodies are the ones
+the app runs.
+"""
+import ast
+import smtplib
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+# ── Database ──
+class _Cursor:
+    def __init__(self, cur, latency):
+        self._cur, self._latency = cur, latency
+
+    def execute(self, sql, params=None):
+        if self._latency:
+            time.sleep(self._latency)
+        return self._cur.execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class LatencyConnection:
+    """DB-API connection whose execute() and commit() each cost one round trip."""
+
+    def __init__(self, conn, latency=0.0):
+        self._conn, self._latency = conn, latency
+        if latency:
+            time.sleep(latency)  # connection setup
+
+    def cursor(self):
+        return _Cursor(self._conn.cursor(), self._latency)
+
+    def commit(self):
+        if self._latency:
+            time.sleep(self._latency)
+        self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def connect_postgres(dsn, schema=None, latency=0.0):
+    import psycopg2
+    opts = f"-c search_path={schema}" if schema else None
+    return LatencyConnection(psycopg2.connect(dsn, options=opts), latency)
+
+
+# ── Google Sheets ──
+class FakeWorksheet:
+    """In-memory worksheet with gspread's get_all_records/append_row semantics."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.rows = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_all_records(self):
+        self._round_trip()
+        with self._lock:
+            if not self.rows:
+                return []
+            head = self.rows[0]
+            return [dict(zip(head, r)) for r in self.rows[1:]]
+
+    def append_row(self, values):
+        self._round_trip()
+        with self._lock:
+            self.rows.append(list(values))
+
+
+class _FakeClient:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def open(self, name):
+        return SimpleNamespace(sheet1=self.worksheet)
+
+
+@contextmanager
+def fake_google_sheets(worksheet):
+    """Make gspread.authorize() hand out `worksheet` while the block runs."""
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+    orig = gspread.authorize, ServiceAccountCredentials.__dict__["from_json_keyfile_dict"]
+    gspread.authorize = lambda creds, *args, **kwargs: _FakeClient(worksheet)
+    ServiceAccountCredentials.from_json_keyfile_dict = classmethod(lambda cls, *args, **kwargs: None)
+    try:
+        yield
+    finally:
+        gspread.authorize, ServiceAccountCredentials.from_json_keyfile_dict = orig
+
+
+# ── SMTP ──
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 sink ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line[:4].upper()
+            if cmd == b"EHLO":
+                self.reply("250-sink\r\n250 SIZE 0")
+            elif cmd == b"DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                size = 0
+                for chunk in iter(self.rfile.readline, b""):
+                    if chunk == b".\r\n":
+                        break
+                    size += len(chunk)
+                self.server.delivered(size)
+                self.reply("250 queued")
+            elif cmd == b"QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Accepts and discards mail on 127.0.0.1, counting messages and bytes."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, port=0):
+        super().__init__(("127.0.0.1", port), _SMTPHandler)
+        self.latency = latency
+        self.messages = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def delivered(self, size):
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True).start()
+        return self
+
+
+class _PlainSMTP(smtplib.SMTP):
+    # the sink speaks plain SMTP; everything else in send_email is unchanged
+    def starttls(self, *args, **kwargs):
+        return 220, b"skipped"
+
+    def login(self, *args, **kwargs):
+        return 235, b"skipped"
+
+
+@contextmanager
+def plain_smtp():
+    """Make smtplib.SMTP skip STARTTLS and AUTH while the block runs."""
+    orig = smtplib.SMTP
+    smtplib.SMTP = _PlainSMTP
+    try:
+        yield
+    finally:
+        smtplib.SMTP = orig
+
+
+# ── App code ──
+def load_app_functions(path, names, env):
+    """Compile the named top-level functions of an app script into env and return them."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    nodes = [n for n in tree.body if isinstance(n, ast.FunctionDef) and n.name in names]
+    missing = set(names) - {n.name for n in nodes}
+    if missing:
+        raise LookupError(f"{path} has no function(s) {sorted(missing)}")
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), path, "exec"), env)
+    return {n: env[n] for n in names}
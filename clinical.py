@@ -0,0 +1,40 @@
+from datetime import datetime
+
+import rules
+
+# Pure helpers shared by the app and the PDF renderer.
+# Nothing heavy is imported here so the login page can use them cheaply.
+
+# ── Utilities ──
+def parse_date(d):
+    if not d: return None
+    if isinstance(d, datetime): return d.date()
+    for fmt in ("%Y-%m-%d","%d-%m-%Y","%d/%m/%Y"):
+        try: return datetime.strptime(d,fmt).date()
+        except: pass
+    return None
+
+def calculate_bmi(weight, height):
+    try:
+        w,h = float(weight),float(height)
+        return round(w/(h/100)**2,1) if h else None
+    except: return None
+
+def bmi_category(bmi):
+    if bmi is None: return "—","muted"
+    b = float(bmi)
+    if b < 18.5: return "Underweight","warn"
+    if b < 25: return "Normal","ok"
+    if b < 30: return "Overweight","warn"
+    return "Obese","danger"
+
+# Report comments come from the rules in clinical_rules.json (see rules.py).
+def analyze_numerical_vitals(data):
+    return [f.comment for f in rules.current().evaluate(data) if f.kind == "vital"]
+
+def analyze_subjective_answers(data):
+    return [f.comment for f in rules.current().evaluate(data) if f.kind == "answer"]
+
+def findings(data):
+    """All rule findings for a visit, in report order (vitals, then answers)."""
+    return rules.current().evaluate(data)
@@ -0,0 +1,229 @@
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+import dbstream
+
+# -------------------------
+# In-memory cohort index (bitmaps over responses)
+# -------------------------
+# One bitset per answer of each questionnaire column, per referee (camp) and
+# per band of each vital: bit i is set when the i-th visit (in id order) has
+# that value. Bitsets are NumPy uint64 arrays, 1 bit per visit (125 KB per
+# million visits), so a cohort such as
+#
+#   idx.any("patient_gender", "Female") & idx.range("patient_age", 40)
+#       & idx.any("urine_color", "Dark yellow") & ~idx.any("hair_loss", "No")
+#       & idx.range("o2_level", None, 94) & idx.any("patient_referee", "Camp X")
+#
+# is a handful of vectorized word operations and a popcount: well under a
+# millisecond at a million visits. refresh() appends visits with an id past
+# the last one indexed; only a full rebuild (every REBUILD_EVERY seconds)
+# reads everything again. Until then counts can be stale by up to that long:
+# a visit whose transaction commits after a higher id was indexed is missed,
+# and edits, deletions, patient merges and archived months are not seen.
+#
+#   python cohort.py        build the index and time a sample cohort
+
+ANSWERS = {"patient_gender": "gender_code", "vision": "vision_code", "breathing": "breathing_code",
+           "hearing": "hearing_code", "skin_condition": "skin_condition_code", "oral_health": "oral_health_code",
+           "urine_color": "urine_color_code", "hair_loss": "hair_loss_code", "nail_changes": "nail_changes_code",
+           "cataract": "cataract_code"}
+TEXT = ("patient_referee",)
+# band cut points; band i holds values in [cuts[i-1], cuts[i]). Ranges must start and end on a cut.
+BANDS = {"patient_age": (15, 30, 40, 50, 60, 70),
+         "bmi": (18.5, 25, 30),
+         "o2_level": (90, 94),
+         "systolic_blood_pressure": (90, 120, 140),
+         "diastolic_blood_pressure": (60, 80, 90),
+         "pulse_rate": (60, 100),
+         "temperature": (97.8, 99.1, 100.4),
+         "hemoglobin_level": (8, 11, 12, 13)}
+REBUILD_EVERY = 3600.0  # seconds; the most counts can lag changes other than new visits
+BATCH = 100_000
+
+_POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)  # set bits per byte value
+
+
+def popcount(words, axis=None):
+    """Set bits of a uint64 array: in all of it, or per row with axis=1."""
+    if hasattr(np, "bitwise_count"):  # NumPy 2: a popcount instruction per word
+        return np.bitwise_count(words).sum(axis)
+    return _POP8[np.ascontiguousarray(words).view(np.uint8)].sum(axis, dtype=np.int64)
+
+
+class Bitmap:
+    """A set of visits as a packed bitset; &, | and ~ combine, count() is a popcount."""
+    __slots__ = ("words", "n")
+
+    def __init__(self, words, n):
+        self.words, self.n = words, n
+
+    def __and__(self, other):
+        return Bitmap(self.words & other.words, self.n)
+
+    def __or__(self, other):
+        return Bitmap(self.words | other.words, self.n)
+
+    def __invert__(self):
+        words = ~self.words
+        if self.n % 64:  # bits past the last visit stay clear
+            words[-1] &= np.uint64((1 << (self.n % 64)) - 1)
+        return Bitmap(words, self.n)
+
+    def count(self):
+        return int(popcount(self.words))
+
+    def positions(self):
+        return np.flatnonzero(np.unpackbits(self.words.view(np.uint8), bitorder="little")[:self.n])
+
+
+def band_label(cuts, i):
+    if i == 0:
+        return f"< {cuts[0]:g}"
+    if i == len(cuts):
+        return f"≥ {cuts[-1]:g}"
+    return f"{cuts[i - 1]:g}–{cuts[i]:g}"
+
+
+class CohortIndex:
+    def __init__(self, connect, log=print):
+        self.connect, self.log = connect, log
+        self.lock = threading.Lock()
+        self.n = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.maps = {}      # (column, value) -> uint64 array of self.cap words
+        self.cap = 0
+        self.last_id = 0
+        self.built = 0.0    # monotonic time of the last full build
+        self.refreshed = 0.0
+
+    # ── building ──
+    def refresh(self, full=False):
+        """Append visits past the last indexed id; rebuild when `full` or older than REBUILD_EVERY. Returns rows added."""
+        with self.lock:
+            if full or not self.built or time.monotonic() - self.built > REBUILD_EVERY:
+                self.n, self.ids, self.maps, self.cap, self.last_id = 0, np.empty(0, dtype=np.int64), {}, 0, 0
+                self.built = time.monotonic()
+            conn = self.connect()
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT code, answer FROM answer_codes")
+                answers = dict(cur.fetchall())
+                cols = ["id", *ANSWERS.values(), *TEXT, *BANDS]
+                added = 0
+                for rows in dbstream.batches(conn, f"SELECT {', '.join(cols)} FROM responses_compact "
+                                                   "WHERE id > %s ORDER BY id", (self.last_id,), BATCH):
+                    self._append(pd.DataFrame(rows, columns=cols), answers)
+                    added += len(rows)
+                conn.rollback()
+            finally:
+                conn.close()
+            self.refreshed = time.monotonic()
+            return added
+
+    def _append(self, df, answers):
+        start, k = self.n, len(df)
+        self._grow(start + k)
+        self.ids = np.concatenate([self.ids, df["id"].to_numpy(dtype=np.int64)])
+        pos = start + np.arange(k)
+        for col, src in ANSWERS.items():
+            codes = df[src].fillna(-1).to_numpy(dtype=np.int32)
+            for code in np.unique(codes[codes >= 0]):
+                self._set((col, answers.get(int(code), str(code))), pos[codes == code])
+        for col in TEXT:
+            codes, uniques = pd.factorize(df[col].replace("", None))
+            for u, value in enumerate(uniques):
+                self._set((col, value), pos[codes == u])
+        for col, cuts in BANDS.items():
+            v = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+            have = ~np.isnan(v) & (v != 0)  # 0 is how the form records "not measured"
+            band = np.searchsorted(np.asarray(cuts, dtype=float), v[have], side="right")
+            for b in np.unique(band):
+                self._set((col, int(b)), pos[have][band == b])
+        self.n = start + k
+        self.last_id = int(self.ids[-1]) if self.n else 0
+
+    def _grow(self, n):
+        need = (n + 63) // 64
+        if need > self.cap:
+            self.cap = max(need, 2 * self.cap)
+            for key, words in self.maps.items():
+                self.maps[key] = np.concatenate([words, np.zeros(self.cap - len(words), np.uint64)])
+
+    def _set(self, key, positions):
+        """Set the bits at `positions` (sorted, all at or past self.n) in the bitmap for `key`."""
+        words = self.maps.get(key)
+        if words is None:
+            words = self.maps[key] = np.zeros(self.cap, np.uint64)
+        w0 = self.n // 64
+        bits = np.zeros((positions[-1] // 64 + 1 - w0) * 64, dtype=bool)
+        bits[positions - w0 * 64] = True
+        words[w0:w0 + len(bits) // 64] |= np.packbits(bits, bitorder="little").view(np.uint64)
+
+    # ── querying ──
+    def _bitmap(self, key):  # key None: the empty set
+        nw = (self.n + 63) // 64
+        words = self.maps.get(key)
+        return Bitmap(words[:nw].copy() if words is not None else np.zeros(nw, np.uint64), self.n)
+
+    def all(self):
+        return ~Bitmap(np.zeros((self.n + 63) // 64, np.uint64), self.n)
+
+    def any(self, column, *values):
+        """Visits whose `column` is any of `values` (answers, referee names)."""
+        with self.lock:
+            out = self._bitmap(None)
+            for v in values:
+                out = out | self._bitmap((column, v))
+            return out
+
+    def range(self, column, lo=None, hi=None):
+        """Visits with lo <= column < hi for a banded vital; lo and hi must be cut points (or None)."""
+        cuts = BANDS[column]
+        for x in (lo, hi):
+            if x is not None and x not in cuts:
+                raise ValueError(f"{column} ranges must start and end on one of {cuts}")
+        first = 0 if lo is None else cuts.index(lo) + 1
+        last = len(cuts) if hi is None else cuts.index(hi)
+        return self.bands(column, range(first, last + 1))
+
+    def bands(self, column, bands):
+        with self.lock:
+            out = self._bitmap(None)
+            for b in bands:
+                out = out | self._bitmap((column, b))
+            return out
+
+    def values(self, column):
+        """[(value, visits)] of a column, most visits first; bands in order as (label, visits)."""
+        with self.lock:
+            if column in BANDS:
+                cuts = BANDS[column]
+                return [(band_label(cuts, b), self._bitmap((column, b)).count()) for b in range(len(cuts) + 1)]
+            out = [(v, self._bitmap((c, v)).count()) for c, v in self.maps if c == column]
+        return sorted(out, key=lambda x: -x[1])
+
+    def response_ids(self, bitmap, limit=None):
+        return self.ids[bitmap.positions()[:limit]]
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    dsn = os.environ["DATABASE_URL"]
+    idx = CohortIndex(lambda: psycopg2.connect(dsn))
+    t0 = time.perf_counter()
+    n = idx.refresh()
+    print(f"{n} visits, {len(idx.maps)} bitmaps in {time.perf_counter() - t0:.1f} s")
+    t0 = time.perf_counter()
+    c = (idx.any("patient_gender", "Female") & idx.range("patient_age", 40) & idx.any("urine_color", "Dark yellow")
+         & ~idx.any("hair_loss", "No") & idx.range("o2_level", None, 94))
+    if len(sys.argv) > 1:
+        c = c & idx.any("patient_referee", sys.argv[1])
+    print(f"{c.count()} visits in {(time.perf_counter() - t0) * 1000:.2f} ms")
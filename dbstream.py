@@ -0,0 +1,48 @@
+import itertools
+
+from psycopg2.extras import NamedTupleCursor
+
+# -------------------------
+# Streaming reads through server-side cursors
+# -------------------------
+# A plain psycopg2 cursor pulls the whole result into client memory on
+# execute(). A named cursor leaves it on the server and fetches `itersize`
+# rows per round trip, so a bulk read of responses (exports, re-rendering)
+# holds one batch at a time however large the result. Named cursors live in
+# a transaction: the caller owns the connection and ends the transaction;
+# on an autocommit connection the cursor is declared WITH HOLD instead.
+
+ITERSIZE = 2000  # rows per round trip; raise for wide scans on a remote server
+
+_names = itertools.count()
+
+
+def _cursor(conn, itersize, cursor_factory=None):
+    cur = conn.cursor(name=f"stream_{next(_names)}", cursor_factory=cursor_factory,
+                      withhold=conn.autocommit)
+    cur.itersize = itersize
+    return cur
+
+
+def stream(conn, sql, params=None, itersize=ITERSIZE):
+    """Yield the rows of `sql` as named tuples (fields named after the result columns)."""
+    cur = _cursor(conn, itersize, NamedTupleCursor)
+    try:
+        cur.execute(sql, params)
+        yield from cur
+    finally:
+        cur.close()
+
+
+def batches(conn, sql, params=None, size=ITERSIZE):
+    """Yield the rows of `sql` as lists of at most `size` plain tuples, one list per round trip."""
+    cur = _cursor(conn, size)
+    try:
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cur.close()
@@ -0,0 +1,289 @@
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2.extras import NamedTupleCursor, execute_values
+
+import dbstream
+from cohort import popcount
+
+# -------------------------
+# Duplicate patients (tables in migrations/011_patient_merges.sql)
+# -------------------------
+# find() compares patients only within blocks that share a normalised phone
+# number, or a phonetic name key (Soundex of first and last name) with the
+# same gender and a similar birth year, so the work grows with the block
+# sizes rather than with the square of the visits. Blocks larger than
+# MAX_BLOCK (a clinic phone, a very common name) are skipped. Pairs are
+# scored with NumPy: name similarity is the Dice coefficient of hashed
+# character trigrams, computed once per distinct pair of names. Pairs
+# scoring THRESHOLD or more are grouped (union-find) and proposed for a
+# merge into the group's oldest patient_id; the Duplicates page reviews them.
+#
+#   python dedupe.py        find duplicates and replace the pending proposals
+
+MAX_BLOCK = 50
+THRESHOLD = 0.85
+WEIGHTS = {"name": 0.5, "phone": 0.25, "age": 0.15, "gender": 0.1}
+# phone evidence: equal 1, one digit apart (a typo) PHONE_TYPO, missing on either side PHONE_UNKNOWN
+PHONE_TYPO = 0.6
+PHONE_UNKNOWN = 0.5
+SIG_WORDS = 4  # 256-bit trigram signature per name
+PAIR_CHUNK = 2_000_000
+PHONE_REASONS = {1.0: "same phone", PHONE_TYPO: "phone one digit apart", PHONE_UNKNOWN: "no phone on one"}
+
+
+def normalise_phone(s):
+    return s.fillna("").astype(str).str.replace(r"\D", "", regex=True).str[-10:]
+
+
+def normalise_name(s):
+    return (s.fillna("").astype(str).str.lower().str.replace(r"[^a-z ]", "", regex=True)
+            .str.split().str.join(" "))
+
+
+_SOUNDEX = str.maketrans("bfpvcgjkqsxzdtlmnr", "111122222222334556")
+
+
+def soundex(word):
+    """American Soundex code of a word ('' for none)."""
+    if not word:
+        return ""
+    codes = word.translate(_SOUNDEX)
+    out, last = word[0].upper(), codes[0]
+    for ch, c in zip(word[1:], codes[1:]):
+        if c.isdigit() and c != last:
+            out += c
+        if ch not in "hw":
+            last = c
+    return (out + "000")[:4]
+
+
+def phonetic_key(name):
+    parts = name.split()
+    return soundex(parts[0]) + soundex(parts[-1]) if parts else ""
+
+
+def signature(name):
+    """SIG_WORDS uint64 words with one bit set per hashed character trigram."""
+    sig = [0] * SIG_WORDS
+    padded = f"  {name} "
+    for i in range(len(padded) - 2):
+        h = zlib.crc32(padded[i:i + 3].encode()) % (64 * SIG_WORDS)
+        sig[h >> 6] |= 1 << (h & 63)
+    return sig
+
+
+def _pairs(keys, max_block=MAX_BLOCK):
+    """All (i, j), i < j, of rows sharing a key, in blocks of 2..max_block rows. Returns (a, b, skipped blocks)."""
+    keys = pd.Series(keys)
+    keys = keys[keys.notna() & (keys != "")]
+    sizes = keys.groupby(keys).transform("size")
+    skipped = keys[sizes > max_block].nunique()
+    keys = keys[(sizes >= 2) & (sizes <= max_block)]
+    order = keys.sort_values(kind="stable")
+    rows, groups = order.index.to_numpy(), order.to_numpy()
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    lens = np.diff(np.r_[starts, len(groups)])
+    out_a, out_b = [], []
+    for size in np.unique(lens):  # one triu per block size, applied to all blocks of that size at once
+        i, j = np.triu_indices(size, 1)
+        s = starts[lens == size][:, None]
+        out_a.append(rows[(s + i).ravel()])
+        out_b.append(rows[(s + j).ravel()])
+    if not out_a:
+        return np.empty(0, np.int64), np.empty(0, np.int64), skipped
+    return np.concatenate(out_a), np.concatenate(out_b), skipped
+
+
+def load(conn):
+    """One row per patient_id (its latest visit): patient_id, name, phone, gender_code, birth year."""
+    cols = ["patient_id", "patient_name", "patient_phone", "gender_code", "patient_age", "collection_date"]
+    parts = [pd.DataFrame(b, columns=cols) for b in dbstream.batches(
+        conn, f"SELECT {', '.join(cols)} FROM responses_compact WHERE patient_id IS NOT NULL ORDER BY id", size=100_000)]
+    conn.rollback()
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=cols)
+    df = df.drop_duplicates("patient_id", keep="last").reset_index(drop=True)
+    year = pd.to_datetime(df["collection_date"], errors="coerce").dt.year
+    age = pd.to_numeric(df["patient_age"], errors="coerce").where(lambda a: a > 0)
+    return pd.DataFrame({"patient_id": df["patient_id"].astype(np.int64), "name": normalise_name(df["patient_name"]),
+                         "phone": normalise_phone(df["patient_phone"]).where(lambda p: p.str.len() >= 7, ""),
+                         "gender": df["gender_code"], "born": (year - age).to_numpy(dtype=float, na_value=np.nan)})
+
+
+def features(p):
+    """Per-patient arrays score_pairs() works on, computed once per run."""
+    names, name_code = np.unique(p["name"].to_numpy(), return_inverse=True)
+    sig = np.array([signature(n) for n in names], dtype=np.uint64).reshape(len(names), SIG_WORDS)
+    digits = np.frombuffer("".join(p["phone"].str.rjust(10, "x")).encode("ascii"), np.uint8).reshape(-1, 10)
+    return {"name_code": name_code, "sig": sig, "bits": popcount(sig, axis=1), "digits": digits,
+            "has_phone": (p["phone"] != "").to_numpy(), "born": p["born"].to_numpy(),
+            "gender": p["gender"].to_numpy(dtype=float, na_value=np.nan)}
+
+
+def score_pairs(f, a, b):
+    """Score the pairs (a, b) of patient rows. Returns (score, name, phone, age_ok) arrays."""
+    n = len(f["sig"])
+    # the Dice coefficient once per distinct pair of names
+    combo, inv = np.unique(f["name_code"][a].astype(np.int64) * n + f["name_code"][b], return_inverse=True)
+    ca, cb = combo // n, combo % n
+    common = popcount(f["sig"][ca] & f["sig"][cb], axis=1)
+    name_sim = (2 * common / np.maximum(f["bits"][ca] + f["bits"][cb], 1))[inv]
+    apart = (f["digits"][a] != f["digits"][b]).sum(1)
+    phone_sim = np.where(~(f["has_phone"][a] & f["has_phone"][b]), PHONE_UNKNOWN,
+                         np.where(apart == 0, 1.0, np.where(apart == 1, PHONE_TYPO, 0.0)))
+    age_ok = np.abs(f["born"][a] - f["born"][b]) <= 2  # NaN compares False
+    gender_eq = f["gender"][a] == f["gender"][b]
+    score = (WEIGHTS["name"] * name_sim + WEIGHTS["phone"] * phone_sim + WEIGHTS["age"] * age_ok
+             + WEIGHTS["gender"] * gender_eq)
+    return score, name_sim, phone_sim, age_ok
+
+
+def _groups(a, b):
+    """Connected components of the edges (a, b): {row: root row}."""
+    parent = {}
+
+    def find(x):
+        while parent.get(x, x) != x:
+            parent[x] = parent.get(parent[x], parent[x])
+            x = parent[x]
+        return x
+
+    for x, y in zip(a.tolist(), b.tolist()):
+        rx, ry = find(x), find(y)
+        if rx != ry:
+            parent[max(rx, ry)] = min(rx, ry)
+    return {x: find(x) for x in set(a.tolist()) | set(b.tolist())}
+
+
+def find(conn, log=print):
+    """Propose merges for every duplicate group found. Returns (patients compared, pairs scored, proposals)."""
+    t0 = time.perf_counter()
+    p = load(conn)
+    t_load = time.perf_counter() - t0
+    pk = p["name"].map(phonetic_key)
+    blocks = [("phone", p["phone"])]
+    for shift in (0, 2):  # overlapping 4-year birth buckets, so neighbours across an edge still meet
+        bucket = ((p["born"] + shift) // 4).astype("Int64").astype(str)
+        blocks.append(("name", (pk + ":" + p["gender"].astype(str) + ":" + bucket).where(p["born"].notna() & (pk != ""))))
+    a_all, b_all = [], []
+    for kind, keys in blocks:
+        a, b, skipped = _pairs(keys)
+        a_all.append(a)
+        b_all.append(b)
+        if log and skipped:
+            log(f"{skipped} {kind} blocks over {MAX_BLOCK} patients skipped")
+    pairs = np.unique(np.stack([np.concatenate(a_all), np.concatenate(b_all)], 1), axis=0) \
+        if sum(len(a) for a in a_all) else np.empty((0, 2), np.int64)
+    cur = conn.cursor()
+    cur.execute("SELECT patient_id, canonical_id FROM merge_proposals WHERE status = 'rejected'")
+    rejected = {tuple(sorted(r)) for r in cur.fetchall()}
+    conn.rollback()
+    f = features(p)
+    keep_a, keep_b, keep_s, keep_r = [], [], [], []
+    for lo in range(0, len(pairs), PAIR_CHUNK):
+        a, b = pairs[lo:lo + PAIR_CHUNK, 0], pairs[lo:lo + PAIR_CHUNK, 1]
+        score, name_sim, phone_sim, age_ok = score_pairs(f, a, b)
+        hit = np.flatnonzero(score >= THRESHOLD)
+        keep_a.append(a[hit])
+        keep_b.append(b[hit])
+        keep_s.append(score[hit])
+        keep_r += [", ".join(filter(None, (f"name {ns:.0%}", PHONE_REASONS.get(ps, ""), "same age" if ao else "")))
+                   for ns, ps, ao in zip(name_sim[hit], phone_sim[hit], age_ok[hit])]
+    a, b = (np.concatenate(keep_a), np.concatenate(keep_b)) if keep_a else (np.empty(0, int), np.empty(0, int))
+    s = np.concatenate(keep_s) if keep_s else np.empty(0)
+    pid = p["patient_id"].to_numpy()
+    ok = [tuple(sorted((pid[x], pid[y]))) not in rejected for x, y in zip(a, b)]
+    a, b, s, reasons = a[ok], b[ok], s[ok], [r for r, k in zip(keep_r, ok) if k]
+    # each member is proposed into the oldest patient_id of its group, with its best pair score
+    root = _groups(a, b)
+    best = {}
+    for x, y, sc, why in zip(a.tolist(), b.tolist(), s.tolist(), reasons):
+        for m in (x, y):
+            if sc > best.get(m, (0,))[0]:
+                best[m] = (sc, why)
+    members = {}
+    for m, r in root.items():
+        members.setdefault(r, []).append(m)
+    rows = []
+    for group in members.values():
+        canonical = int(min(pid[m] for m in group))
+        rows += [(int(pid[m]), canonical, round(best[m][0], 3), best[m][1]) for m in group if pid[m] != canonical]
+    cur.execute("DELETE FROM merge_proposals WHERE status = 'pending'")
+    if rows:
+        execute_values(cur, "INSERT INTO merge_proposals (patient_id, canonical_id, score, reasons) VALUES %s "
+                            "ON CONFLICT (patient_id, canonical_id) DO NOTHING", rows, page_size=1000)
+    conn.commit()
+    if log:
+        log(f"{len(p)} patients (loaded in {t_load:.1f} s), {len(pairs)} pairs scored, "
+            f"{len(rows)} merge proposals in {len(members)} groups, {time.perf_counter() - t0:.1f} s")
+    return len(p), len(pairs), len(rows)
+
+
+# ── Review ──
+def pending(conn, limit=20):
+    """Pending groups, best first: [(canonical_id, [visit rows of the group's patients])]."""
+    cur = conn.cursor(cursor_factory=NamedTupleCursor)
+    cur.execute("""SELECT canonical_id FROM merge_proposals WHERE status = 'pending'
+                   GROUP BY canonical_id ORDER BY max(score) DESC, canonical_id LIMIT %s""", (limit,))
+    ids = [r.canonical_id for r in cur.fetchall()]
+    cur.execute("""SELECT g.canonical_id, g.patient_id, g.score, g.reasons, r.id, r.collection_date, r.patient_name,
+                          r.patient_phone, r.patient_age, a.answer AS patient_gender, r.patient_referee
+                   FROM (SELECT canonical_id, patient_id, score, reasons FROM merge_proposals
+                         WHERE status = 'pending' AND canonical_id = ANY(%(ids)s::int[])
+                         UNION ALL SELECT c, c, NULL, NULL FROM unnest(%(ids)s::int[]) AS c) g
+                   JOIN responses_compact r ON r.patient_id = g.patient_id
+                   LEFT JOIN answer_codes a ON a.code = r.gender_code
+                   ORDER BY g.canonical_id, g.patient_id, r.collection_date""", {"ids": ids})
+    rows = cur.fetchall()
+    conn.rollback()
+    groups = {c: [] for c in ids}
+    for r in rows:
+        groups[r.canonical_id].append(r)
+    return list(groups.items())
+
+
+def accept(conn, canonical_id, user, patient_ids=None):
+    """Merge the group's pending patients (or just `patient_ids`) into canonical_id. Returns visits moved."""
+    cur = conn.cursor()
+    cur.execute("""UPDATE merge_proposals SET status = 'accepted', decided_by = %s, decided_at = CURRENT_TIMESTAMP
+                   WHERE canonical_id = %s AND status = 'pending' AND (%s::int[] IS NULL OR patient_id = ANY(%s::int[]))
+                   RETURNING patient_id""", (user, canonical_id, patient_ids, patient_ids))
+    merged = [r[0] for r in cur.fetchall()]
+    cur.execute("""INSERT INTO patient_links (patient_id, canonical_id, merged_by)
+                   SELECT unnest(%s::int[]), %s, %s
+                   ON CONFLICT (patient_id) DO UPDATE SET canonical_id = EXCLUDED.canonical_id""",
+                (merged, canonical_id, user))
+    # ids merged earlier into one of these follow them
+    cur.execute("UPDATE patient_links SET canonical_id = %s WHERE canonical_id = ANY(%s::int[])", (canonical_id, merged))
+    cur.execute("UPDATE visits SET patient_id = %s WHERE patient_id = ANY(%s::int[])", (canonical_id, merged))
+    moved = cur.rowcount
+    # the merged records go; their match keys move to patient_links so later visits find the kept one
+    cur.execute("""WITH gone AS (DELETE FROM patients WHERE id = ANY(%s::int[]) RETURNING id, match_key)
+                   UPDATE patient_links l SET match_key = gone.match_key FROM gone WHERE l.patient_id = gone.id""",
+                (merged,))
+    conn.commit()
+    return moved
+
+
+def reject(conn, canonical_id, user):
+    cur = conn.cursor()
+    cur.execute("""UPDATE merge_proposals SET status = 'rejected', decided_by = %s, decided_at = CURRENT_TIMESTAMP
+                   WHERE canonical_id = %s AND status = 'pending'""", (user, canonical_id))
+    conn.commit()
+    return cur.rowcount
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        find(conn)
+    finally:
+        conn.close()
+    sys.exit(0)
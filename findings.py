@@ -0,0 +1,314 @@
+import csv
+import io
+import json
+import math
+import os
+import sys
+import time
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import NamedTupleCursor, execute_values
+
+import rerender
+import rules
+
+# -------------------------
+# Stored findings and re-analysis (tables in migrations/008_findings.sql)
+# -------------------------
+# save_response stores each visit's findings with the digest of the rule set
+# that produced them. When clinical_rules.json changes, reanalyze() brings
+# the stored findings up to date without evaluating every visit again: the
+# old and new rule sets are diffed group by group into a SQL condition that
+# selects only visits whose values fall where the two could disagree (for a
+# threshold moved from 30 to 32 on one field, just the visits in [30, 32)).
+# Those are re-evaluated; the rest are relabelled with the new digest.
+#
+# Work is done in chunks of visit ids, each committed with the visits' new
+# digest, so an interrupted run resumes where it stopped. One run at a time.
+#
+#   python findings.py            re-analyse every visit not current with the rules
+#   python findings.py --status   visits per rule set
+
+FINDINGS_LOCK = 727003  # pg_try_advisory_lock key: one re-analysis at a time
+CHUNK = 5000            # visit ids per transaction
+REPORT_EVERY = 10.0     # seconds between progress lines
+
+_registered = set()     # digests known to be in rule_sets, per process
+
+
+def ensure(conn, rs):
+    """
+    Record the rule set in rule_sets and its urgent answers in urgent_answers
+    (committing). Returns True when it was not there before or the urgent
+    answers changed, i.e. stored findings or urgent flags may now be stale.
+    """
+    if rs.digest in _registered:
+        return False
+    cur = conn.cursor()
+    cur.execute("INSERT INTO rule_sets (digest, version, spec) VALUES (%s, %s, %s) "
+                "ON CONFLICT (digest) DO NOTHING", (rs.digest, rs.version, json.dumps(rs.spec)))
+    new = cur.rowcount == 1
+    reflagged = _sync_urgent(cur, rs.spec)
+    conn.commit()
+    _registered.add(rs.digest)
+    return new or reflagged > 0
+
+
+def urgent_answers(spec):
+    """(question, answer, prefix) for each answer an "urgent" rule tests (its other conditions aside)."""
+    return sorted({(f, v, kind == "answer_prefix")
+                   for g in spec["groups"] for r in g["rules"] if r.get("level") == "urgent"
+                   for kind in ("answer", "answer_prefix") for f, vs in r.get(kind, {}).items() for v in vs})
+
+
+def _sync_urgent(cur, spec):
+    """Point answer_codes.urgent at the rule set's urgent answers (migrations/016). Returns the answers re-flagged."""
+    cur.execute("DELETE FROM urgent_answers")
+    execute_values(cur, "INSERT INTO urgent_answers (question, answer, prefix) VALUES %s "
+                        "ON CONFLICT DO NOTHING", urgent_answers(spec))
+    cur.execute("UPDATE answer_codes SET urgent = answer_is_urgent(question, answer) "
+                "WHERE urgent <> answer_is_urgent(question, answer)")
+    return cur.rowcount
+
+
+def store(cur, response_id, rs, found):
+    """Write a visit's findings and mark it current with `rs` (in the caller's transaction)."""
+    cur.execute("DELETE FROM visit_findings WHERE response_id = %s", (response_id,))
+    if found:
+        execute_values(cur, "INSERT INTO visit_findings "
+                            "(response_id, rule_id, rule_group, level, severity, comment) VALUES %s",
+                       [(response_id, f.rule, f.group, f.level, f.severity, f.comment) for f in found])
+    cur.execute("INSERT INTO visit_analysis (response_id, ruleset, analyzed_at) "
+                "VALUES (%s, %s, CURRENT_TIMESTAMP) ON CONFLICT (response_id) "
+                "DO UPDATE SET ruleset = EXCLUDED.ruleset, analyzed_at = EXCLUDED.analyzed_at",
+                (response_id, rs.digest))
+
+
+# ── Which visits can a rule change affect? ──
+def _column(field, answer=False):
+    """The responses_compact expression a rule field is read from."""
+    if answer:
+        return sql.SQL("r.{}").format(sql.Identifier("gender_code" if field == "patient_gender" else field + "_code"))
+    return sql.SQL("r.{}::numeric").format(sql.Identifier(field))  # REAL compares as the value the app reads
+
+
+def _answers(field, values, prefix=False):
+    test = "starts_with(answer, p)" if prefix else "answer = p"
+    return (sql.SQL("{} IN (SELECT code FROM answer_codes, unnest(%s::text[]) AS p "
+                    "WHERE question = %s AND " + test + ")").format(_column(field, answer=True)),
+            [list(values), field])
+
+
+def _range(field, lo, hi):
+    parts, params = [], []
+    if lo != -math.inf:
+        parts.append(sql.SQL("{} >= %s").format(_column(field)))
+        params.append(lo)
+    if hi != math.inf:
+        parts.append(sql.SQL("{} < %s").format(_column(field)))
+        params.append(hi)
+    return sql.SQL(" AND ").join(parts) if parts else sql.SQL("true"), params
+
+
+def _interval(field, iv):
+    ops = {"lt": "<", "le": "<=", "gt": ">", "ge": ">="}
+    return (sql.SQL(" AND ").join(sql.SQL("{} " + ops[op] + " %s").format(_column(field)) for op in iv),
+            [float(x) for x in iv.values()])
+
+
+def _join(parts, sep):
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return None
+    return (sql.SQL(sep).join(sql.SQL("({})").format(p) for p, _ in parts),
+            [x for _, params in parts for x in params])
+
+
+def _may_match(rule):
+    """A condition true for every visit the rule could match (gender and age are ignored)."""
+    conds = [_interval(f, iv) for f, iv in (rule.get("when") or rule.get("any") or {}).items()]
+    conds += [_answers(f, vs) for f, vs in rule.get("answer", {}).items()]
+    conds += [_answers(f, vs, prefix=True) for f, vs in rule.get("answer_prefix", {}).items()]
+    return _join(conds, " OR " if "any" in rule else " AND ")
+
+
+def _outcome(group, test):
+    """(id, level, comment) of the first rule in `group` whose conditions pass `test`."""
+    for r in (group or {}).get("rules", []):
+        if test(r):
+            return r["id"], r.get("level"), r["comment"]
+    return None
+
+
+def _single_field(a, b):
+    """The one field and condition kind every rule of both groups uses, if that is the case."""
+    keys = set()
+    for g in (a, b):
+        for r in (g or {}).get("rules", []):
+            if "gender" in r or "age" in r:
+                return None
+            keys |= {(kind, f) for kind in ("when", "any", "answer", "answer_prefix") for f in r.get(kind, {})}
+    if len(keys) != 1 or (a and b and a.get("requires") != b.get("requires")):
+        return None
+    return next(iter(keys))
+
+
+def _group_change(a, b):
+    """A condition selecting the visits whose finding for this group can differ between versions a and b."""
+    single = _single_field(a, b)
+    if single and single[0] in ("when", "any"):
+        # one numeric field: compare outcomes segment by segment
+        f = single[1]
+        ivs = [r[k][f] for g in (a, b) for r in (g or {}).get("rules", []) for k in ("when", "any") if k in r]
+        bounds = rules.interval_bounds(ivs)
+        edges = [-math.inf] + bounds + [math.inf]
+        ranges = []
+        for lo, hi in zip(edges, edges[1:]):
+            rep = lo if lo != -math.inf else (hi - 1 if hi != math.inf else 0.0)
+            test = lambda r: rules.interval_holds((r.get("when") or r.get("any"))[f], rep)  # noqa: E731
+            if _outcome(a, test) != _outcome(b, test):
+                if ranges and ranges[-1][1] == lo:
+                    ranges[-1][1] = hi
+                else:
+                    ranges.append([lo, hi])
+        return _join([_range(f, lo, hi) for lo, hi in ranges], " OR ")
+    if single and single[0] == "answer":
+        # one answer field: compare outcomes answer by answer
+        f = single[1]
+        values = {v for g in (a, b) for r in (g or {}).get("rules", []) for v in r["answer"][f]}
+        differ = sorted(v for v in values
+                        if _outcome(a, lambda r: v in r["answer"][f]) != _outcome(b, lambda r: v in r["answer"][f]))
+        return _answers(f, differ) if differ else None
+    return _join([_may_match(r) for g in (a, b) for r in (g or {}).get("rules", [])], " OR ")
+
+
+def affected(old, new):
+    """
+    A (Composable, params) condition on responses_compact r that holds for
+    every visit whose findings under rule spec `new` can differ from those
+    under `old`; None when no visit's can. `old` None means unknown (all visits).
+    """
+    if old is None or old.get("levels") != new.get("levels"):
+        return sql.SQL("true"), []
+    old_g, new_g = ({g["name"]: g for g in s["groups"]} for s in (old, new))
+    return _join([_group_change(old_g.get(n), new_g.get(n))
+                  for n in sorted(set(old_g) | set(new_g)) if old_g.get(n) != new_g.get(n)], " OR ")
+
+
+# ── Re-analysis ──
+def _chunk(cur, rs, ids, where):
+    """Re-evaluate the visits among `ids` that `where` selects. Returns (evaluated, changed)."""
+    if where is None:
+        return 0, 0
+    cond, params = where
+    cur.execute(sql.SQL("SELECT r.id FROM responses_compact r WHERE r.id = ANY(%s) AND ({})").format(cond),
+                [ids] + params)
+    todo = [r[0] for r in cur.fetchall()]
+    if not todo:
+        return 0, 0
+    cur.execute("SELECT response_id, rule_id, comment FROM visit_findings WHERE response_id = ANY(%s)", (todo,))
+    old = {}
+    for rid, rule, comment in cur.fetchall():
+        old.setdefault(rid, set()).add((rule, comment))
+    cur.execute(f"SELECT id, {rerender.FIELDS} FROM responses WHERE id = ANY(%s)", (todo,))
+    recs = [r._asdict() for r in cur.fetchall()]
+    changed, rows = [], []
+    for rec, found in zip(recs, rs.evaluate_many(recs)):
+        if {(f.rule, f.comment) for f in found} != old.get(rec["id"], set()):
+            changed.append(rec["id"])
+            rows += [(rec["id"], f.rule, f.group, f.level, f.severity, f.comment) for f in found]
+    if changed:
+        cur.execute("DELETE FROM visit_findings WHERE response_id = ANY(%s)", (changed,))
+        if rows:
+            buf = io.StringIO()
+            csv.writer(buf).writerows(rows)
+            buf.seek(0)
+            cur.copy_expert("COPY visit_findings (response_id, rule_id, rule_group, level, severity, comment) "
+                            "FROM STDIN WITH (FORMAT csv)", buf)
+    return len(todo), len(changed)
+
+
+def reanalyze(connect, rs=None, chunk=CHUNK, log=print):
+    """
+    Bring every visit's stored findings and urgent flag up to date with `rs`
+    (default: the current rules). Returns {"visits", "evaluated", "changed",
+    "reflagged", "seconds"},
+    or None when another run holds the lock.
+    """
+    rs = rs or rules.current()
+    conn = connect()
+    stats = {"visits": 0, "evaluated": 0, "changed": 0, "reflagged": 0, "seconds": 0.0}
+    t0 = last = time.perf_counter()
+    try:
+        cur = conn.cursor(cursor_factory=NamedTupleCursor)
+        cur.execute("SELECT pg_try_advisory_lock(%s) AS ok", (FINDINGS_LOCK,))
+        if not cur.fetchone().ok:
+            conn.rollback()
+            return None
+        ensure(conn, rs)
+        cur.execute("SELECT visits_urgent_sync() AS n")  # past visits, after a change of urgent answers
+        stats["reflagged"] = cur.fetchone().n
+        cur.execute("""SELECT a.ruleset, s.spec FROM (SELECT DISTINCT ruleset FROM visit_analysis
+                                                      WHERE ruleset <> %s) a
+                       LEFT JOIN rule_sets s ON s.digest = a.ruleset""", (rs.digest,))
+        stale = cur.fetchall()
+        conn.commit()
+        for digest, spec in stale:
+            where = affected(spec, rs.spec)
+            after = 0
+            while True:
+                cur.execute("SELECT response_id FROM visit_analysis WHERE ruleset = %s AND response_id > %s "
+                            "ORDER BY response_id LIMIT %s", (digest, after, chunk))
+                ids = [r.response_id for r in cur.fetchall()]
+                if not ids:
+                    break
+                after = ids[-1]
+                evaluated, changed = _chunk(cur, rs, ids, where)
+                cur.execute("UPDATE visit_analysis SET ruleset = %s, analyzed_at = CURRENT_TIMESTAMP "
+                            "WHERE response_id = ANY(%s) AND ruleset = %s", (rs.digest, ids, digest))
+                conn.commit()
+                stats["visits"] += len(ids)
+                stats["evaluated"] += evaluated
+                stats["changed"] += changed
+                if log and time.perf_counter() - last >= REPORT_EVERY:
+                    last = time.perf_counter()
+                    log(_progress(stats, last - t0))
+        cur.execute("SELECT pg_advisory_unlock(%s)", (FINDINGS_LOCK,))
+        conn.commit()
+    finally:
+        conn.close()
+    stats["seconds"] = round(time.perf_counter() - t0, 2)
+    if log:
+        log(_progress(stats, stats["seconds"]) + f", {stats['reflagged']} urgent flags changed (rules {rs.version}, {rs.digest})")
+    return stats
+
+
+def _progress(s, seconds):
+    rate = s["visits"] / seconds if seconds else 0
+    return (f"{s['visits']} visits ({s['evaluated']} re-evaluated, {s['changed']} changed) "
+            f"in {seconds:.1f} s, {rate:,.0f} visits/s")
+
+
+def status(conn):
+    """[(ruleset digest, version, visits)] for the stored analysis, most visits first."""
+    cur = conn.cursor()
+    cur.execute("""SELECT a.ruleset, s.version, count(*) FROM visit_analysis a
+                   LEFT JOIN rule_sets s ON s.digest = a.ruleset
+                   GROUP BY a.ruleset, s.version ORDER BY count(*) DESC""")
+    rows = cur.fetchall()
+    conn.rollback()
+    return rows
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    dsn = os.environ["DATABASE_URL"]
+    connect = lambda: psycopg2.connect(dsn)  # noqa: E731
+    if "--status" in sys.argv[1:]:
+        current = rules.current().digest
+        for digest, version, n in status(connect()):
+            print(f"{digest or '(never analysed)':16} {version or '':12} {n:>10}{'  current' if digest == current else ''}")
+    elif reanalyze(connect) is None:
+        print("another re-analysis is running")
@@ -0,0 +1,64 @@
+from psycopg2.extras import NamedTupleCursor
+
+import rerender
+
+# -------------------------
+# Report history queries (indexes in migrations/006_report_history.sql)
+# -------------------------
+# Visits newest first, paged by seeking past the (collection_date, id) of the
+# previous page's last row instead of OFFSET, so page 1000 costs what page 1
+# does. Every filter combination is served by one of the 006 indexes; gender,
+# a patient column since 012, is checked per row against the patient's key.
+# Visits without a collection date are not listed.
+
+PAGE_SIZE = 25
+
+
+def page(conn, after=None, size=PAGE_SIZE, start=None, end=None, referee=None, gender=None, urgent=False):
+    """
+    One page of visits. `after` is the (collection_date, id) key returned for
+    the previous page. Returns (rows, key of the next page or None on the last).
+    """
+    cur = conn.cursor(cursor_factory=NamedTupleCursor)
+    cur.execute("""
+        SELECT r.id, r.report_id, r.patient_id, r.collection_date, r.patient_name, r.patient_age,
+               g.answer AS patient_gender, r.patient_referee, r.urgent
+        FROM responses_compact r
+        LEFT JOIN answer_codes g ON g.code = r.gender_code
+        WHERE r.collection_date IS NOT NULL
+          AND (%(after_date)s::date IS NULL OR (r.collection_date, r.id) < (%(after_date)s, %(after_id)s))
+          AND (%(start)s::date IS NULL OR r.collection_date >= %(start)s)
+          AND (%(end)s::date IS NULL OR r.collection_date <= %(end)s)
+          AND (%(referee)s::text IS NULL OR r.patient_referee = %(referee)s)
+          AND (%(gender)s::text IS NULL OR r.gender_code = (SELECT code FROM answer_codes
+                                                           WHERE question = 'patient_gender' AND answer = %(gender)s))
+          AND (NOT %(urgent)s OR r.urgent)
+        ORDER BY r.collection_date DESC, r.id DESC
+        LIMIT %(limit)s""",
+                {"after_date": after[0] if after else None, "after_id": after[1] if after else None,
+                 "start": start, "end": end, "referee": referee or None, "gender": gender or None,
+                 "urgent": bool(urgent), "limit": size + 1})
+    rows = cur.fetchall()
+    conn.rollback()
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, (rows[-1].collection_date, rows[-1].id)
+
+
+def referees(conn):
+    """Referee names for the filter, most visits first (from the dashboard rollup)."""
+    cur = conn.cursor()
+    cur.execute("SELECT referee FROM rollup_referee WHERE visits > 0 ORDER BY visits DESC, referee")
+    names = [r[0] for r in cur.fetchall()]
+    conn.rollback()
+    return names
+
+
+def visit(conn, response_id):
+    """The visit as the dict the submit form builds (for re-rendering its report), or None."""
+    cur = conn.cursor(cursor_factory=NamedTupleCursor)
+    cur.execute(f"SELECT {rerender.FIELDS} FROM responses WHERE id = %s", (response_id,))
+    rec = cur.fetchone()
+    conn.rollback()
+    return rerender.report_data(rec) if rec else None
@@ -0,0 +1,102 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -------------------------
+# Stage latency metrics
+# -------------------------
+# Per-stage latency histograms exported in the Prometheus text format, so the
+# existing Grafana (with a Prometheus data source scraping this endpoint) can
+# chart p50/p95/p99 per stage:
+#
+#   histogram_quantile(0.95, sum by (le, stage) (rate(medreport_stage_seconds_bucket[5m])))
+#
+# Recording is off until start_server() is called; a disabled @timed function
+# costs one attribute check.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+enabled = False
+_lock = threading.Lock()
+_stages = {}  # stage -> [bucket counts..., +Inf count, sum, errors]
+_server = None
+
+
+def observe(stage, seconds, error=False):
+    i = bisect_left(BUCKETS, seconds)
+    with _lock:
+        h = _stages.get(stage)
+        if h is None:
+            h = _stages[stage] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+        h[i] += 1
+        h[-2] += seconds
+        if error:
+            h[-1] += 1
+
+
+def timed(stage):
+    """Decorator recording the wall time of each call under `stage`."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                out = fn(*args, **kwargs)
+            except BaseException:
+                observe(stage, time.perf_counter() - t0, error=True)
+                raise
+            observe(stage, time.perf_counter() - t0)
+            return out
+        return wrapper
+    return deco
+
+
+def render():
+    """Current metrics in the Prometheus text exposition format."""
+    with _lock:
+        snap = {k: list(v) for k, v in _stages.items()}
+    lines = ["# HELP medreport_stage_seconds Wall time of report pipeline stages.",
+             "# TYPE medreport_stage_seconds histogram"]
+    for stage, h in sorted(snap.items()):
+        cum = 0
+        for le, n in zip(BUCKETS + ("+Inf",), h[:len(BUCKETS) + 1]):
+            cum += n
+            lines.append(f'medreport_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cum}')
+        lines.append(f'medreport_stage_seconds_sum{{stage="{stage}"}} {h[-2]:.6f}')
+        lines.append(f'medreport_stage_seconds_count{{stage="{stage}"}} {cum}')
+    lines += ["# HELP medreport_stage_errors_total Stage calls that raised.",
+              "# TYPE medreport_stage_errors_total counter"]
+    for stage, h in sorted(snap.items()):
+        lines.append(f'medreport_stage_errors_total{{stage="{stage}"}} {h[-1]}')
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(port, host="127.0.0.1"):
+    """Serve /metrics on a daemon thread and turn recording on. Idempotent."""
+    global _server, enabled
+    if _server is None:
+        _server = ThreadingHTTPServer((host, int(port)), _Handler)
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    enabled = True
+    return _server
@@ -0,0 +1,66 @@
+import os
+import glob
+
+import psycopg2
+
+# -------------------------
+# Schema migrations
+# -------------------------
+# Plain .sql files in migrations/, applied once each in file-name order.
+# Every file runs in its own transaction together with its bookkeeping row,
+# so a failing migration leaves the schema untouched.
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_LOCK = 727001  # pg_advisory_xact_lock key shared by all app replicas
+
+
+def migration_files():
+    return sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql")))
+
+
+def applied_versions(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    cur.execute("SELECT version FROM schema_migrations")
+    return {r[0] for r in cur.fetchall()}
+
+
+def apply_migrations(conn, log=print, target=None):
+    """
+    Apply pending migrations on an open connection, up to and including
+    `target` when given. Returns the versions applied.
+    """
+    done = []
+    cur = conn.cursor()
+    for path in migration_files():
+        version = os.path.splitext(os.path.basename(path))[0]
+        if target and version > target:
+            break
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK,))
+        if version in applied_versions(cur):
+            conn.commit()
+            continue
+        with open(path, encoding="utf-8") as f:
+            sql = f.read()
+        try:
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        done.append(version)
+        if log:
+            log(f"applied {version}")
+    return done
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        if not apply_migrations(conn):
+            print("schema up to date")
+    finally:
+        conn.close()
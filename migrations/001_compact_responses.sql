@@ -0,0 +1,157 @@
+-- 001: right-sized column types and lookup-coded categorical answers.
+--
+-- The data moves to responses_compact: fixed-width columns first (ordered by
+-- alignment), vitals as SMALLINT/REAL instead of NUMERIC, and the ten
+-- categorical answers as SMALLINT codes into answer_codes.
+-- "responses" becomes a view with the original column list, plus an
+-- INSTEAD OF trigger, so save_response() and the Grafana SQL keep working.
+
+CREATE TABLE IF NOT EXISTS answer_codes (
+    code SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    question VARCHAR(32) NOT NULL,
+    answer TEXT NOT NULL,
+    UNIQUE (question, answer)
+);
+
+-- Code for an answer, registering it on first sight.
+CREATE OR REPLACE FUNCTION answer_code(q TEXT, a TEXT) RETURNS SMALLINT
+LANGUAGE plpgsql AS $$
+DECLARE c SMALLINT;
+BEGIN
+    IF a IS NULL THEN RETURN NULL; END IF;
+    SELECT code INTO c FROM answer_codes WHERE question = q AND answer = a;
+    IF c IS NULL THEN
+        INSERT INTO answer_codes (question, answer) VALUES (q, a)
+        ON CONFLICT (question, answer) DO NOTHING RETURNING code INTO c;
+        IF c IS NULL THEN  -- registered concurrently
+            SELECT code INTO c FROM answer_codes WHERE question = q AND answer = a;
+        END IF;
+    END IF;
+    RETURN c;
+END $$;
+
+CREATE TABLE responses_compact (
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    id INTEGER PRIMARY KEY DEFAULT nextval('responses_id_seq'),
+    patient_id INTEGER,
+    report_id INTEGER,
+    collection_date DATE,
+    report_date DATE,
+    weight REAL,
+    height REAL,
+    bmi REAL,
+    temperature REAL,
+    hemoglobin_level REAL,
+    patient_age SMALLINT,
+    pulse_rate SMALLINT,
+    systolic_blood_pressure SMALLINT,
+    diastolic_blood_pressure SMALLINT,
+    o2_level SMALLINT,
+    gender_code SMALLINT,
+    vision_code SMALLINT,
+    breathing_code SMALLINT,
+    hearing_code SMALLINT,
+    skin_condition_code SMALLINT,
+    oral_health_code SMALLINT,
+    urine_color_code SMALLINT,
+    hair_loss_code SMALLINT,
+    nail_changes_code SMALLINT,
+    cataract_code SMALLINT,
+    patient_name VARCHAR(100),
+    patient_referee VARCHAR(100),
+    patient_phone VARCHAR(20),
+    disabilities TEXT
+);
+
+-- Register every answer already in use, then copy the rows across.
+INSERT INTO answer_codes (question, answer)
+SELECT DISTINCT q, a FROM responses,
+    LATERAL (VALUES ('patient_gender', patient_gender), ('vision', vision),
+                    ('breathing', breathing), ('hearing', hearing),
+                    ('skin_condition', skin_condition), ('oral_health', oral_health),
+                    ('urine_color', urine_color), ('hair_loss', hair_loss),
+                    ('nail_changes', nail_changes), ('cataract', cataract)) AS v(q, a)
+WHERE a IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+INSERT INTO responses_compact
+SELECT r.created_at, r.id, r.patient_id, r.report_id, r.collection_date, r.report_date,
+       r.weight, r.height, r.bmi, r.temperature, r.hemoglobin_level,
+       r.patient_age, r.pulse_rate, r.systolic_blood_pressure, r.diastolic_blood_pressure,
+       r.o2_level, g.code, vi.code, br.code, he.code, sk.code, oh.code, uc.code, hl.code,
+       nc.code, ca.code, r.patient_name, r.patient_referee, r.patient_phone, r.disabilities
+FROM responses r
+LEFT JOIN answer_codes g ON g.question = 'patient_gender' AND g.answer = r.patient_gender
+LEFT JOIN answer_codes vi ON vi.question = 'vision' AND vi.answer = r.vision
+LEFT JOIN answer_codes br ON br.question = 'breathing' AND br.answer = r.breathing
+LEFT JOIN answer_codes he ON he.question = 'hearing' AND he.answer = r.hearing
+LEFT JOIN answer_codes sk ON sk.question = 'skin_condition' AND sk.answer = r.skin_condition
+LEFT JOIN answer_codes oh ON oh.question = 'oral_health' AND oh.answer = r.oral_health
+LEFT JOIN answer_codes uc ON uc.question = 'urine_color' AND uc.answer = r.urine_color
+LEFT JOIN answer_codes hl ON hl.question = 'hair_loss' AND hl.answer = r.hair_loss
+LEFT JOIN answer_codes nc ON nc.question = 'nail_changes' AND nc.answer = r.nail_changes
+LEFT JOIN answer_codes ca ON ca.question = 'cataract' AND ca.answer = r.cataract;
+
+DO $$
+BEGIN
+    IF (SELECT count(*) FROM responses) <> (SELECT count(*) FROM responses_compact) THEN
+        RAISE EXCEPTION 'responses_compact row count does not match responses';
+    END IF;
+END $$;
+
+ALTER SEQUENCE responses_id_seq OWNED BY responses_compact.id;
+DROP TABLE responses;
+
+CREATE INDEX responses_compact_collection_date_idx ON responses_compact (collection_date DESC);
+
+-- Same columns, names and order as the original table. blood_pressure and
+-- patient_age_gender are derived for the older Grafana panels that still use them.
+CREATE VIEW responses AS
+SELECT r.id, r.patient_id, r.report_id, r.collection_date, r.report_date, r.patient_name,
+       r.patient_age, g.answer::VARCHAR(10) AS patient_gender, r.patient_referee,
+       r.patient_phone, r.weight, r.height, r.bmi, r.pulse_rate,
+       r.systolic_blood_pressure, r.diastolic_blood_pressure, r.o2_level, r.temperature,
+       vi.answer::VARCHAR(50) AS vision, br.answer AS breathing, he.answer AS hearing,
+       sk.answer AS skin_condition, oh.answer AS oral_health, uc.answer AS urine_color,
+       hl.answer AS hair_loss, nc.answer AS nail_changes, ca.answer AS cataract,
+       r.disabilities, r.hemoglobin_level, r.created_at,
+       r.systolic_blood_pressure || '/' || r.diastolic_blood_pressure AS blood_pressure,
+       r.patient_age || '/' || g.answer AS patient_age_gender
+FROM responses_compact r
+LEFT JOIN answer_codes g ON g.code = r.gender_code
+LEFT JOIN answer_codes vi ON vi.code = r.vision_code
+LEFT JOIN answer_codes br ON br.code = r.breathing_code
+LEFT JOIN answer_codes he ON he.code = r.hearing_code
+LEFT JOIN answer_codes sk ON sk.code = r.skin_condition_code
+LEFT JOIN answer_codes oh ON oh.code = r.oral_health_code
+LEFT JOIN answer_codes uc ON uc.code = r.urine_color_code
+LEFT JOIN answer_codes hl ON hl.code = r.hair_loss_code
+LEFT JOIN answer_codes nc ON nc.code = r.nail_changes_code
+LEFT JOIN answer_codes ca ON ca.code = r.cataract_code;
+
+ALTER VIEW responses ALTER COLUMN id SET DEFAULT nextval('responses_id_seq');
+ALTER VIEW responses ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION responses_view_write() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM responses_compact WHERE id = OLD.id;
+        RETURN OLD;
+    END IF;
+    INSERT INTO responses_compact VALUES (
+        NEW.created_at, NEW.id, NEW.patient_id, NEW.report_id, NEW.collection_date, NEW.report_date,
+        NEW.weight, NEW.height, NEW.bmi, NEW.temperature, NEW.hemoglobin_level,
+        NEW.patient_age, NEW.pulse_rate, NEW.systolic_blood_pressure,
+        NEW.diastolic_blood_pressure, NEW.o2_level,
+        answer_code('patient_gender', NEW.patient_gender), answer_code('vision', NEW.vision),
+        answer_code('breathing', NEW.breathing), answer_code('hearing', NEW.hearing),
+        answer_code('skin_condition', NEW.skin_condition), answer_code('oral_health', NEW.oral_health),
+        answer_code('urine_color', NEW.urine_color), answer_code('hair_loss', NEW.hair_loss),
+        answer_code('nail_changes', NEW.nail_changes), answer_code('cataract', NEW.cataract),
+        NEW.patient_name, NEW.patient_referee, NEW.patient_phone, NEW.disabilities);
+    RETURN NEW;
+END $$;
+
+CREATE TRIGGER responses_view_write INSTEAD OF INSERT OR DELETE ON responses
+    FOR EACH ROW EXECUTE FUNCTION responses_view_write();
@@ -0,0 +1,71 @@
+-- 002: single-row latest_vitals summary for the Grafana gauge and stat panels.
+--
+-- Kept current by triggers on responses_compact, inside the inserting
+-- transaction, so the panels read one row instead of sorting responses.
+-- "Latest" follows the panels' old ORDER BY collection_date DESC; among rows
+-- with the same date the most recently inserted one wins.
+
+CREATE TABLE latest_vitals (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    response_id INTEGER,
+    collection_date DATE,
+    weight REAL,
+    height REAL,
+    bmi REAL,
+    temperature REAL,
+    pulse_rate SMALLINT,
+    systolic_blood_pressure SMALLINT,
+    diastolic_blood_pressure SMALLINT,
+    o2_level SMALLINT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION latest_vitals_refresh() RETURNS VOID
+LANGUAGE sql AS $$
+    INSERT INTO latest_vitals (id, response_id, collection_date, weight, height, bmi, temperature,
+                               pulse_rate, systolic_blood_pressure, diastolic_blood_pressure, o2_level)
+    SELECT 1, id, collection_date, weight, height, bmi, temperature,
+           pulse_rate, systolic_blood_pressure, diastolic_blood_pressure, o2_level
+    FROM responses_compact
+    ORDER BY collection_date DESC NULLS LAST, id DESC
+    LIMIT 1
+    ON CONFLICT (id) DO UPDATE SET
+        response_id = EXCLUDED.response_id, collection_date = EXCLUDED.collection_date,
+        weight = EXCLUDED.weight, height = EXCLUDED.height, bmi = EXCLUDED.bmi,
+        temperature = EXCLUDED.temperature, pulse_rate = EXCLUDED.pulse_rate,
+        systolic_blood_pressure = EXCLUDED.systolic_blood_pressure,
+        diastolic_blood_pressure = EXCLUDED.diastolic_blood_pressure,
+        o2_level = EXCLUDED.o2_level, updated_at = CURRENT_TIMESTAMP;
+$$;
+
+CREATE OR REPLACE FUNCTION latest_vitals_write() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO latest_vitals (id, response_id, collection_date, weight, height, bmi, temperature,
+                                   pulse_rate, systolic_blood_pressure, diastolic_blood_pressure, o2_level)
+        VALUES (1, NEW.id, NEW.collection_date, NEW.weight, NEW.height, NEW.bmi, NEW.temperature,
+                NEW.pulse_rate, NEW.systolic_blood_pressure, NEW.diastolic_blood_pressure, NEW.o2_level)
+        ON CONFLICT (id) DO UPDATE SET
+            response_id = EXCLUDED.response_id, collection_date = EXCLUDED.collection_date,
+            weight = EXCLUDED.weight, height = EXCLUDED.height, bmi = EXCLUDED.bmi,
+            temperature = EXCLUDED.temperature, pulse_rate = EXCLUDED.pulse_rate,
+            systolic_blood_pressure = EXCLUDED.systolic_blood_pressure,
+            diastolic_blood_pressure = EXCLUDED.diastolic_blood_pressure,
+            o2_level = EXCLUDED.o2_level, updated_at = CURRENT_TIMESTAMP
+        WHERE latest_vitals.collection_date IS NULL
+           OR EXCLUDED.collection_date >= latest_vitals.collection_date;
+    ELSIF OLD.id = (SELECT response_id FROM latest_vitals WHERE id = 1)
+       OR (TG_OP = 'UPDATE'
+           AND NEW.collection_date >= (SELECT collection_date FROM latest_vitals WHERE id = 1)) THEN
+        -- the latest row changed or went away: recompute through the date index
+        DELETE FROM latest_vitals;
+        PERFORM latest_vitals_refresh();
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER latest_vitals_write AFTER INSERT OR UPDATE OR DELETE ON responses_compact
+    FOR EACH ROW EXECUTE FUNCTION latest_vitals_write();
+
+SELECT latest_vitals_refresh();
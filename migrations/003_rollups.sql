@@ -0,0 +1,86 @@
+-- 003: rollup tables for the aggregate dashboard panels.
+--
+-- rollups_refresh() folds the responses_compact rows created since the last
+-- watermark into per-day, per-referee, per-gender/age-bucket and
+-- per-answer counts, then advances the watermark, all in one transaction.
+-- Rows newer than now() - lag are left for the next run so that inserts
+-- still in flight (created_at is set at transaction start) are not skipped.
+-- rollups.py runs it periodically and can verify it against a full recompute.
+
+CREATE TABLE rollup_watermark (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    created_at TIMESTAMP NOT NULL DEFAULT '-infinity',
+    refreshed_at TIMESTAMP
+);
+INSERT INTO rollup_watermark DEFAULT VALUES;
+
+CREATE TABLE rollup_daily (
+    day DATE PRIMARY KEY,
+    visits INTEGER NOT NULL
+);
+
+CREATE TABLE rollup_referee (
+    referee VARCHAR(100) PRIMARY KEY,
+    visits INTEGER NOT NULL
+);
+
+-- gender_code 0 = not recorded; age_bucket is the decade (30 = 30-39), -1 = not recorded
+CREATE TABLE rollup_demographics (
+    gender_code SMALLINT NOT NULL,
+    age_bucket SMALLINT NOT NULL,
+    visits INTEGER NOT NULL,
+    PRIMARY KEY (gender_code, age_bucket)
+);
+
+-- one row per answer code (the code already identifies the question)
+CREATE TABLE rollup_answers (
+    code SMALLINT PRIMARY KEY,
+    visits INTEGER NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION rollups_refresh(lag INTERVAL DEFAULT '1 minute')
+RETURNS TABLE (rows_added BIGINT, watermark TIMESTAMP)
+LANGUAGE plpgsql AS $$
+DECLARE
+    lo TIMESTAMP;
+    hi TIMESTAMP := LOCALTIMESTAMP - lag;
+    n BIGINT;
+BEGIN
+    -- row lock serialises concurrent refreshes
+    SELECT w.created_at INTO lo FROM rollup_watermark w WHERE id = 1 FOR UPDATE;
+    IF hi <= lo THEN
+        RETURN QUERY SELECT 0::BIGINT, lo;
+        RETURN;
+    END IF;
+
+    CREATE TEMP TABLE rollup_batch ON COMMIT DROP AS
+    SELECT * FROM responses_compact r WHERE r.created_at > lo AND r.created_at <= hi;
+    GET DIAGNOSTICS n = ROW_COUNT;
+
+    INSERT INTO rollup_daily AS t (day, visits)
+    SELECT b.collection_date, count(*) FROM rollup_batch b
+    WHERE b.collection_date IS NOT NULL GROUP BY 1
+    ON CONFLICT (day) DO UPDATE SET visits = t.visits + EXCLUDED.visits;
+
+    INSERT INTO rollup_referee AS t (referee, visits)
+    SELECT b.patient_referee, count(*) FROM rollup_batch b
+    WHERE b.patient_referee IS NOT NULL GROUP BY 1
+    ON CONFLICT (referee) DO UPDATE SET visits = t.visits + EXCLUDED.visits;
+
+    INSERT INTO rollup_demographics AS t (gender_code, age_bucket, visits)
+    SELECT COALESCE(b.gender_code, 0), COALESCE(b.patient_age / 10 * 10, -1), count(*)
+    FROM rollup_batch b GROUP BY 1, 2
+    ON CONFLICT (gender_code, age_bucket) DO UPDATE SET visits = t.visits + EXCLUDED.visits;
+
+    INSERT INTO rollup_answers AS t (code, visits)
+    SELECT v.code, count(*) FROM rollup_batch b
+    CROSS JOIN LATERAL (VALUES (b.vision_code), (b.breathing_code), (b.hearing_code),
+                               (b.skin_condition_code), (b.oral_health_code), (b.urine_color_code),
+                               (b.hair_loss_code), (b.nail_changes_code), (b.cataract_code)) AS v(code)
+    WHERE v.code IS NOT NULL GROUP BY 1
+    ON CONFLICT (code) DO UPDATE SET visits = t.visits + EXCLUDED.visits;
+
+    UPDATE rollup_watermark SET created_at = hi, refreshed_at = LOCALTIMESTAMP WHERE id = 1;
+    DROP TABLE rollup_batch;
+    RETURN QUERY SELECT n, hi;
+END $$;
@@ -0,0 +1,45 @@
+-- 004: state shared between app replicas (used when SHARED_STORE is set).
+--
+-- artifacts       report PDFs and submitted data, for the "postgres" object store
+-- jobs            Sheets sync and e-mail delivery, claimed by any replica's worker
+-- id_reservations report/patient IDs handed out from sequences, one open
+--                 reservation per browser session, so replicas never issue the
+--                 same ID and a reconnect to another replica keeps the same one
+
+CREATE TABLE artifacts (
+    key TEXT PRIMARY KEY,
+    content_type TEXT,
+    data BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- PDFs are already compressed
+ALTER TABLE artifacts ALTER COLUMN data SET STORAGE EXTERNAL;
+
+CREATE TABLE jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(32) NOT NULL,
+    payload JSONB NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'failed')),
+    attempts SMALLINT NOT NULL DEFAULT 0,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_by TEXT,
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX jobs_ready_idx ON jobs (run_after) WHERE status = 'pending';
+
+CREATE SEQUENCE report_id_seq;
+CREATE SEQUENCE patient_id_seq;
+-- next values continue after the existing rows, as MAX()+1 did (report IDs start at 1001)
+SELECT setval('report_id_seq', GREATEST(COALESCE((SELECT MAX(report_id) FROM responses_compact), 0) + 1, 1001), false);
+SELECT setval('patient_id_seq', COALESCE((SELECT MAX(patient_id) FROM responses_compact), 0) + 1, false);
+
+CREATE TABLE id_reservations (
+    report_id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL,
+    session_key VARCHAR(64) NOT NULL,
+    reserved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    used_at TIMESTAMP
+);
+CREATE UNIQUE INDEX id_reservations_open_idx ON id_reservations (session_key) WHERE used_at IS NULL;
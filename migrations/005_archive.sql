@@ -0,0 +1,28 @@
+-- 005: content-addressed archive of generated reports and uploaded attachments.
+--
+-- archive_blobs    one row per distinct content (SHA-256), with its codec and
+--                  how many entries point at it; the bytes live in the object
+--                  store under blobs/<hash[:2]>/<hash>
+-- archive_entries  report_id + role ('report', 'upload') -> blob, so the same
+--                  lab PDF attached to many reports is stored once
+
+CREATE TABLE archive_blobs (
+    hash CHAR(64) PRIMARY KEY,
+    codec VARCHAR(8) NOT NULL CHECK (codec IN ('raw', 'deflate', 'zstd')),
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0 CHECK (refcount >= 0),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    released_at TIMESTAMP
+);
+CREATE INDEX archive_blobs_garbage_idx ON archive_blobs (released_at) WHERE refcount = 0;
+
+CREATE TABLE archive_entries (
+    report_id INTEGER NOT NULL,
+    role VARCHAR(16) NOT NULL,
+    hash CHAR(64) NOT NULL REFERENCES archive_blobs (hash),
+    filename TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (report_id, role)
+);
+CREATE INDEX archive_entries_hash_idx ON archive_entries (hash);
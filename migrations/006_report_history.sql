@@ -0,0 +1,62 @@
+-- 006: indexes and an urgent flag for the report history page.
+--
+-- The page lists visits newest first with keyset pagination on
+-- (collection_date, id), optionally filtered by date range, referee, gender
+-- and urgent findings. Each filter has an index in that order, so a page is
+-- one index range scan of page-size rows however many visits there are.
+--
+-- "Urgent" is a visit with an answer the report flags with "The doctor needs
+-- to urgently look at ..." (clinical.analyze_subjective_answers). The answers
+-- are marked in answer_codes and responses_compact.urgent is set from them on
+-- write, so the filter is a partial index rather than a scan over the codes.
+
+ALTER TABLE answer_codes ADD COLUMN urgent BOOLEAN NOT NULL DEFAULT false;
+
+-- register the urgent answers now, so the flag is in place before first use
+INSERT INTO answer_codes (question, answer) VALUES
+    ('hair_loss', 'Yes, severe hair loss'),
+    ('nail_changes', 'Yes, dark streaks'),
+    ('urine_color', 'Brownish/red (seek medical attention)'),
+    ('oral_health', 'Bleeding gums'),
+    ('oral_health', 'Frequent mouth ulcers')
+ON CONFLICT (question, answer) DO NOTHING;
+
+UPDATE answer_codes SET urgent = true
+WHERE (question = 'hair_loss' AND answer = 'Yes, severe hair loss')
+   OR (question = 'nail_changes' AND answer = 'Yes, dark streaks')
+   OR (question = 'urine_color' AND answer LIKE 'Brownish%')
+   OR (question = 'oral_health' AND answer IN ('Bleeding gums', 'Frequent mouth ulcers'));
+
+ALTER TABLE responses_compact ADD COLUMN urgent BOOLEAN NOT NULL DEFAULT false;
+
+-- the flag does not change latest_vitals; skip its per-row trigger for the backfill
+ALTER TABLE responses_compact DISABLE TRIGGER latest_vitals_write;
+UPDATE responses_compact r SET urgent = true
+WHERE EXISTS (SELECT 1 FROM answer_codes a
+              WHERE a.urgent AND a.code IN (r.vision_code, r.breathing_code, r.hearing_code,
+                                            r.skin_condition_code, r.oral_health_code, r.urine_color_code,
+                                            r.hair_loss_code, r.nail_changes_code, r.cataract_code));
+ALTER TABLE responses_compact ENABLE TRIGGER latest_vitals_write;
+
+CREATE OR REPLACE FUNCTION responses_urgent() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.urgent := EXISTS (
+        SELECT 1 FROM answer_codes
+        WHERE urgent AND code IN (NEW.vision_code, NEW.breathing_code, NEW.hearing_code,
+                                  NEW.skin_condition_code, NEW.oral_health_code, NEW.urine_color_code,
+                                  NEW.hair_loss_code, NEW.nail_changes_code, NEW.cataract_code));
+    RETURN NEW;
+END $$;
+
+CREATE TRIGGER responses_urgent
+BEFORE INSERT OR UPDATE OF vision_code, breathing_code, hearing_code, skin_condition_code, oral_health_code,
+                           urine_color_code, hair_loss_code, nail_changes_code, cataract_code
+ON responses_compact FOR EACH ROW EXECUTE FUNCTION responses_urgent();
+
+-- (collection_date DESC) is a prefix of the history index
+DROP INDEX IF EXISTS responses_compact_collection_date_idx;
+CREATE INDEX responses_compact_history_idx ON responses_compact (collection_date DESC, id DESC);
+CREATE INDEX responses_compact_referee_idx ON responses_compact (patient_referee, collection_date DESC, id DESC);
+CREATE INDEX responses_compact_gender_idx ON responses_compact (gender_code, collection_date DESC, id DESC);
+CREATE INDEX responses_compact_urgent_idx ON responses_compact (collection_date DESC, id DESC) WHERE urgent;
@@ -0,0 +1,23 @@
+-- 007: full-text search over visit notes and uploaded attachment text.
+--
+-- responses_compact.notes_tsv  the disabilities/notes field, kept by Postgres
+-- attachment_text              text extracted from uploaded PDFs by a background
+--                              job (search.py), one row per archive blob, so the
+--                              same lab PDF attached to many visits is read once
+-- Both are GIN-indexed; search.search() ranks matches across the two.
+
+ALTER TABLE responses_compact ADD COLUMN notes_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', COALESCE(disabilities, ''))) STORED;
+CREATE INDEX responses_compact_notes_tsv_idx ON responses_compact USING GIN (notes_tsv);
+
+CREATE TABLE attachment_text (
+    hash CHAR(64) PRIMARY KEY,  -- archive_blobs.hash of the uploaded PDF
+    pages SMALLINT,
+    body TEXT NOT NULL,
+    tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', body)) STORED,
+    extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX attachment_text_tsv_idx ON attachment_text USING GIN (tsv);
+
+-- attachment matches are joined back to visits by report_id
+CREATE INDEX responses_compact_report_id_idx ON responses_compact (report_id);
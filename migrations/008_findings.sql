@@ -0,0 +1,57 @@
+-- 008: report findings stored per visit, with the rule set that produced them.
+--
+-- rule_sets       every clinical_rules.json the app has run with, by content
+--                 digest (rules.RuleSet.digest), so a later rule set can be
+--                 diffed against the one a visit was analysed with
+-- visit_analysis  one row per visit: the digest of the rules its findings are
+--                 current for ('' = never analysed). Kept in step with
+--                 responses_compact by a trigger, so visits written by any path
+--                 show up as due for analysis.
+-- visit_findings  the findings themselves (rule, level, comment), for the
+--                 dashboards and for re-analysis (findings.py) to diff against
+--
+-- No foreign keys: visit_analysis is maintained by the trigger instead, which
+-- also removes both rows when a visit is deleted.
+
+CREATE TABLE rule_sets (
+    digest TEXT PRIMARY KEY,
+    version TEXT,
+    spec JSONB NOT NULL,
+    first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE visit_analysis (
+    response_id INTEGER PRIMARY KEY,
+    ruleset TEXT NOT NULL DEFAULT '',
+    analyzed_at TIMESTAMP
+);
+-- re-analysis walks the visits of one stale rule set in id order
+CREATE INDEX visit_analysis_ruleset_idx ON visit_analysis (ruleset, response_id);
+
+CREATE TABLE visit_findings (
+    response_id INTEGER NOT NULL,
+    rule_id TEXT NOT NULL,
+    rule_group TEXT NOT NULL,
+    level TEXT NOT NULL,
+    severity SMALLINT NOT NULL,
+    comment TEXT NOT NULL,
+    PRIMARY KEY (response_id, rule_id)
+);
+CREATE INDEX visit_findings_rule_idx ON visit_findings (rule_id);
+
+INSERT INTO visit_analysis (response_id) SELECT id FROM responses_compact;
+
+CREATE OR REPLACE FUNCTION visit_analysis_track() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM visit_findings WHERE response_id = OLD.id;
+        DELETE FROM visit_analysis WHERE response_id = OLD.id;
+        RETURN OLD;
+    END IF;
+    INSERT INTO visit_analysis (response_id) VALUES (NEW.id) ON CONFLICT DO NOTHING;
+    RETURN NEW;
+END $$;
+
+CREATE TRIGGER visit_analysis_track AFTER INSERT OR DELETE ON responses_compact
+    FOR EACH ROW EXECUTE FUNCTION visit_analysis_track();
@@ -0,0 +1,45 @@
+-- 009: worklist of visits with urgent findings, for the doctors' triage page.
+--
+-- save_response adds a row when a new visit has an urgent finding (triage.py).
+-- Every insert or update takes the next value of triage_seq and NOTIFYs the
+-- 'triage' channel, so a listening page fetches just the rows past the last
+-- seq it saw instead of re-reading the list. Open items are ordered by score
+-- (sum of finding severities) and then by how long they have waited.
+
+CREATE SEQUENCE triage_seq;
+
+CREATE TABLE triage_queue (
+    response_id INTEGER PRIMARY KEY,
+    score SMALLINT NOT NULL,
+    summary TEXT NOT NULL,
+    patient_name VARCHAR(100),
+    queued_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    claimed_by VARCHAR(50),
+    claimed_at TIMESTAMP,
+    resolved_by VARCHAR(50),
+    resolved_at TIMESTAMP,
+    seq BIGINT NOT NULL DEFAULT nextval('triage_seq')
+);
+CREATE INDEX triage_queue_open_idx ON triage_queue (score DESC, queued_at) WHERE resolved_at IS NULL;
+CREATE INDEX triage_queue_seq_idx ON triage_queue (seq);
+
+CREATE OR REPLACE FUNCTION triage_queue_seq() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.seq := nextval('triage_seq');
+    RETURN NEW;
+END $$;
+
+CREATE TRIGGER triage_queue_seq BEFORE UPDATE ON triage_queue
+    FOR EACH ROW EXECUTE FUNCTION triage_queue_seq();
+
+-- one notification per statement; listeners read the changed rows by seq
+CREATE OR REPLACE FUNCTION triage_queue_notify() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('triage', '');
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER triage_queue_notify AFTER INSERT OR UPDATE ON triage_queue
+    FOR EACH STATEMENT EXECUTE FUNCTION triage_queue_notify();
@@ -0,0 +1,14 @@
+-- 010: per-patient running baselines of the vitals.
+--
+-- One row per patient (keyed by baseline.patient_key: a hash of the
+-- normalised phone number and name, since patient_id is issued per visit).
+-- stats holds Welford's (count, mean, M2) for each vital, in the order of
+-- baseline.VITALS, so a visit updates it in O(1) and the variance is
+-- M2 / count. last_response_id is the newest visit folded in.
+
+CREATE TABLE vital_baselines (
+    patient_key UUID PRIMARY KEY,
+    stats REAL[] NOT NULL,
+    last_response_id INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
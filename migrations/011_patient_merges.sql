@@ -0,0 +1,31 @@
+-- 011: duplicate-patient proposals and accepted merges.
+--
+-- Every visit gets a new patient_id, so a returning patient has several.
+-- dedupe.py proposes that a patient_id be merged into a canonical one (the
+-- oldest of the group); a reviewer accepts or rejects each group on the
+-- Duplicates page. Accepting moves the visits to the canonical patient_id and
+-- records the old id in patient_links; rejected pairs are not proposed again.
+
+CREATE TABLE merge_proposals (
+    patient_id INTEGER NOT NULL,
+    canonical_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    reasons TEXT,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'accepted', 'rejected')),
+    proposed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    decided_by VARCHAR(50),
+    decided_at TIMESTAMP,
+    PRIMARY KEY (patient_id, canonical_id)
+);
+CREATE INDEX merge_proposals_pending_idx ON merge_proposals (canonical_id) WHERE status = 'pending';
+
+CREATE TABLE patient_links (
+    patient_id INTEGER PRIMARY KEY,   -- the id the visits had before the merge
+    canonical_id INTEGER NOT NULL,
+    merged_by VARCHAR(50),
+    merged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX patient_links_canonical_idx ON patient_links (canonical_id);
+
+-- per-patient lookups when a merge is applied and on the review page
+CREATE INDEX responses_compact_patient_id_idx ON responses_compact (patient_id);
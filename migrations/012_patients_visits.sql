@@ -0,0 +1,174 @@
+-- 012: patients and visits.
+--
+-- Name, phone and gender were repeated on every visit. They move to patients,
+-- one row per patient_id, and responses_compact becomes visits with a foreign
+-- key to it. Age (at that visit) and referee (who sent the patient to that
+-- camp) stay on the visit. A new visit is linked to an existing patient when
+-- patient_match_key() (normalised phone and name, as in baseline.py) matches,
+-- so returning patients keep one patient_id.
+--
+-- responses_compact and responses stay as views with their old columns for the
+-- modules and Grafana panels that read them; inserts into responses go through
+-- patient_upsert() like save_response() does. The dropped columns' space is
+-- reclaimed as rows are rewritten.
+
+CREATE OR REPLACE FUNCTION patient_match_key(phone TEXT, name TEXT) RETURNS UUID
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN length(p) >= 7 AND n <> '' THEN md5(p || ':' || n)::uuid END
+    FROM (SELECT right(regexp_replace(COALESCE(phone, ''), '\D', '', 'g'), 10) AS p,
+                 regexp_replace(lower(COALESCE(name, '')), '[^a-z]', '', 'g') AS n) s
+$$;
+
+CREATE TABLE patients (
+    id INTEGER PRIMARY KEY DEFAULT nextval('patient_id_seq'),
+    match_key UUID UNIQUE,
+    gender_code SMALLINT,
+    name VARCHAR(100),
+    phone VARCHAR(20),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX patients_phone_idx ON patients (phone);
+
+-- Give match keys to the patients without one. When several share a key (a
+-- returning patient saved before this migration) the newest patient_id gets
+-- it and the Duplicates page can merge the others into it.
+CREATE OR REPLACE FUNCTION patients_assign_keys() RETURNS BIGINT
+LANGUAGE sql AS $$
+    WITH k AS (
+        SELECT DISTINCT ON (key) id, key
+        FROM (SELECT id, patient_match_key(phone, name) AS key FROM patients WHERE match_key IS NULL) s
+        WHERE key IS NOT NULL AND NOT EXISTS (SELECT 1 FROM patients t WHERE t.match_key = s.key)
+        ORDER BY key, id DESC),
+    u AS (UPDATE patients p SET match_key = k.key FROM k WHERE p.id = k.id RETURNING 1)
+    SELECT count(*) FROM u
+$$;
+
+-- a merged patient's key keeps leading to the patient it was merged into
+ALTER TABLE patient_links ADD COLUMN match_key UUID;
+CREATE UNIQUE INDEX patient_links_match_key_idx ON patient_links (match_key);
+
+-- The patient a visit belongs to, created or updated from the visit's details:
+-- the one with the same match key (or merged from one that had it), else a new
+-- patient numbered new_id (from patient_id_seq when that is NULL or taken).
+CREATE OR REPLACE FUNCTION patient_upsert(tel TEXT, full_name TEXT, gender SMALLINT, new_id INTEGER DEFAULT NULL)
+RETURNS INTEGER LANGUAGE plpgsql AS $$
+DECLARE pid INTEGER;
+BEGIN
+    SELECT canonical_id INTO pid FROM patient_links WHERE match_key = patient_match_key(tel, full_name);
+    IF FOUND THEN
+        RETURN pid;
+    END IF;
+    WHILE new_id IS NULL OR EXISTS (SELECT 1 FROM patients WHERE id = new_id) LOOP
+        new_id := nextval('patient_id_seq');
+    END LOOP;
+    INSERT INTO patients AS p (id, match_key, gender_code, name, phone)
+    VALUES (new_id, patient_match_key(tel, full_name), gender, full_name, tel)
+    ON CONFLICT (match_key) DO UPDATE SET
+        gender_code = COALESCE(EXCLUDED.gender_code, p.gender_code), name = EXCLUDED.name,
+        phone = EXCLUDED.phone, updated_at = CURRENT_TIMESTAMP
+    RETURNING p.id INTO pid;
+    RETURN pid;
+END $$;
+
+-- Visits saved without a patient_id become patients of their own.
+SELECT setval('patient_id_seq', GREATEST((SELECT COALESCE(max(patient_id), 0) FROM responses_compact),
+                                         (SELECT last_value FROM patient_id_seq)));
+UPDATE responses_compact SET patient_id = nextval('patient_id_seq') WHERE patient_id IS NULL;
+
+-- Each patient's details as of their latest visit.
+INSERT INTO patients (id, gender_code, name, phone, created_at, updated_at)
+SELECT DISTINCT ON (patient_id) patient_id, gender_code, patient_name, patient_phone,
+       min(created_at) OVER (PARTITION BY patient_id), created_at
+FROM responses_compact
+ORDER BY patient_id, collection_date DESC NULLS LAST, id DESC;
+
+SELECT patients_assign_keys();
+
+DROP VIEW responses;
+ALTER TABLE responses_compact RENAME TO visits;
+ALTER TABLE visits DROP COLUMN gender_code, DROP COLUMN patient_name, DROP COLUMN patient_phone;
+ALTER TABLE visits ALTER COLUMN patient_id SET NOT NULL,
+    ADD CONSTRAINT visits_patient_id_fkey FOREIGN KEY (patient_id) REFERENCES patients (id);
+
+-- a patient's visits, newest first (replaces the 011 index)
+DROP INDEX responses_compact_patient_id_idx;
+CREATE INDEX visits_patient_idx ON visits (patient_id, collection_date DESC, id DESC);
+
+-- The old table's columns. The join is LEFT on the patients key, so queries
+-- that use no patient column skip it.
+CREATE VIEW responses_compact AS
+SELECT v.created_at, v.id, v.patient_id, v.report_id, v.collection_date, v.report_date,
+       v.weight, v.height, v.bmi, v.temperature, v.hemoglobin_level, v.patient_age, v.pulse_rate,
+       v.systolic_blood_pressure, v.diastolic_blood_pressure, v.o2_level, p.gender_code,
+       v.vision_code, v.breathing_code, v.hearing_code, v.skin_condition_code, v.oral_health_code,
+       v.urine_color_code, v.hair_loss_code, v.nail_changes_code, v.cataract_code,
+       p.name AS patient_name, v.patient_referee, p.phone AS patient_phone, v.disabilities,
+       v.urgent, v.notes_tsv
+FROM visits v
+LEFT JOIN patients p ON p.id = v.patient_id;
+
+-- As in 001, now over visits and patients.
+CREATE VIEW responses AS
+SELECT r.id, r.patient_id, r.report_id, r.collection_date, r.report_date, p.name AS patient_name,
+       r.patient_age, g.answer::VARCHAR(10) AS patient_gender, r.patient_referee,
+       p.phone AS patient_phone, r.weight, r.height, r.bmi, r.pulse_rate,
+       r.systolic_blood_pressure, r.diastolic_blood_pressure, r.o2_level, r.temperature,
+       vi.answer::VARCHAR(50) AS vision, br.answer AS breathing, he.answer AS hearing,
+       sk.answer AS skin_condition, oh.answer AS oral_health, uc.answer AS urine_color,
+       hl.answer AS hair_loss, nc.answer AS nail_changes, ca.answer AS cataract,
+       r.disabilities, r.hemoglobin_level, r.created_at,
+       r.systolic_blood_pressure || '/' || r.diastolic_blood_pressure AS blood_pressure,
+       r.patient_age || '/' || g.answer AS patient_age_gender
+FROM visits r
+LEFT JOIN patients p ON p.id = r.patient_id
+LEFT JOIN answer_codes g ON g.code = p.gender_code
+LEFT JOIN answer_codes vi ON vi.code = r.vision_code
+LEFT JOIN answer_codes br ON br.code = r.breathing_code
+LEFT JOIN answer_codes he ON he.code = r.hearing_code
+LEFT JOIN answer_codes sk ON sk.code = r.skin_condition_code
+LEFT JOIN answer_codes oh ON oh.code = r.oral_health_code
+LEFT JOIN answer_codes uc ON uc.code = r.urine_color_code
+LEFT JOIN answer_codes hl ON hl.code = r.hair_loss_code
+LEFT JOIN answer_codes nc ON nc.code = r.nail_changes_code
+LEFT JOIN answer_codes ca ON ca.code = r.cataract_code;
+
+ALTER VIEW responses ALTER COLUMN id SET DEFAULT nextval('responses_id_seq');
+ALTER VIEW responses ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP;
+
+-- A patient_id that already exists is kept (a further visit of that patient);
+-- otherwise the patient is matched or created by patient_upsert().
+CREATE OR REPLACE FUNCTION responses_view_write() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM visits WHERE id = OLD.id;
+        RETURN OLD;
+    END IF;
+    IF NEW.patient_id IS NULL OR NOT EXISTS (SELECT 1 FROM patients WHERE id = NEW.patient_id) THEN
+        NEW.patient_id := patient_upsert(NEW.patient_phone, NEW.patient_name,
+                                         answer_code('patient_gender', NEW.patient_gender), NEW.patient_id);
+    END IF;
+    INSERT INTO visits (created_at, id, patient_id, report_id, collection_date, report_date,
+                        weight, height, bmi, temperature, hemoglobin_level, patient_age, pulse_rate,
+                        systolic_blood_pressure, diastolic_blood_pressure, o2_level,
+                        vision_code, breathing_code, hearing_code, skin_condition_code, oral_health_code,
+                        urine_color_code, hair_loss_code, nail_changes_code, cataract_code,
+                        patient_referee, disabilities)
+    VALUES (NEW.created_at, NEW.id, NEW.patient_id, NEW.report_id, NEW.collection_date, NEW.report_date,
+            NEW.weight, NEW.height, NEW.bmi, NEW.temperature, NEW.hemoglobin_level,
+            NEW.patient_age, NEW.pulse_rate, NEW.systolic_blood_pressure,
+            NEW.diastolic_blood_pressure, NEW.o2_level,
+            answer_code('vision', NEW.vision), answer_code('breathing', NEW.breathing),
+            answer_code('hearing', NEW.hearing), answer_code('skin_condition', NEW.skin_condition),
+            answer_code('oral_health', NEW.oral_health), answer_code('urine_color', NEW.urine_color),
+            answer_code('hair_loss', NEW.hair_loss), answer_code('nail_changes', NEW.nail_changes),
+            answer_code('cataract', NEW.cataract), NEW.patient_referee, NEW.disabilities);
+    RETURN NEW;
+END $$;
+
+CREATE TRIGGER responses_view_write INSTEAD OF INSERT OR DELETE ON responses
+    FOR EACH ROW EXECUTE FUNCTION responses_view_write();
+
+ANALYZE patients;
+ANALYZE visits;
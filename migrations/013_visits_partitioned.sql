@@ -0,0 +1,176 @@
+-- 013: visits partitioned by collection month.
+--
+-- visits_partitioned is visits declared PARTITION BY RANGE (collection_date),
+-- one partition per month (visits_2024_03) and visits_default for visits with
+-- no date, or in a month that has no partition yet. A query bounded to months
+-- that have partitions (a Grafana time range) reads only those months, and
+-- retention detaches whole months instead of deleting rows.
+--
+-- The rows are moved by partitions.py (run as a job by the app, or
+-- `python partitions.py --move`) in id chunks that commit one by one, while
+-- visits stays in use; ids written to visits meanwhile are logged in
+-- visits_move_log. visits_partition_swap() then re-copies those and swaps the
+-- tables in one short transaction. An empty visits (a new install) is swapped
+-- here.
+--
+-- A unique index on a partitioned table has to include collection_date, which
+-- may be NULL, so id has a plain index; ids come from responses_id_seq.
+
+CREATE TABLE visits_partitioned (LIKE visits INCLUDING DEFAULTS INCLUDING GENERATED)
+    PARTITION BY RANGE (collection_date);
+ALTER TABLE visits_partitioned
+    ADD CONSTRAINT visits_patient_id_fkey FOREIGN KEY (patient_id) REFERENCES patients (id);
+CREATE TABLE visits_default PARTITION OF visits_partitioned DEFAULT;
+
+CREATE INDEX visits_id_idx ON visits_partitioned (id);
+CREATE INDEX visits_history_idx ON visits_partitioned (collection_date DESC, id DESC);
+CREATE INDEX visits_referee_idx ON visits_partitioned (patient_referee, collection_date DESC, id DESC);
+CREATE INDEX visits_urgent_idx ON visits_partitioned (collection_date DESC, id DESC) WHERE urgent;
+CREATE INDEX visits_notes_tsv_idx ON visits_partitioned USING GIN (notes_tsv);
+CREATE INDEX visits_report_id_idx ON visits_partitioned (report_id);
+CREATE INDEX visits_patient_history_idx ON visits_partitioned (patient_id, collection_date DESC, id DESC);
+
+-- Insertable columns of a visits table (all but the generated notes_tsv).
+CREATE OR REPLACE FUNCTION visits_columns(tbl TEXT) RETURNS TEXT
+LANGUAGE sql STABLE AS $$
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) FROM pg_attribute
+    WHERE attrelid = tbl::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+$$;
+
+-- Create the partition for the month of `day` (NULL if it exists). Visits of
+-- that month saved while it had none are moved out of visits_default: it is
+-- detached for the move, which drops its copies of the row triggers, so the
+-- move does not count as deleting and re-inserting them.
+CREATE OR REPLACE FUNCTION visits_add_partition(day DATE, parent TEXT DEFAULT 'visits') RETURNS TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    lo DATE := date_trunc('month', day)::date;
+    hi DATE := (date_trunc('month', day) + INTERVAL '1 month')::date;
+    part TEXT := 'visits_' || to_char(day, 'YYYY_MM');
+    cols TEXT := visits_columns(parent);
+BEGIN
+    IF to_regclass(part) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM visits_default WHERE collection_date >= lo AND collection_date < hi) THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', part, parent, lo, hi);
+        RETURN part;
+    END IF;
+    EXECUTE format('ALTER TABLE %I DETACH PARTITION visits_default', parent);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', part, parent, lo, hi);
+    EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM visits_default WHERE collection_date >= %L AND collection_date < %L',
+                   part, cols, cols, lo, hi);
+    DELETE FROM visits_default WHERE collection_date >= lo AND collection_date < hi;
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION visits_default DEFAULT', parent);
+    RETURN part;
+END $$;
+
+-- Partitions for the 12 months before this one (so a dashboard range over the
+-- last year never falls in visits_default), this month and the next `ahead`,
+-- and for earlier months that have visits waiting in visits_default. Returns
+-- the partitions created.
+CREATE OR REPLACE FUNCTION visits_maintain(ahead INTEGER DEFAULT 3, parent TEXT DEFAULT 'visits') RETURNS SETOF TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    this_month DATE := date_trunc('month', current_date)::date;
+    m DATE;
+    part TEXT;
+BEGIN
+    FOR m IN
+        SELECT generate_series(this_month - INTERVAL '12 months', this_month + ahead * INTERVAL '1 month', INTERVAL '1 month')::date
+        UNION
+        SELECT DISTINCT date_trunc('month', collection_date)::date FROM visits_default
+        WHERE collection_date < this_month
+        ORDER BY 1
+    LOOP
+        part := visits_add_partition(m, parent);
+        IF part IS NOT NULL THEN
+            RETURN NEXT part;
+        END IF;
+    END LOOP;
+END $$;
+
+-- Detach the monthly partitions that end on or before `before` and rename them
+-- archived_visits_YYYY_MM, to be dumped and dropped. Their findings go with
+-- them; the dashboard rollups keep counting them. Returns the tables archived.
+CREATE OR REPLACE FUNCTION visits_archive(before DATE) RETURNS SETOF TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    part TEXT;
+BEGIN
+    FOR part IN
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'visits'::regclass AND c.relname ~ '^visits_\d{4}_\d{2}$'
+          AND to_date(substr(c.relname, 8), 'YYYY_MM') + INTERVAL '1 month' <= before
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE visits DETACH PARTITION %I', part);
+        EXECUTE format('DELETE FROM visit_findings WHERE response_id IN (SELECT id FROM %I)', part);
+        EXECUTE format('DELETE FROM visit_analysis WHERE response_id IN (SELECT id FROM %I)', part);
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', part, 'archived_' || part);
+        RETURN NEXT 'archived_' || part;
+    END LOOP;
+END $$;
+
+-- ids inserted, updated or deleted in visits since this migration
+CREATE TABLE visits_move_log (id INTEGER NOT NULL);
+
+CREATE OR REPLACE FUNCTION visits_move_capture() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO visits_move_log VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END);
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER visits_move_capture AFTER INSERT OR UPDATE OR DELETE ON visits
+    FOR EACH ROW EXECUTE FUNCTION visits_move_capture();
+
+-- Finish the move: re-copy the logged rows, check the counts and put
+-- visits_partitioned in place of visits, with its triggers, leaving the old
+-- table as visits_unpartitioned to be dropped. The views are switched first
+-- (to visits_partitioned, which the rename makes visits): a query through
+-- them locks the view before visits, so taking the locks in the same order
+-- cannot deadlock with it. visits is locked for all the rest, as a weaker
+-- lock upgraded for the rename deadlocks with a transaction that read visits
+-- before writing it.
+CREATE OR REPLACE FUNCTION visits_partition_swap() RETURNS BIGINT
+LANGUAGE plpgsql AS $$
+DECLARE
+    cols TEXT := visits_columns('visits_partitioned');
+    n BIGINT;
+BEGIN
+    EXECUTE 'CREATE OR REPLACE VIEW responses_compact AS '
+            || regexp_replace(pg_get_viewdef('responses_compact'::regclass), '\mvisits\M', 'visits_partitioned', 'g');
+    EXECUTE 'CREATE OR REPLACE VIEW responses AS '
+            || regexp_replace(pg_get_viewdef('responses'::regclass), '\mvisits\M', 'visits_partitioned', 'g');
+    LOCK TABLE visits IN ACCESS EXCLUSIVE MODE;
+    DELETE FROM visits_partitioned WHERE id IN (SELECT id FROM visits_move_log);
+    EXECUTE format('INSERT INTO visits_partitioned (%s) SELECT %s FROM visits WHERE id IN (SELECT id FROM visits_move_log)',
+                   cols, cols);
+    GET DIAGNOSTICS n = ROW_COUNT;
+    IF (SELECT count(*) FROM visits) <> (SELECT count(*) FROM visits_partitioned) THEN
+        RAISE EXCEPTION 'visits_partitioned does not have every row of visits yet';
+    END IF;
+
+    ALTER TABLE visits RENAME TO visits_unpartitioned;
+    ALTER TABLE visits_partitioned RENAME TO visits;
+    ALTER SEQUENCE responses_id_seq OWNED BY visits.id;
+    CREATE TRIGGER latest_vitals_write AFTER INSERT OR UPDATE OR DELETE ON visits
+        FOR EACH ROW EXECUTE FUNCTION latest_vitals_write();
+    CREATE TRIGGER responses_urgent
+    BEFORE INSERT OR UPDATE OF vision_code, breathing_code, hearing_code, skin_condition_code, oral_health_code,
+                               urine_color_code, hair_loss_code, nail_changes_code, cataract_code
+    ON visits FOR EACH ROW EXECUTE FUNCTION responses_urgent();
+    CREATE TRIGGER visit_analysis_track AFTER INSERT OR DELETE ON visits
+        FOR EACH ROW EXECUTE FUNCTION visit_analysis_track();
+    RETURN n;
+END $$;
+
+SELECT visits_maintain(3, 'visits_partitioned');
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM visits) THEN
+        PERFORM visits_partition_swap();
+        DROP TABLE visits_unpartitioned, visits_move_log;
+    END IF;
+END $$;
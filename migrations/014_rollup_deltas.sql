@@ -0,0 +1,178 @@
+-- 014: rollups fed by a change log instead of a created_at watermark.
+--
+-- The 003 refresh only added the rows created since its watermark: deletes
+-- and edits of a visit never reached the rollups, and a row whose transaction
+-- began more than the lag before it committed (created_at is the transaction
+-- start) fell behind the watermark and was never counted. Now a row trigger on
+-- visits logs every change in rollup_delta, in the same transaction: +1 with
+-- the new row's keys on insert, -1 with the old row's on delete, both when an
+-- update changes a counted column. rollups_refresh() deletes the committed
+-- log rows and adds them up, so each change is counted exactly once, whenever
+-- it commits. The rollups are rebuilt once here.
+
+CREATE TABLE rollup_delta (
+    day DATE,
+    referee VARCHAR(100),
+    gender_code SMALLINT NOT NULL,   -- 0 = not recorded, as in rollup_demographics
+    age_bucket SMALLINT NOT NULL,    -- -1 = not recorded
+    codes SMALLINT[] NOT NULL,       -- the nine answer codes
+    n SMALLINT NOT NULL              -- +1 or -1
+);
+
+CREATE OR REPLACE FUNCTION rollups_track() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND
+       (OLD.collection_date, OLD.patient_referee, OLD.patient_age, OLD.patient_id,
+        OLD.vision_code, OLD.breathing_code, OLD.hearing_code, OLD.skin_condition_code, OLD.oral_health_code,
+        OLD.urine_color_code, OLD.hair_loss_code, OLD.nail_changes_code, OLD.cataract_code)
+       IS NOT DISTINCT FROM
+       (NEW.collection_date, NEW.patient_referee, NEW.patient_age, NEW.patient_id,
+        NEW.vision_code, NEW.breathing_code, NEW.hearing_code, NEW.skin_condition_code, NEW.oral_health_code,
+        NEW.urine_color_code, NEW.hair_loss_code, NEW.nail_changes_code, NEW.cataract_code) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO rollup_delta VALUES (
+            OLD.collection_date, OLD.patient_referee,
+            COALESCE((SELECT gender_code FROM patients WHERE id = OLD.patient_id), 0),
+            COALESCE(OLD.patient_age / 10 * 10, -1),
+            ARRAY[OLD.vision_code, OLD.breathing_code, OLD.hearing_code, OLD.skin_condition_code,
+                  OLD.oral_health_code, OLD.urine_color_code, OLD.hair_loss_code, OLD.nail_changes_code,
+                  OLD.cataract_code], -1);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO rollup_delta VALUES (
+            NEW.collection_date, NEW.patient_referee,
+            COALESCE((SELECT gender_code FROM patients WHERE id = NEW.patient_id), 0),
+            COALESCE(NEW.patient_age / 10 * 10, -1),
+            ARRAY[NEW.vision_code, NEW.breathing_code, NEW.hearing_code, NEW.skin_condition_code,
+                  NEW.oral_health_code, NEW.urine_color_code, NEW.hair_loss_code, NEW.nail_changes_code,
+                  NEW.cataract_code], 1);
+    END IF;
+    RETURN NULL;
+END $$;
+
+-- Taking the trigger's lock holds off writers until the rebuild below commits.
+CREATE TRIGGER rollups_track AFTER INSERT OR UPDATE OR DELETE ON visits
+    FOR EACH ROW EXECUTE FUNCTION rollups_track();
+
+-- Fold the committed changes into the rollups. Changes still in flight stay
+-- in the log for the next run.
+DROP FUNCTION rollups_refresh(INTERVAL);
+CREATE FUNCTION rollups_refresh() RETURNS TABLE (changes BIGINT, refreshed_at TIMESTAMP)
+LANGUAGE plpgsql AS $$
+DECLARE
+    n BIGINT;
+BEGIN
+    -- row lock serialises concurrent refreshes
+    PERFORM 1 FROM rollup_watermark WHERE id = 1 FOR UPDATE;
+    CREATE TEMP TABLE rollup_batch (LIKE rollup_delta) ON COMMIT DROP;
+    WITH d AS (DELETE FROM rollup_delta RETURNING *)
+    INSERT INTO rollup_batch SELECT * FROM d;
+    GET DIAGNOSTICS n = ROW_COUNT;
+
+    INSERT INTO rollup_daily AS t (day, visits)
+    SELECT b.day, sum(b.n) FROM rollup_batch b WHERE b.day IS NOT NULL GROUP BY 1
+    ON CONFLICT (day) DO UPDATE SET visits = t.visits + EXCLUDED.visits;
+    DELETE FROM rollup_daily WHERE visits = 0 AND day IN (SELECT day FROM rollup_batch);
+
+    INSERT INTO rollup_referee AS t (referee, visits)
+    SELECT b.referee, sum(b.n) FROM rollup_batch b WHERE b.referee IS NOT NULL GROUP BY 1
+    ON CONFLICT (referee) DO UPDATE SET visits = t.visits + EXCLUDED.visits;
+    DELETE FROM rollup_referee WHERE visits = 0 AND referee IN (SELECT referee FROM rollup_batch);
+
+    INSERT INTO rollup_demographics AS t (gender_code, age_bucket, visits)
+    SELECT b.gender_code, b.age_bucket, sum(b.n) FROM rollup_batch b GROUP BY 1, 2
+    ON CONFLICT (gender_code, age_bucket) DO UPDATE SET visits = t.visits + EXCLUDED.visits;
+    DELETE FROM rollup_demographics WHERE visits = 0;
+
+    INSERT INTO rollup_answers AS t (code, visits)
+    SELECT c.code, sum(b.n) FROM rollup_batch b CROSS JOIN LATERAL unnest(b.codes) AS c(code)
+    WHERE c.code IS NOT NULL GROUP BY 1
+    ON CONFLICT (code) DO UPDATE SET visits = t.visits + EXCLUDED.visits;
+    DELETE FROM rollup_answers WHERE visits = 0;
+
+    UPDATE rollup_watermark SET refreshed_at = LOCALTIMESTAMP WHERE id = 1;
+    DROP TABLE rollup_batch;
+    RETURN QUERY SELECT n, LOCALTIMESTAMP;
+END $$;
+
+ALTER TABLE rollup_watermark DROP COLUMN created_at;
+
+-- Rebuild from every visit (the watermark may have skipped some).
+TRUNCATE rollup_daily, rollup_referee, rollup_demographics, rollup_answers;
+INSERT INTO rollup_daily (day, visits)
+SELECT collection_date, count(*) FROM responses_compact WHERE collection_date IS NOT NULL GROUP BY 1;
+INSERT INTO rollup_referee (referee, visits)
+SELECT patient_referee, count(*) FROM responses_compact WHERE patient_referee IS NOT NULL GROUP BY 1;
+INSERT INTO rollup_demographics (gender_code, age_bucket, visits)
+SELECT COALESCE(gender_code, 0), COALESCE(patient_age / 10 * 10, -1), count(*) FROM responses_compact GROUP BY 1, 2;
+INSERT INTO rollup_answers (code, visits)
+SELECT v.code, count(*) FROM responses_compact r
+CROSS JOIN LATERAL (VALUES (r.vision_code), (r.breathing_code), (r.hearing_code),
+                           (r.skin_condition_code), (r.oral_health_code), (r.urine_color_code),
+                           (r.hair_loss_code), (r.nail_changes_code), (r.cataract_code)) AS v(code)
+WHERE v.code IS NOT NULL GROUP BY 1;
+UPDATE rollup_watermark SET refreshed_at = LOCALTIMESTAMP WHERE id = 1;
+
+-- Partition housekeeping (013) must not show up as changes: a new month's
+-- partition is filled while detached and then attached, which fires no row
+-- triggers, and the swap after a move copies visits' triggers, this one
+-- included, from the table it replaces.
+CREATE OR REPLACE FUNCTION visits_add_partition(day DATE, parent TEXT DEFAULT 'visits') RETURNS TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    lo DATE := date_trunc('month', day)::date;
+    hi DATE := (date_trunc('month', day) + INTERVAL '1 month')::date;
+    part TEXT := 'visits_' || to_char(day, 'YYYY_MM');
+    cols TEXT := visits_columns(parent);
+BEGIN
+    IF to_regclass(part) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM visits_default WHERE collection_date >= lo AND collection_date < hi) THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', part, parent, lo, hi);
+        RETURN part;
+    END IF;
+    EXECUTE format('ALTER TABLE %I DETACH PARTITION visits_default', parent);
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED)', part, parent);
+    EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM visits_default WHERE collection_date >= %L AND collection_date < %L',
+                   part, cols, cols, lo, hi);
+    DELETE FROM visits_default WHERE collection_date >= lo AND collection_date < hi;
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', parent, part, lo, hi);
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION visits_default DEFAULT', parent);
+    RETURN part;
+END $$;
+
+CREATE OR REPLACE FUNCTION visits_partition_swap() RETURNS BIGINT
+LANGUAGE plpgsql AS $$
+DECLARE
+    cols TEXT := visits_columns('visits_partitioned');
+    n BIGINT;
+    def TEXT;
+BEGIN
+    EXECUTE 'CREATE OR REPLACE VIEW responses_compact AS '
+            || regexp_replace(pg_get_viewdef('responses_compact'::regclass), '\mvisits\M', 'visits_partitioned', 'g');
+    EXECUTE 'CREATE OR REPLACE VIEW responses AS '
+            || regexp_replace(pg_get_viewdef('responses'::regclass), '\mvisits\M', 'visits_partitioned', 'g');
+    LOCK TABLE visits IN ACCESS EXCLUSIVE MODE;
+    DELETE FROM visits_partitioned WHERE id IN (SELECT id FROM visits_move_log);
+    EXECUTE format('INSERT INTO visits_partitioned (%s) SELECT %s FROM visits WHERE id IN (SELECT id FROM visits_move_log)',
+                   cols, cols);
+    GET DIAGNOSTICS n = ROW_COUNT;
+    IF (SELECT count(*) FROM visits) <> (SELECT count(*) FROM visits_partitioned) THEN
+        RAISE EXCEPTION 'visits_partitioned does not have every row of visits yet';
+    END IF;
+
+    ALTER TABLE visits RENAME TO visits_unpartitioned;
+    ALTER TABLE visits_partitioned RENAME TO visits;
+    ALTER SEQUENCE responses_id_seq OWNED BY visits.id;
+    FOR def IN
+        SELECT pg_get_triggerdef(oid) FROM pg_trigger
+        WHERE tgrelid = 'visits_unpartitioned'::regclass AND NOT tgisinternal AND tgname <> 'visits_move_capture'
+    LOOP
+        EXECUTE regexp_replace(def, ' ON (\S+\.)?visits_unpartitioned ', ' ON \1visits ');
+    END LOOP;
+    RETURN n;
+END $$;
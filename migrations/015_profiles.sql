@@ -0,0 +1,27 @@
+-- 015: submission profiling shared between replicas (used when SHARED_STORE is set).
+--
+-- With several replicas an admin arms the profiler on one of them while the
+-- next submit may land on another, so the armed state and the captures live
+-- here instead of in the process (profiling.use_database()). A replica takes
+-- the armed "next" flag or its every-Nth turn with one UPDATE, so exactly one
+-- submit is profiled for each arming.
+
+CREATE TABLE profile_state (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    next BOOLEAN NOT NULL DEFAULT FALSE,
+    every INTEGER NOT NULL DEFAULT 0,
+    seen INTEGER NOT NULL DEFAULT 0
+);
+INSERT INTO profile_state DEFAULT VALUES;
+
+CREATE TABLE profiles (
+    report_id INTEGER PRIMARY KEY,
+    replica TEXT,
+    captured_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    wall_s REAL,
+    peak_kb REAL,
+    functions JSONB,
+    allocations JSONB,
+    prof BYTEA          -- cProfile dump_stats output
+);
+CREATE INDEX profiles_captured_idx ON profiles (captured_at DESC);
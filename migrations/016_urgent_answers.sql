@@ -0,0 +1,58 @@
+-- 016: the urgent flag follows the rule set.
+--
+-- 006 marked a fixed list of answers urgent in answer_codes. Now the list is
+-- urgent_answers, rewritten from the rules at level "urgent" whenever a rule
+-- set is registered (findings.ensure()), and answer_codes.urgent is computed
+-- from it: for a new answer on insert, for the known ones on every rewrite.
+-- visits.urgent of past visits is brought in line by the re-analysis job
+-- (visits_urgent_sync()). Seeded with 006's list until the app first runs.
+
+CREATE TABLE urgent_answers (
+    question VARCHAR(32) NOT NULL,
+    answer TEXT NOT NULL,
+    prefix BOOLEAN NOT NULL DEFAULT false,   -- answer is a prefix (answer_prefix rules)
+    PRIMARY KEY (question, answer, prefix)
+);
+INSERT INTO urgent_answers (question, answer, prefix) VALUES
+    ('hair_loss', 'Yes, severe hair loss', false),
+    ('nail_changes', 'Yes, dark streaks', false),
+    ('urine_color', 'Brownish', true),
+    ('oral_health', 'Bleeding gums', false),
+    ('oral_health', 'Frequent mouth ulcers', false);
+
+CREATE OR REPLACE FUNCTION answer_is_urgent(q TEXT, a TEXT) RETURNS BOOLEAN
+LANGUAGE sql STABLE AS $$
+    SELECT EXISTS (SELECT 1 FROM urgent_answers u
+                   WHERE u.question = q AND (u.answer = a OR (u.prefix AND starts_with(a, u.answer))))
+$$;
+
+CREATE OR REPLACE FUNCTION answer_codes_urgent() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.urgent := answer_is_urgent(NEW.question, NEW.answer);
+    RETURN NEW;
+END $$;
+
+CREATE TRIGGER answer_codes_urgent BEFORE INSERT ON answer_codes
+    FOR EACH ROW EXECUTE FUNCTION answer_codes_urgent();
+
+UPDATE answer_codes SET urgent = answer_is_urgent(question, answer)
+WHERE urgent <> answer_is_urgent(question, answer);
+
+-- Set visits.urgent from answer_codes where it differs. Returns the visits changed.
+CREATE OR REPLACE FUNCTION visits_urgent_sync() RETURNS BIGINT
+LANGUAGE plpgsql AS $$
+DECLARE
+    n BIGINT;
+BEGIN
+    UPDATE visits v SET urgent = NOT v.urgent
+    WHERE v.urgent <> EXISTS (
+        SELECT 1 FROM answer_codes a
+        WHERE a.urgent AND a.code IN (v.vision_code, v.breathing_code, v.hearing_code,
+                                      v.skin_condition_code, v.oral_health_code, v.urine_color_code,
+                                      v.hair_loss_code, v.nail_changes_code, v.cataract_code));
+    GET DIAGNOSTICS n = ROW_COUNT;
+    RETURN n;
+END $$;
+
+SELECT visits_urgent_sync();
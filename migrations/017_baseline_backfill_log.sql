@@ -0,0 +1,31 @@
+-- 017: visits saved during a baseline backfill, by transaction.
+--
+-- baseline.backfill() scans the visits in one snapshot and then folds in the
+-- visits saved meanwhile. Those were taken as id > max(id) at the start, which
+-- misses a visit whose id was drawn before the scan but committed after it.
+-- Now, while baseline_backfill_running has its row, new visits are logged
+-- with their transaction id, and the backfill folds in the logged visits its
+-- snapshot could not see. The trigger is per statement, so a bulk load pays
+-- one lookup, and nothing is logged when no backfill runs.
+
+CREATE TABLE baseline_backfill_running (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE baseline_backfill_log (
+    response_id INTEGER NOT NULL,
+    xid XID8 NOT NULL DEFAULT pg_current_xact_id()
+);
+
+CREATE OR REPLACE FUNCTION baseline_backfill_capture() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM baseline_backfill_running) THEN
+        INSERT INTO baseline_backfill_log (response_id) SELECT id FROM new_rows;
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER baseline_backfill_capture AFTER INSERT ON visits
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION baseline_backfill_capture();
@@ -0,0 +1,77 @@
+-- 018: the gender recorded at each visit, for the rollups.
+--
+-- 012 moved gender to patients, and rollup_demographics counted each visit
+-- under its patient's gender. A later visit that corrects the gender
+-- (patient_upsert) or a merge of patients (dedupe.accept) then changed the
+-- gender of past visits without changing any visit row, so the rollups kept
+-- the old counts and drifted from a recount. visits.gender_code keeps the
+-- gender as recorded at the visit, like age and referee; it is filled from the
+-- patient on insert and the rollups count by it. The views still show the
+-- patient's current gender.
+
+ALTER TABLE visits ADD COLUMN gender_code SMALLINT;
+DO $$
+BEGIN
+    IF to_regclass('visits_partitioned') IS NOT NULL THEN  -- a move is under way (013)
+        ALTER TABLE visits_partitioned ADD COLUMN gender_code SMALLINT;
+    END IF;
+END $$;
+
+-- fold in what is logged so far; the lock above holds off new changes
+SELECT rollups_refresh();
+
+-- the column does not change latest_vitals; skip its per-row trigger for the backfill
+ALTER TABLE visits DISABLE TRIGGER latest_vitals_write;
+UPDATE visits v SET gender_code = p.gender_code
+FROM patients p WHERE p.id = v.patient_id AND p.gender_code IS NOT NULL;
+ALTER TABLE visits ENABLE TRIGGER latest_vitals_write;
+
+CREATE OR REPLACE FUNCTION visits_gender() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.gender_code IS NULL THEN
+        NEW.gender_code := (SELECT gender_code FROM patients WHERE id = NEW.patient_id);
+    END IF;
+    RETURN NEW;
+END $$;
+
+CREATE TRIGGER visits_gender BEFORE INSERT ON visits
+    FOR EACH ROW EXECUTE FUNCTION visits_gender();
+
+-- As in 014, with the visit's gender; a visit moved to another patient keeps it.
+CREATE OR REPLACE FUNCTION rollups_track() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND
+       (OLD.collection_date, OLD.patient_referee, OLD.patient_age, OLD.gender_code,
+        OLD.vision_code, OLD.breathing_code, OLD.hearing_code, OLD.skin_condition_code, OLD.oral_health_code,
+        OLD.urine_color_code, OLD.hair_loss_code, OLD.nail_changes_code, OLD.cataract_code)
+       IS NOT DISTINCT FROM
+       (NEW.collection_date, NEW.patient_referee, NEW.patient_age, NEW.gender_code,
+        NEW.vision_code, NEW.breathing_code, NEW.hearing_code, NEW.skin_condition_code, NEW.oral_health_code,
+        NEW.urine_color_code, NEW.hair_loss_code, NEW.nail_changes_code, NEW.cataract_code) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO rollup_delta VALUES (
+            OLD.collection_date, OLD.patient_referee, COALESCE(OLD.gender_code, 0),
+            COALESCE(OLD.patient_age / 10 * 10, -1),
+            ARRAY[OLD.vision_code, OLD.breathing_code, OLD.hearing_code, OLD.skin_condition_code,
+                  OLD.oral_health_code, OLD.urine_color_code, OLD.hair_loss_code, OLD.nail_changes_code,
+                  OLD.cataract_code], -1);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO rollup_delta VALUES (
+            NEW.collection_date, NEW.patient_referee, COALESCE(NEW.gender_code, 0),
+            COALESCE(NEW.patient_age / 10 * 10, -1),
+            ARRAY[NEW.vision_code, NEW.breathing_code, NEW.hearing_code, NEW.skin_condition_code,
+                  NEW.oral_health_code, NEW.urine_color_code, NEW.hair_loss_code, NEW.nail_changes_code,
+                  NEW.cataract_code], 1);
+    END IF;
+    RETURN NULL;
+END $$;
+
+-- recount by the visits' gender (the patients' may have drifted from the counts)
+TRUNCATE rollup_demographics;
+INSERT INTO rollup_demographics (gender_code, age_bucket, visits)
+SELECT COALESCE(gender_code, 0), COALESCE(patient_age / 10 * 10, -1), count(*) FROM visits GROUP BY 1, 2;
@@ -0,0 +1,125 @@
+-- 019: archived months in the rollup check, unique visit ids, and findings
+-- kept when a visit moves to another month.
+--
+-- visits_archive() detaches whole months, and the rollups keep counting
+-- them (no trigger fires), while rollups.verify() recounts from visits, so
+-- the two parted after the first archive. The archived visits' rollup keys
+-- are now summed into rollup_archived, in rollup_delta's shape, and
+-- verify() adds them back.
+--
+-- A unique index on a partitioned table must include the partition key, so
+-- 013 left id with a plain index. The ids are now also kept in visit_ids,
+-- whose primary key rejects an id that is taken, concurrent inserts
+-- included (a trigger on visits adds and removes them).
+--
+-- An update that changes the month of collection_date moves the row to
+-- another partition as a delete and an insert, and visit_analysis_track()
+-- took the delete for the end of the visit and dropped its findings. It now
+-- leaves them when the visit is still there.
+
+CREATE TABLE rollup_archived (LIKE rollup_delta);
+ALTER TABLE rollup_archived ALTER COLUMN n TYPE INTEGER;  -- visits per key, not +-1
+
+CREATE OR REPLACE FUNCTION visits_archive(before DATE) RETURNS SETOF TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    part TEXT;
+BEGIN
+    FOR part IN
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'visits'::regclass AND c.relname ~ '^visits_\d{4}_\d{2}$'
+          AND to_date(substr(c.relname, 8), 'YYYY_MM') + INTERVAL '1 month' <= before
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE visits DETACH PARTITION %I', part);
+        EXECUTE format($q$
+            INSERT INTO rollup_archived
+            SELECT collection_date, patient_referee, COALESCE(gender_code, 0), COALESCE(patient_age / 10 * 10, -1),
+                   ARRAY[vision_code, breathing_code, hearing_code, skin_condition_code, oral_health_code,
+                         urine_color_code, hair_loss_code, nail_changes_code, cataract_code], count(*)
+            FROM %I GROUP BY 1, 2, 3, 4, 5$q$, part);
+        EXECUTE format('DELETE FROM visit_findings WHERE response_id IN (SELECT id FROM %I)', part);
+        EXECUTE format('DELETE FROM visit_analysis WHERE response_id IN (SELECT id FROM %I)', part);
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', part, 'archived_' || part);
+        RETURN NEXT 'archived_' || part;
+    END LOOP;
+END $$;
+
+-- months archived before this migration (before 018 too: then by the patient's gender)
+DO $$
+DECLARE
+    part TEXT;
+    gender TEXT;
+BEGIN
+    FOR part IN SELECT relname FROM pg_class WHERE relname ~ '^archived_visits_\d{4}_\d{2}$'
+                  AND relnamespace = (SELECT oid FROM pg_namespace WHERE nspname = current_schema()) LOOP
+        gender := CASE WHEN EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = part::regclass
+                                    AND attname = 'gender_code' AND NOT attisdropped)
+                       THEN 'a.gender_code'
+                       ELSE '(SELECT gender_code FROM patients p WHERE p.id = a.patient_id)' END;
+        EXECUTE format($q$
+            INSERT INTO rollup_archived
+            SELECT collection_date, patient_referee, COALESCE(%s, 0), COALESCE(patient_age / 10 * 10, -1),
+                   ARRAY[vision_code, breathing_code, hearing_code, skin_condition_code, oral_health_code,
+                         urine_color_code, hair_loss_code, nail_changes_code, cataract_code], count(*)
+            FROM %I a GROUP BY 1, 2, 3, 4, 5$q$, gender, part);
+    END LOOP;
+END $$;
+
+-- every visit id in use, archived ones included (they stay taken)
+CREATE TABLE visit_ids (id INTEGER PRIMARY KEY);
+INSERT INTO visit_ids SELECT id FROM visits;
+
+CREATE OR REPLACE FUNCTION visits_id_unique() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM visit_ids WHERE id = OLD.id;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO visit_ids VALUES (NEW.id);  -- raises unique_violation for a taken id
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER visits_id_unique AFTER INSERT OR UPDATE OF id OR DELETE ON visits
+    FOR EACH ROW EXECUTE FUNCTION visits_id_unique();
+
+-- Recount the rollups from the visits and the archived months, as months
+-- archived before this migration were left out by the rebuilds in 014 and
+-- 018. The trigger created above holds off writers; what they logged before
+-- is folded in first.
+SELECT rollups_refresh();
+CREATE TEMP TABLE rollup_all ON COMMIT DROP AS
+SELECT collection_date AS day, patient_referee AS referee, COALESCE(gender_code, 0) AS gender_code,
+       COALESCE(patient_age / 10 * 10, -1) AS age_bucket,
+       ARRAY[vision_code, breathing_code, hearing_code, skin_condition_code, oral_health_code,
+             urine_color_code, hair_loss_code, nail_changes_code, cataract_code] AS codes, count(*) AS n
+FROM visits GROUP BY 1, 2, 3, 4, 5
+UNION ALL
+SELECT * FROM rollup_archived;
+TRUNCATE rollup_daily, rollup_referee, rollup_demographics, rollup_answers;
+INSERT INTO rollup_daily (day, visits)
+SELECT day, sum(n) FROM rollup_all WHERE day IS NOT NULL GROUP BY 1;
+INSERT INTO rollup_referee (referee, visits)
+SELECT referee, sum(n) FROM rollup_all WHERE referee IS NOT NULL GROUP BY 1;
+INSERT INTO rollup_demographics (gender_code, age_bucket, visits)
+SELECT gender_code, age_bucket, sum(n) FROM rollup_all GROUP BY 1, 2;
+INSERT INTO rollup_answers (code, visits)
+SELECT c.code, sum(a.n) FROM rollup_all a CROSS JOIN LATERAL unnest(a.codes) AS c(code)
+WHERE c.code IS NOT NULL GROUP BY 1;
+UPDATE rollup_watermark SET refreshed_at = LOCALTIMESTAMP WHERE id = 1;
+
+CREATE OR REPLACE FUNCTION visit_analysis_track() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM visits WHERE id = OLD.id) THEN  -- not moved to another partition
+            DELETE FROM visit_findings WHERE response_id = OLD.id;
+            DELETE FROM visit_analysis WHERE response_id = OLD.id;
+        END IF;
+        RETURN OLD;
+    END IF;
+    INSERT INTO visit_analysis (response_id) VALUES (NEW.id) ON CONFLICT DO NOTHING;
+    RETURN NEW;
+END $$;
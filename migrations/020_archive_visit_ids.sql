@@ -0,0 +1,41 @@
+-- 020: archive entries keyed by visit instead of report_id.
+--
+-- report_id is not unique: outside SHARED_STORE mode the form takes
+-- MAX(report_id)+1, so two reports saved at once share one. archive_entries
+-- was keyed by it, and the second put replaced the first patient's PDF and
+-- upload, which the success screen, history and search then served for both
+-- visits. Entries are now keyed by the visit (visits.id, as response_id in
+-- visit_findings).
+--
+-- An existing entry goes to the latest visit with its report_id, archived
+-- months included: that visit's put was the last to write it. Entries no
+-- visit has are dropped and their blobs released for archive.py --gc.
+
+ALTER TABLE archive_entries ADD COLUMN response_id INTEGER;
+
+CREATE TEMP TABLE archive_visit ON COMMIT DROP AS
+SELECT report_id, id FROM visits WHERE report_id IS NOT NULL;
+DO $$
+DECLARE
+    part TEXT;
+BEGIN
+    FOR part IN SELECT relname FROM pg_class WHERE relname ~ '^archived_visits_\d{4}_\d{2}$'
+                  AND relnamespace = (SELECT oid FROM pg_namespace WHERE nspname = current_schema()) LOOP
+        EXECUTE format('INSERT INTO archive_visit SELECT report_id, id FROM %I WHERE report_id IS NOT NULL', part);
+    END LOOP;
+END $$;
+
+UPDATE archive_entries e SET response_id = a.id
+FROM (SELECT report_id, max(id) AS id FROM archive_visit GROUP BY 1) a
+WHERE a.report_id = e.report_id;
+
+WITH gone AS (DELETE FROM archive_entries WHERE response_id IS NULL RETURNING hash)
+UPDATE archive_blobs b SET refcount = b.refcount - g.n,
+       released_at = CASE WHEN b.refcount = g.n THEN CURRENT_TIMESTAMP END
+FROM (SELECT hash, count(*) AS n FROM gone GROUP BY 1) g
+WHERE b.hash = g.hash;
+
+ALTER TABLE archive_entries DROP CONSTRAINT archive_entries_pkey;
+ALTER TABLE archive_entries DROP COLUMN report_id;
+ALTER TABLE archive_entries ALTER COLUMN response_id SET NOT NULL;
+ALTER TABLE archive_entries ADD PRIMARY KEY (response_id, role);
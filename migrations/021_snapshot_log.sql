@@ -0,0 +1,78 @@
+-- 021: the analysis snapshot fed by a change log instead of a created_at watermark.
+--
+-- snapshot.py exported the rows created between its last watermark and
+-- now() - 1 minute. A visit whose transaction committed later than that (its
+-- created_at is the transaction start) fell behind the watermark for good,
+-- and edits, deletes, patient merges and archived months never reached the
+-- snapshot. Now every change of a row of responses_compact logs the visit id
+-- in snapshot_log with its transaction id, in the same transaction. An export
+-- records its snapshot in snapshot_exports, and the next one re-exports the
+-- logged visits that snapshot could not see. Log rows every registered export
+-- has seen are deleted.
+
+CREATE TABLE snapshot_log (
+    id INTEGER NOT NULL,
+    xid XID8 NOT NULL DEFAULT pg_current_xact_id()
+);
+
+-- one row per snapshot directory (its absolute path)
+CREATE TABLE snapshot_exports (
+    path TEXT PRIMARY KEY,
+    snap pg_snapshot NOT NULL,
+    exported_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION snapshot_track() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO snapshot_log (id) VALUES (OLD.id);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.id <> OLD.id) THEN
+        INSERT INTO snapshot_log (id) VALUES (NEW.id);
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER snapshot_track AFTER INSERT OR UPDATE OR DELETE ON visits
+    FOR EACH ROW EXECUTE FUNCTION snapshot_track();
+
+-- the patient columns of responses_compact
+CREATE OR REPLACE FUNCTION snapshot_track_patient() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO snapshot_log (id) SELECT id FROM visits WHERE patient_id = NEW.id;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER snapshot_track_patient AFTER UPDATE OF name, phone, gender_code ON patients
+    FOR EACH ROW WHEN ((OLD.name, OLD.phone, OLD.gender_code) IS DISTINCT FROM (NEW.name, NEW.phone, NEW.gender_code))
+    EXECUTE FUNCTION snapshot_track_patient();
+
+-- Archiving detaches months without firing row triggers: log their visits
+-- as removed.
+CREATE OR REPLACE FUNCTION visits_archive(before DATE) RETURNS SETOF TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    part TEXT;
+BEGIN
+    FOR part IN
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'visits'::regclass AND c.relname ~ '^visits_\d{4}_\d{2}$'
+          AND to_date(substr(c.relname, 8), 'YYYY_MM') + INTERVAL '1 month' <= before
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE visits DETACH PARTITION %I', part);
+        EXECUTE format($q$
+            INSERT INTO rollup_archived
+            SELECT collection_date, patient_referee, COALESCE(gender_code, 0), COALESCE(patient_age / 10 * 10, -1),
+                   ARRAY[vision_code, breathing_code, hearing_code, skin_condition_code, oral_health_code,
+                         urine_color_code, hair_loss_code, nail_changes_code, cataract_code], count(*)
+            FROM %I GROUP BY 1, 2, 3, 4, 5$q$, part);
+        EXECUTE format('INSERT INTO snapshot_log (id) SELECT id FROM %I', part);
+        EXECUTE format('DELETE FROM visit_findings WHERE response_id IN (SELECT id FROM %I)', part);
+        EXECUTE format('DELETE FROM visit_analysis WHERE response_id IN (SELECT id FROM %I)', part);
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', part, 'archived_' || part);
+        RETURN NEXT 'archived_' || part;
+    END LOOP;
+END $$;
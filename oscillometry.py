@@ -0,0 +1,159 @@
+import numpy as np
+
+# -------------------------
+# Oscillometric blood pressure estimation
+# -------------------------
+# The cuff is inflated above systolic and deflated slowly. Arterial pulses ride
+# on top of the deflation ramp as small oscillations; their amplitude peaks at
+# the mean arterial pressure (MAP). With the characteristic-ratio method,
+# systolic is the cuff pressure above MAP where the amplitude has fallen to
+# SYSTOLIC_RATIO * max, diastolic the pressure below MAP where it has fallen to
+# DIASTOLIC_RATIO * max.
+
+SYSTOLIC_RATIO = 0.55
+DIASTOLIC_RATIO = 0.85
+
+BASELINE_WINDOW_S = 1.5   # longer than one beat: tracks the deflation ramp only
+SMOOTH_WINDOW_S = 0.1     # removes sensor noise, keeps the pulse upstroke
+MIN_BEAT_INTERVAL_S = 0.3  # 200 bpm
+MAX_BEAT_INTERVAL_S = 2.0  # 30 bpm
+
+
+def _moving_average(x, n):
+    """Centered moving average via cumulative sums (same length as x)."""
+    n = max(int(n), 1)
+    if n == 1:
+        return x.astype(float)
+    pad = n // 2
+    xp = np.pad(x.astype(float), (pad, n - 1 - pad), mode="edge")
+    c = np.cumsum(xp)
+    c = np.concatenate(([0.0], c))
+    return (c[n:] - c[:-n]) / n
+
+
+def _rolling_max(x, n):
+    n = max(int(n), 1)
+    pad = n // 2
+    xp = np.pad(x, (pad, n - 1 - pad), mode="edge")
+    return np.lib.stride_tricks.sliding_window_view(xp, n).max(axis=1)
+
+
+def beat_interval(osc, fs):
+    """Dominant beat period in samples from the FFT autocorrelation of the oscillations."""
+    n = osc.size
+    nfft = 1 << (2 * n - 1).bit_length()
+    spec = np.fft.rfft(osc - osc.mean(), nfft)
+    ac = np.fft.irfft(spec.real ** 2 + spec.imag ** 2, nfft)[:n]
+    lo, hi = int(MIN_BEAT_INTERVAL_S * fs), min(int(MAX_BEAT_INTERVAL_S * fs), n - 1)
+    if hi <= lo:
+        return None
+    return lo + int(np.argmax(ac[lo:hi]))
+
+
+def oscillation_envelope(pressure, fs):
+    """Return (cuff_pressure_at_beat, beat_amplitude, beat_index) for a deflation trace."""
+    p = np.asarray(pressure, dtype=float)
+    baseline = _moving_average(p, BASELINE_WINDOW_S * fs)
+    osc = _moving_average(p, SMOOTH_WINDOW_S * fs) - baseline
+
+    # A beat is a sample that is the maximum of a window ~0.7 beat wide around it
+    period = beat_interval(osc, fs)
+    if not period:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=int)
+    win = int(0.7 * period) | 1
+    peaks = np.flatnonzero((osc == _rolling_max(osc, win)) & (osc > 0))
+    if peaks.size < 3:
+        return np.empty(0), np.empty(0), peaks
+    # drop plateau duplicates closer than one minimum interval
+    keep = np.concatenate(([True], np.diff(peaks) >= win // 2))
+    peaks = peaks[keep]
+
+    # amplitude = peak minus the trough between it and the previous peak
+    troughs = np.minimum.reduceat(osc[:peaks[-1]], np.concatenate(([0], peaks[:-1])))
+    amp = osc[peaks] - troughs
+    amp = _moving_average(amp, 5)  # beat-to-beat smoothing
+    return baseline[peaks], amp, peaks
+
+
+def _crossing(pressures, amps, level):
+    """Interpolated cuff pressure where amps first reaches level, walking away from MAP."""
+    hit = np.flatnonzero(amps <= level)
+    if hit.size == 0:
+        return None
+    i = hit[0]
+    if i == 0:
+        return float(pressures[0])
+    a0, a1 = amps[i - 1], amps[i]
+    frac = (a0 - level) / (a0 - a1) if a0 != a1 else 0.0
+    return float(pressures[i - 1] + frac * (pressures[i] - pressures[i - 1]))
+
+
+def estimate_blood_pressure(pressure, fs, systolic_ratio=SYSTOLIC_RATIO, diastolic_ratio=DIASTOLIC_RATIO):
+    """
+    Estimate MAP, systolic and diastolic (mmHg) from a cuff deflation trace.
+    Returns None when the trace holds too few beats to estimate.
+    """
+    cuff, amp, peaks = oscillation_envelope(pressure, fs)
+    if amp.size < 5:
+        return None
+    order = np.argsort(cuff)[::-1]  # high to low cuff pressure
+    cuff, amp, peaks = cuff[order], amp[order], peaks[order]
+    m = int(np.argmax(amp))
+    a_max = amp[m]
+
+    systolic = _crossing(cuff[m::-1], amp[m::-1], systolic_ratio * a_max)
+    diastolic = _crossing(cuff[m:], amp[m:], diastolic_ratio * a_max)
+    if systolic is None or diastolic is None:
+        return None
+
+    beat_s = np.diff(np.sort(peaks)) / fs
+    pulse = 60.0 / np.median(beat_s) if beat_s.size else None
+    return {
+        "map": round(float(cuff[m]), 1),
+        "systolic_blood_pressure": int(round(systolic)),
+        "diastolic_blood_pressure": int(round(diastolic)),
+        "pulse_rate": int(round(pulse)) if pulse else None,
+    }
+
+
+def apply_to_data(data, pressure, fs):
+    """
+    Fill the BP fields read by analyze_numerical_vitals from a cuff trace.
+    Manual pulse rate is kept when present. Returns the estimate (or None).
+    """
+    est = estimate_blood_pressure(pressure, fs)
+    if est:
+        data["systolic_blood_pressure"] = est["systolic_blood_pressure"]
+        data["diastolic_blood_pressure"] = est["diastolic_blood_pressure"]
+        data["mean_arterial_pressure"] = est["map"]
+        if not data.get("pulse_rate") and est["pulse_rate"]:
+            data["pulse_rate"] = est["pulse_rate"]
+    return est
+
+
+# -------------------------
+# Synthetic traces
+# -------------------------
+def synthetic_trace(systolic=120, diastolic=80, heart_rate=72, fs=100.0,
+                    start=180.0, stop=40.0, rate=3.0, noise=0.3, seed=0):
+    """
+    Reproducible cuff deflation trace whose envelope crosses the characteristic
+    ratios exactly at the given systolic/diastolic. Returns (pressure, fs).
+    """
+    rng = np.random.default_rng(seed)
+    n = int((start - stop) / rate * fs)
+    t = np.arange(n) / fs
+    ramp = start - rate * t
+
+    map_ = diastolic + (systolic - diastolic) / 3.0
+    # asymmetric gaussian: width chosen so env(systolic)=SYSTOLIC_RATIO, env(diastolic)=DIASTOLIC_RATIO
+    w_hi = (systolic - map_) / np.sqrt(-2 * np.log(SYSTOLIC_RATIO))
+    w_lo = (map_ - diastolic) / np.sqrt(-2 * np.log(DIASTOLIC_RATIO))
+    w = np.where(ramp >= map_, w_hi, w_lo)
+    envelope = 3.0 * np.exp(-0.5 * ((ramp - map_) / w) ** 2)
+
+    phase = (heart_rate / 60.0 * t) % 1.0
+    pulse = np.exp(-((phase - 0.15) / 0.08) ** 2) - 0.35 * phase  # sharp upstroke, slow run-off
+    pulse -= pulse.mean()
+    pressure = ramp + envelope * pulse / np.ptp(pulse) + rng.normal(0, noise, n)
+    return pressure, fs
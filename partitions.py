@@ -0,0 +1,185 @@
+import os
+import sys
+import time
+from datetime import date
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+import shared_store
+
+# -------------------------
+# Monthly partitions of visits (migrations/013_visits_partitioned.sql)
+# -------------------------
+# visits is range-partitioned on collection_date, one partition per month.
+# maintain() keeps partitions ready for the next AHEAD months, so a new visit
+# never waits on DDL, and moves visits that landed in visits_default (a month
+# with no partition yet) into their own. archive() detaches whole months for
+# retention: the tables are renamed archived_visits_YYYY_MM and nothing is
+# deleted row by row.
+#
+# A database migrated from an unpartitioned visits is moved by move(): id
+# chunks copied into visits_partitioned, each committed, while the app keeps
+# writing to visits; visits_partition_swap() re-copies the rows changed in
+# the meantime and swaps the tables. An interrupted move resumes. The app runs
+# all this as its "partitions" job, again every EVERY seconds.
+#
+#   python partitions.py                  create the coming months' partitions
+#   python partitions.py --move           move an unpartitioned visits table
+#   python partitions.py --archive DATE   detach the months before DATE
+#   python partitions.py --status         partitions and their row counts
+
+MOVE_LOCK = 727004      # pg_try_advisory_lock key: one move at a time
+AHEAD = 3               # months of partitions kept ready after the current one
+CHUNK = 50000           # visit ids copied per transaction
+SWAP_WAIT = "2s"        # lock_timeout per attempt to swap the tables
+SWAP_TRIES = 30
+EVERY = 24 * 3600       # seconds between runs of the app's partitions job
+REPORT_EVERY = 10.0     # seconds between progress lines
+
+
+def pending(conn):
+    """True while visits_partitioned is waiting for move()."""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('visits_partitioned') IS NOT NULL")
+    waiting = cur.fetchone()[0]
+    if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+    return waiting
+
+
+def maintain(conn, ahead=AHEAD):
+    """Create the partitions this month through `ahead` months on need (committing). Returns their names."""
+    cur = conn.cursor()
+    cur.execute("SELECT visits_maintain(%s, %s)", (ahead, "visits_partitioned" if pending(conn) else "visits"))
+    made = [r[0] for r in cur.fetchall()]
+    conn.commit()
+    return made
+
+
+def archive(conn, before):
+    """Detach the months that end on or before `before` (committing). Returns the archived tables."""
+    cur = conn.cursor()
+    cur.execute("SELECT visits_archive(%s)", (before,))
+    tables = [r[0] for r in cur.fetchall()]
+    conn.commit()
+    return tables
+
+
+def move(connect, chunk=CHUNK, log=print):
+    """
+    Copy visits into visits_partitioned and swap the two. Returns {"visits",
+    "replayed", "seconds"} ("visits": 0 when there was nothing to move), or
+    None when another move holds the lock.
+    """
+    conn = connect()
+    stats = {"visits": 0, "replayed": 0, "seconds": 0.0}
+    t0 = last = time.perf_counter()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (MOVE_LOCK,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return None
+        if not pending(conn):
+            cur.execute("DROP TABLE IF EXISTS visits_unpartitioned, visits_move_log")  # a move stopped after its swap
+            conn.commit()
+            return stats
+        # a partition for every month with visits, so few land in visits_default
+        cur.execute("""SELECT visits_add_partition(m, 'visits_partitioned')
+                       FROM (SELECT DISTINCT date_trunc('month', collection_date)::date AS m FROM visits
+                             WHERE collection_date < date_trunc('month', current_date) + %s * INTERVAL '1 month') s
+                       ORDER BY m""", (AHEAD + 1,))
+        cur.execute("SELECT visits_columns('visits_partitioned'), "
+                    "(SELECT COALESCE(max(id), 0) FROM visits_partitioned), (SELECT COALESCE(max(id), 0) FROM visits)")
+        cols, after, top = cur.fetchone()
+        conn.commit()
+        while after < top:
+            cur.execute(f"INSERT INTO visits_partitioned ({cols}) SELECT {cols} FROM visits "
+                        "WHERE id > %s AND id <= %s", (after, after + chunk))
+            conn.commit()
+            after += chunk
+            stats["visits"] += cur.rowcount
+            if log and time.perf_counter() - last >= REPORT_EVERY:
+                last = time.perf_counter()
+                log(_progress(stats, last - t0) + f", id {min(after, top)} of {top}")
+        stats["replayed"] = _swap(conn)
+        cur.execute("DROP TABLE visits_unpartitioned, visits_move_log")
+        conn.commit()
+        cur.execute("ANALYZE visits")
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MOVE_LOCK,))
+        conn.commit()
+    finally:
+        conn.close()
+    stats["seconds"] = round(time.perf_counter() - t0, 2)
+    if log:
+        log(_progress(stats, stats["seconds"]) + f", {stats['replayed']} changed meanwhile; visits is partitioned")
+    return stats
+
+
+def _swap(conn):
+    """visits_partition_swap(), retried while the app holds locks on visits. Returns the rows re-copied."""
+    cur = conn.cursor()
+    for _ in range(SWAP_TRIES):
+        try:
+            cur.execute("SET LOCAL lock_timeout = %s", (SWAP_WAIT,))
+            cur.execute("SELECT visits_partition_swap()")
+            replayed = cur.fetchone()[0]
+            conn.commit()
+            return replayed
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            time.sleep(1)
+    raise RuntimeError(f"visits stayed locked; swap not done after {SWAP_TRIES} attempts")
+
+
+def _progress(s, seconds):
+    rate = s["visits"] / seconds if seconds else 0
+    return f"{s['visits']} visits copied in {seconds:.1f} s, {rate:,.0f} visits/s"
+
+
+def schedule(conn, delay=0):
+    """Queue the app's partitions job in `delay` seconds, unless one is already waiting."""
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM jobs WHERE kind = 'partitions' AND status = 'pending'")
+    if cur.fetchone() is None:
+        shared_store.enqueue(conn, "partitions", {}, delay)
+    else:
+        conn.rollback()
+
+
+def status(conn):
+    """[(table, bounds, rows)] for the partitions of visits (or visits_partitioned during a move), by bounds."""
+    cur = conn.cursor()
+    cur.execute("""SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), s.n_live_tup
+                   FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                   LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+                   WHERE i.inhparent = COALESCE(to_regclass('visits_partitioned'), to_regclass('visits'))
+                   ORDER BY c.relname = 'visits_default', c.relname""")
+    rows = cur.fetchall()
+    conn.rollback()
+    return rows
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    dsn = os.environ["DATABASE_URL"]
+    connect = lambda: psycopg2.connect(dsn)  # noqa: E731
+    args = sys.argv[1:]
+    if "--move" in args:
+        if move(connect) is None:
+            print("another move is running")
+    elif "--archive" in args:
+        before = date.fromisoformat(args[args.index("--archive") + 1])
+        for table in archive(connect(), before) or ["nothing to archive"]:
+            print(table)
+    elif "--status" in args:
+        conn = connect()
+        if pending(conn):
+            print("visits is not partitioned yet; run with --move")
+        for table, bounds, rows in status(conn):
+            print(f"{table:20} {bounds:60} {rows or 0:>10}")
+    else:
+        for table in maintain(connect()):
+            print("created", table)
@@ -0,0 +1,229 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# -------------------------
+# On-demand profiling of report submissions
+# -------------------------
+# An admin arms the profiler for the next submit, or for every Nth one. The
+# submit handler calls should_profile() and, only if it returns True, runs
+# inside capture(). When nothing is armed the check is a dict lookup and no
+# profiler or tracemalloc hook is installed.
+#
+# The state and captures are per process unless use_database() is called (the
+# app does with SHARED_STORE set): then they live in profile_state/profiles
+# (migration 015), so arming on one replica profiles the next submit on any of
+# them and every replica lists every capture. The armed state is re-read at
+# most every STATE_TTL seconds, so an unarmed submit still costs no query.
+
+PROFILE_DIR = os.path.join("generated_files", "profiles")
+KEEP = 50
+TOP_N = 25
+STATE_TTL = 2.0  # seconds a replica trusts its copy of the shared state
+
+_lock = threading.Lock()
+_capture_lock = threading.Lock()  # one profiler per process (required on 3.12+)
+_state = {"next": False, "every": 0, "seen": 0}
+_results = OrderedDict()  # report_id -> result dict, newest last
+_db = {"connect": None, "replica": None, "read_at": 0.0}
+
+
+def use_database(connect, replica=None):
+    """Share the armed state and the captures through the database (migration 015)."""
+    _db.update(connect=connect, replica=replica, read_at=0.0)
+
+
+def _query(sql, params=(), fetch=True):
+    conn = _db["connect"]()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchall() if fetch else None
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+def _read_state(force=False):
+    if force or time.monotonic() - _db["read_at"] > STATE_TTL:
+        (row,) = _query("SELECT next, every, seen FROM profile_state WHERE id = 1")
+        with _lock:
+            _state.update(next=row[0], every=row[1], seen=row[2])
+            _db["read_at"] = time.monotonic()
+
+
+def arm_next():
+    if _db["connect"]:
+        _query("UPDATE profile_state SET next = TRUE WHERE id = 1", fetch=False)
+        _db["read_at"] = 0.0
+    with _lock:
+        _state["next"] = True
+
+
+def set_every(n):
+    """Profile every n-th submit (0 turns sampling off)."""
+    if _db["connect"]:
+        _query("UPDATE profile_state SET every = %s, seen = 0 WHERE id = 1", (max(int(n), 0),), fetch=False)
+        _db["read_at"] = 0.0
+    with _lock:
+        _state["every"] = max(int(n), 0)
+        _state["seen"] = 0
+
+
+def status():
+    if _db["connect"]:
+        _read_state(force=True)
+    with _lock:
+        return dict(_state)
+
+
+def should_profile():
+    if _db["connect"]:
+        _read_state()
+    if not (_state["next"] or _state["every"]):
+        return False
+    if _db["connect"]:
+        # take the armed flag, or count this submit, for all replicas at once
+        (row,) = _query("""
+            UPDATE profile_state p SET next = FALSE, seen = CASE WHEN o.next THEN o.seen ELSE o.seen + 1 END
+            FROM (SELECT next, every, seen FROM profile_state WHERE id = 1 FOR UPDATE) o
+            WHERE p.id = 1
+            RETURNING o.next OR (o.every > 0 AND mod(o.seen + 1, o.every) = 0), p.next, p.every, p.seen""")
+        with _lock:
+            _state.update(next=row[1], every=row[2], seen=row[3])
+        return row[0]
+    with _lock:
+        if _state["next"]:
+            _state["next"] = False
+            return True
+        if _state["every"]:
+            _state["seen"] += 1
+            return _state["seen"] % _state["every"] == 0
+    return False
+
+
+class Capture:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.skipped = False
+        self.snapshot = None
+        self.wall = 0.0
+        self.peak = 0
+
+    def top_functions(self, n=TOP_N, sort="cumulative"):
+        stats = pstats.Stats(self.profile, stream=io.StringIO()).sort_stats(sort)
+        rows = []
+        for func in stats.fcn_list[:n]:
+            cc, nc, tt, ct, _ = stats.stats[func]
+            file, line, name = func
+            rows.append({"function": f"{name} ({os.path.basename(file)}:{line})",
+                         "calls": nc, "tottime_s": round(tt, 4), "cumtime_s": round(ct, 4)})
+        return rows
+
+    def top_allocations(self, n=TOP_N):
+        if self.snapshot is None:
+            return []
+        return [{"location": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+                 "size_kb": round(s.size / 1024, 1), "blocks": s.count}
+                for s in self.snapshot.statistics("lineno")[:n]]
+
+    def save(self, report_id):
+        """Keep the summary in memory and the raw profile on disk (both in the database when shared)."""
+        if self.skipped:
+            return None
+        if _db["connect"]:
+            return self._save_shared(report_id)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{report_id}.prof")
+        self.profile.dump_stats(path)
+        result = {"report_id": report_id, "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "wall_s": round(self.wall, 3), "peak_kb": round(self.peak / 1024, 1),
+                  "functions": self.top_functions(), "allocations": self.top_allocations(),
+                  "path": path}
+        with _lock:
+            _results[report_id] = result
+            _results.move_to_end(report_id)
+            while len(_results) > KEEP:
+                _results.popitem(last=False)
+        return result
+
+    def _save_shared(self, report_id):
+        with tempfile.NamedTemporaryFile(suffix=".prof", delete=False) as f:
+            path = f.name
+        try:
+            self.profile.dump_stats(path)
+            with open(path, "rb") as f:
+                prof = f.read()
+        finally:
+            os.remove(path)
+        _query("""INSERT INTO profiles (report_id, replica, wall_s, peak_kb, functions, allocations, prof)
+                  VALUES (%s, %s, %s, %s, %s, %s, %s)
+                  ON CONFLICT (report_id) DO UPDATE SET replica = EXCLUDED.replica,
+                      captured_at = CURRENT_TIMESTAMP, wall_s = EXCLUDED.wall_s, peak_kb = EXCLUDED.peak_kb,
+                      functions = EXCLUDED.functions, allocations = EXCLUDED.allocations, prof = EXCLUDED.prof""",
+               (report_id, _db["replica"], round(self.wall, 3), round(self.peak / 1024, 1),
+                json.dumps(self.top_functions()), json.dumps(self.top_allocations()), prof), fetch=False)
+        _query("DELETE FROM profiles WHERE report_id NOT IN "
+               "(SELECT report_id FROM profiles ORDER BY captured_at DESC LIMIT %s)", (KEEP,), fetch=False)
+        return {"report_id": report_id, "replica": _db["replica"]}
+
+
+@contextmanager
+def capture():
+    cap = Capture()
+    if not _capture_lock.acquire(blocking=False):
+        cap.skipped = True  # another submit is being profiled right now
+        yield cap
+        return
+    started_tm = not tracemalloc.is_tracing()
+    try:
+        if started_tm:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        cap.profile.enable()
+        try:
+            yield cap
+        finally:
+            cap.profile.disable()
+            cap.wall = time.perf_counter() - t0
+            cap.snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),))
+            cap.peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if started_tm:
+            tracemalloc.stop()
+        _capture_lock.release()
+
+
+def results():
+    """Stored captures, newest first."""
+    if _db["connect"]:
+        rows = _query("""SELECT report_id, to_char(captured_at, 'YYYY-MM-DD HH24:MI:SS'), wall_s, peak_kb,
+                                functions, allocations, replica
+                         FROM profiles ORDER BY captured_at DESC LIMIT %s""", (KEEP,))
+        return [{"report_id": r[0], "at": r[1], "wall_s": r[2], "peak_kb": r[3], "functions": r[4],
+                 "allocations": r[5], "replica": r[6], "path": None} for r in rows]
+    with _lock:
+        return list(reversed(_results.values()))
+
+
+def raw(report_id):
+    """The cProfile dump of a capture as bytes (None if gone)."""
+    if _db["connect"]:
+        rows = _query("SELECT prof FROM profiles WHERE report_id = %s", (report_id,))
+        return bytes(rows[0][0]) if rows else None
+    path = os.path.join(PROFILE_DIR, f"{report_id}.prof")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,98 @@
+import os
+from fpdf import FPDF
+from PyPDF2 import PdfMerger
+from clinical import calculate_bmi, findings
+
+# PDF rendering and merging. Imported on first submit, not at app start-up:
+# fpdf and PyPDF2 are among the slowest imports of the app.
+
+# ── PDF ──
+class PDF(FPDF):
+    def header(self):
+        self.set_draw_color(0,0,0); self.rect(5,5,200,287)
+        if os.path.exists("assets/kgp_logo.png"): self.image("assets/kgp_logo.png",10,8,25)
+        self.set_font('Times','B',16); self.set_xy(0,10)
+        self.cell(0,10,"Indian Institute of Technology Kharagpur",0,1,'C')
+        self.set_font('Times','B',14)
+        self.cell(0,10,"Solar-Powered Mobile Health Measurement Device",0,1,'C'); self.ln(8)
+    def footer(self):
+        self.set_y(-20); self.set_font('Times','I',10)
+        self.cell(0,10,'~ End of Report ~',0,0,'C')
+    def patient_info(self,l,r):
+        self.set_font('Times','',10); iy=self.get_y()
+        self.multi_cell(95,7,"\n".join(f"{k}: {v}" for k,v in l.items()),0,'L')
+        self.set_y(iy); self.set_x(105)
+        self.multi_cell(95,7,"\n".join(f"{k}: {v}" for k,v in r.items()),0,'L')
+        self.line(10,self.get_y(),200,self.get_y()); self.ln(6)
+    def add_dates(self,l,r):
+        self.set_font('Times','',10); iy=self.get_y()
+        self.multi_cell(95,7,"\n".join(f"{k}: {v}" for k,v in l.items()),0,'L')
+        self.set_y(iy); self.set_x(105)
+        self.multi_cell(95,7,"\n".join(f"{k}: {v}" for k,v in r.items()),0,'L')
+        self.ln(6); self.line(10,self.get_y(),200,self.get_y())
+    def chapter_title(self,t):
+        self.set_font('Times','B',12); self.cell(0,8,t,0,1,'L'); self.ln(4)
+    def test_table_1(self,rows):
+        self.set_font('Times','B',10); cw=[60,40,50,40]
+        for i,h in enumerate(['VITALS','RESULT','REF. RANGE','UNIT']): self.cell(cw[i],7,h,1,0,'C')
+        self.ln(); self.set_font('Times','',9)
+        for r in rows:
+            self.cell(cw[0],7,r['description'],1); self.cell(cw[1],7,str(r.get('result','')),1)
+            self.cell(cw[2],7,r.get('range',''),1); self.cell(cw[3],7,r.get('unit',''),1); self.ln()
+    def test_table_2(self,rows):
+        self.set_font('Times','B',10); cw=[20,120,50]
+        for i,h in enumerate(['Sl.No','QUESTIONS','RESPONSE']): self.cell(cw[i],7,h,1,0,'C')
+        self.ln(); self.set_font('Times','',9)
+        for i,r in enumerate(rows):
+            self.cell(cw[0],7,str(i+1)+'.',1,align='C')
+            self.cell(cw[1],7,r.get('description',''),1); self.cell(cw[2],7,str(r.get('result','')),1); self.ln()
+    def add_comments(self,text):
+        self.set_font('Times','B',12); self.cell(0,10,'Comments:',0,1)
+        self.set_font('Times','',11); self.multi_cell(0,6,text)
+
+def create_medical_report(data,out="generated_files/medical_report.pdf"):
+    os.makedirs(os.path.dirname(out),exist_ok=True)
+    pdf=PDF(); pdf.add_page()
+    pdf.add_dates({'Collection Date':data.get('collection_date','')},{'Report Date':data.get('report_date','')})
+    pdf.patient_info(
+        {'Name':data.get('patient_name',''),'Age':data.get('patient_age',''),
+         'Gender':data.get('patient_gender',''),'Referred By':data.get('patient_referee','')},
+        {'Contact':data.get('patient_phone',''),'Patient ID':str(data.get('patient_ID','')),
+         'Report ID':str(data.get('report_ID',''))})
+    pdf.chapter_title('Body Vitals')
+    bmi=data.get('bmi') or calculate_bmi(data.get('weight'),data.get('height'))
+    data['bmi']=bmi
+    pdf.test_table_1([
+        {'description':'Weight','result':f"{data.get('weight','')} kg",'range':'-','unit':'kg'},
+        {'description':'Height','result':f"{data.get('height','')} cm",'range':'-','unit':'cm'},
+        {'description':'BMI','result':bmi or '','range':'18.5-24.9','unit':'kg/m²'},
+        {'description':'SpO2','result':data.get('o2_level',''),'range':'94-100%','unit':'%'},
+        {'description':'Temperature','result':f"{data.get('temperature','')}°F",'range':'97.8-99.1','unit':'°F'},
+        {'description':'Pulse Rate','result':f"{data.get('pulse_rate','')} bpm",'range':'60-100','unit':'bpm'},
+        {'description':'Systolic BP','result':data.get('systolic_blood_pressure',''),'range':'90-140','unit':'mmHg'},
+        {'description':'Diastolic BP','result':data.get('diastolic_blood_pressure',''),'range':'60-140','unit':'mmHg'},
+        {'description':'Hemoglobin','result':f"{data.get('hemoglobin_level','')} g/dL",'range':'12.0-15.5','unit':'g/dL'},
+    ])
+    pdf.chapter_title('General Health Questions')
+    pdf.test_table_2([
+        {'description':"Can you see clearly without glasses?",'result':data.get('vision','')},
+        {'description':"Do you experience difficulty in breathing?",'result':data.get('breathing','')},
+        {'description':"Do you have any difficulty in hearing?",'result':data.get('hearing','')},
+        {'description':"Do you have any visible skin conditions?",'result':data.get('skin_condition','')},
+        {'description':"Do you experience any mouth conditions?",'result':data.get('oral_health','')},
+        {'description':"What is your usual urine colour?",'result':data.get('urine_color','')},
+        {'description':"Have you noticed significant hair loss recently?",'result':data.get('hair_loss','')},
+        {'description':"Have you noticed any unusual changes in your nail colour?",'result':data.get('nail_changes','')},
+        {'description':"Have you been diagnosed with or noticed signs of cataract?",'result':data.get('cataract','')},
+        {'description':"Do you have any physical disabilities?",'result':data.get('disabilities','')},
+    ])
+    all_c = [f.comment for f in findings(data)]+list(data.get('baseline_comments') or [])
+    if all_c: pdf.add_comments(". ".join(all_c)+".")
+    pdf.output(out); return out
+
+def merge_pdf(report_path,upload_bytes,upload_path="generated_files/uploaded.pdf",
+              out="generated_files/merged_report.pdf"):
+    os.makedirs(os.path.dirname(upload_path),exist_ok=True)
+    with open(upload_path,"wb") as f: f.write(upload_bytes)
+    merger=PdfMerger(); merger.append(report_path); merger.append(upload_path)
+    merger.write(out); merger.close(); return out
@@ -0,0 +1,89 @@
+import os
+import sys
+import tempfile
+import time
+
+import psycopg2
+
+import archive
+import dbstream
+import shared_store
+
+# -------------------------
+# Batch re-rendering of report PDFs into the archive (see archive.py)
+# -------------------------
+# Streams the selected visits from responses through a server-side cursor
+# (dbstream) and renders each with report_pdf into a scratch directory, so
+# memory stays flat over any date range. Useful after a template change, or to
+# archive reports made before the archive existed (--missing).
+#
+#   python rerender.py [--from 2024-01-01] [--to 2024-12-31] [--missing] [--itersize 500]
+
+FIELDS = ("id, patient_id, report_id, collection_date, report_date, patient_name, patient_age, "
+          "patient_gender, patient_referee, patient_phone, weight, height, bmi, pulse_rate, "
+          "systolic_blood_pressure, diastolic_blood_pressure, o2_level, temperature, vision, "
+          "breathing, hearing, skin_condition, oral_health, urine_color, hair_loss, nail_changes, "
+          "cataract, disabilities, hemoglobin_level")
+
+
+def report_data(rec):
+    """A responses row as the dict the submit form builds."""
+    data = rec._asdict()
+    data["visit_ID"] = data.pop("id")
+    data["patient_ID"], data["report_ID"] = data.pop("patient_id"), data.pop("report_id")
+    for k in ("collection_date", "report_date"):
+        if data[k] is not None:
+            data[k] = data[k].strftime("%Y-%m-%d")
+    return {k: ("" if v is None else v) for k, v in data.items()}
+
+
+def visits(conn, start=None, end=None, missing=False, itersize=dbstream.ITERSIZE):
+    """Stream the visits to render, oldest first."""
+    sql = f"""SELECT {FIELDS} FROM responses r
+              WHERE (%(start)s::date IS NULL OR collection_date >= %(start)s)
+                AND (%(end)s::date IS NULL OR collection_date <= %(end)s)
+                AND report_id IS NOT NULL"""
+    if missing:
+        sql += """ AND NOT EXISTS (SELECT 1 FROM archive_entries e
+                                   WHERE e.response_id = r.id AND e.role = 'report')"""
+    return dbstream.stream(conn, sql + " ORDER BY collection_date, id",
+                           {"start": start, "end": end}, itersize)
+
+
+def rerender(conn, arc, start=None, end=None, missing=False, itersize=dbstream.ITERSIZE, log=print, every=500):
+    """Render and archive every selected visit. Returns (rendered, failed)."""
+    import report_pdf
+    done = failed = 0
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="rerender_") as workdir:
+        out = os.path.join(workdir, "medical_report.pdf")
+        for rec in visits(conn, start, end, missing, itersize):
+            try:
+                report_pdf.create_medical_report(report_data(rec), out)
+                with open(out, "rb") as f:
+                    arc.put(rec.id, "report", f.read(), "medical_report.pdf")
+                done += 1
+            except Exception as e:
+                failed += 1
+                if log:
+                    log(f"report {rec.report_id}: {e}")
+            if log and (done + failed) % every == 0:
+                log(f"{done + failed} reports, {(done + failed) / (time.perf_counter() - t0):.0f}/s")
+    conn.rollback()  # end the streaming transaction
+    return done, failed
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    dsn = os.environ["DATABASE_URL"]
+    args = sys.argv[1:]
+
+    def opt(flag, default=None):
+        return args[args.index(flag) + 1] if flag in args else default
+
+    connect = lambda: psycopg2.connect(dsn)  # noqa: E731
+    spec = os.environ.get("SHARED_STORE") or "dir:generated_files/archive"
+    arc = archive.Archive(shared_store.open_store(spec, connect), connect)
+    print("rendered: %s, failed: %s" % rerender(connect(), arc, opt("--from"), opt("--to"), "--missing" in args,
+                                               int(opt("--itersize", dbstream.ITERSIZE))))
@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+
+import psycopg2
+
+# -------------------------
+# Dashboard rollups (see migrations/003_rollups.sql and 014_rollup_deltas.sql)
+# -------------------------
+# The aggregation itself lives in the database: a trigger on visits logs each
+# change in rollup_delta and rollups_refresh() folds the committed log into
+# the rollup tables. This module is the background job around it plus a
+# consistency check.
+
+# rollup table -> (key columns, full recompute over the visits, the same from a log table:
+# rollup_delta, or rollup_archived for archived months); demographics count the
+# gender recorded at the visit (migrations/018)
+FULL_RECOMPUTE = {
+    "rollup_daily": ("day", """
+        SELECT collection_date AS day, count(*) AS visits FROM responses_compact
+        WHERE collection_date IS NOT NULL GROUP BY 1""", """
+        SELECT day, n AS visits FROM {log} WHERE day IS NOT NULL"""),
+    "rollup_referee": ("referee", """
+        SELECT patient_referee AS referee, count(*) AS visits FROM responses_compact
+        WHERE patient_referee IS NOT NULL GROUP BY 1""", """
+        SELECT referee, n AS visits FROM {log} WHERE referee IS NOT NULL"""),
+    "rollup_demographics": ("gender_code, age_bucket", """
+        SELECT COALESCE(gender_code, 0) AS gender_code,
+               COALESCE(patient_age / 10 * 10, -1) AS age_bucket, count(*) AS visits
+        FROM visits GROUP BY 1, 2""", """
+        SELECT gender_code, age_bucket, n AS visits FROM {log}"""),
+    "rollup_answers": ("code", """
+        SELECT v.code, count(*) AS visits FROM responses_compact r
+        CROSS JOIN LATERAL (VALUES (r.vision_code), (r.breathing_code), (r.hearing_code),
+                                   (r.skin_condition_code), (r.oral_health_code), (r.urine_color_code),
+                                   (r.hair_loss_code), (r.nail_changes_code), (r.cataract_code)) AS v(code)
+        WHERE v.code IS NOT NULL GROUP BY 1""", """
+        SELECT c.code, d.n AS visits FROM {log} d CROSS JOIN LATERAL unnest(d.codes) AS c(code)
+        WHERE c.code IS NOT NULL"""),
+}
+
+
+def refresh(conn):
+    """Fold the changes logged since the last refresh into the rollups. Returns (changes, refreshed_at)."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT * FROM rollups_refresh()")
+        out = cur.fetchone()
+        conn.commit()
+        return out
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def verify(conn):
+    """
+    Compare every rollup, plus the changes not folded in yet, with a full
+    recompute (plus the archived months, which the rollups keep counting).
+    Returns {table: number of differing rows}; all zeros means consistent.
+    """
+    conn.rollback()
+    cur = conn.cursor()
+    # repeatable read: the rollups, the log and the recompute see the same snapshot
+    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    try:
+        diffs = {}
+        for table, (keys, full_sql, delta_sql) in FULL_RECOMPUTE.items():
+            cur.execute(f"""
+                WITH full_ AS (SELECT {keys}, sum(visits) AS visits
+                               FROM ({full_sql} UNION ALL {delta_sql.format(log="rollup_archived")}) u
+                               GROUP BY {keys}),
+                rolled AS (SELECT {keys}, sum(visits) AS visits
+                           FROM (SELECT {keys}, visits FROM {table} UNION ALL {delta_sql.format(log="rollup_delta")}) u
+                           GROUP BY {keys} HAVING sum(visits) <> 0)
+                SELECT count(*) FROM (
+                    (SELECT {keys}, visits FROM rolled EXCEPT SELECT {keys}, visits FROM full_)
+                    UNION ALL
+                    (SELECT {keys}, visits FROM full_ EXCEPT SELECT {keys}, visits FROM rolled)
+                ) d""")
+            diffs[table] = cur.fetchone()[0]
+        return diffs
+    finally:
+        conn.rollback()
+
+
+def run_forever(conn, every=60, log=print):
+    while True:
+        try:
+            n, _ = refresh(conn)
+            if log and n:
+                log(f"rollups: {n} changes folded in")
+        except psycopg2.Error as e:
+            if log:
+                log(f"rollups: refresh failed: {e}")
+        time.sleep(every)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    args = sys.argv[1:]
+    if "--verify" in args:
+        diffs = verify(conn)
+        print(diffs)
+        sys.exit(1 if any(diffs.values()) else 0)
+    elif "--every" in args:
+        run_forever(conn, every=float(args[args.index("--every") + 1]))
+    else:
+        print("changes folded in: %s, at %s" % refresh(conn))
@@ -0,0 +1,348 @@
+import bisect
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+# -------------------------
+# Clinical findings rule engine (rules in clinical_rules.json)
+# -------------------------
+# The report comments used to be if-chains in clinical.py (and a diverging
+# copy in app_v7). They are now data: groups of rules, each rule a set of
+# conditions on vitals (intervals) or questionnaire answers, optionally
+# limited by gender and age, with a comment template and an urgency level.
+# Within a group the first matching rule wins, like the old if/elif chains.
+#
+# Compiling turns the file into lookup tables:
+#   - every distinct condition gets a bit;
+#   - each numeric field becomes a sorted list of interval bounds plus, per
+#     segment between bounds, the bits of that field's conditions that hold
+#     there, so one bisect yields all of them (the intervals are fixed, so a
+#     segment table does what an interval tree would, with less work per query);
+#   - each answer field becomes a dict answer -> bits;
+#   - every (gender, age segment) context gets its own list of active rules.
+# A record then costs one bisect or dict lookup per field and a mask test
+# per candidate rule. current() recompiles when the file changes.
+#
+#   python rules.py [FILE]    compile, print the version and time an evaluation
+
+RULES_PATH = os.environ.get("CLINICAL_RULES") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "clinical_rules.json")
+CHECK_EVERY = 1.0  # seconds between checks of the file's mtime
+
+Finding = namedtuple("Finding", "rule group kind level severity comment")
+
+_OPS = ("lt", "le", "gt", "ge")
+
+
+def number(v):
+    """A vital as float, or None when it was not measured (missing, blank, 0) or unreadable."""
+    if v is None or v == "":
+        return None
+    try:
+        f = float(str(v).replace("%", "").strip()) if isinstance(v, str) else float(v)
+    except (TypeError, ValueError):
+        return None
+    return f if f and not math.isnan(f) else None
+
+
+def interval_holds(interval, v):
+    return all((op != "lt" or v < x) and (op != "le" or v <= x) and
+               (op != "gt" or v > x) and (op != "ge" or v >= x) for op, x in interval.items())
+
+
+def interval_bounds(intervals):
+    """
+    Sorted bounds b such that every interval is constant on each segment
+    [b[i-1], b[i]); a value's segment is bisect_right(bounds, v).
+    """
+    out = set()
+    for iv in intervals:
+        for op, x in iv.items():
+            if op not in _OPS:
+                raise ValueError(f"unknown interval operator {op!r} (use {', '.join(_OPS)})")
+            # "< x" and ">= x" change at x; "<= x" and "> x" just above it
+            out.add(float(x) if op in ("lt", "ge") else math.nextafter(float(x), math.inf))
+    return sorted(out)
+
+
+def _segment_table(intervals_bits):
+    """[(interval, bit)] -> (bounds, [bits that hold on each segment])."""
+    bounds = interval_bounds([iv for iv, _ in intervals_bits])
+    reps = [-math.inf] + bounds  # a point inside each segment
+    return bounds, [sum(bit for iv, bit in intervals_bits if interval_holds(iv, r)) for r in reps]
+
+
+class _Rule:
+    __slots__ = ("id", "group", "kind", "level", "severity", "comment", "mask", "any", "gender", "age")
+
+
+class RuleSet:
+    def __init__(self, spec, digest=""):
+        self.spec = spec
+        self.version = str(spec.get("version", ""))
+        self.digest = digest
+        levels = spec.get("levels", {"info": 1, "review": 2, "urgent": 3})
+        self.numeric = {}    # field -> [(interval, bit)], then (bounds, masks)
+        self.answers = {}    # field -> {answer: bits}
+        self.prefixes = {}   # field -> [(prefix, bit)]
+        self.fields = {}     # field -> presence bit
+        self.groups = []     # [(name, kind, requires mask, [rules])]
+        self.rules = []
+        bits = {}
+
+        def cond_bit(key):
+            if key not in bits:
+                bits[key] = 1 << len(bits)
+            return bits[key]
+
+        def field_bit(f):
+            if f not in self.fields:
+                self.fields[f] = 1 << len(self.fields)
+            return self.fields[f]
+
+        for g in spec["groups"]:
+            requires = sum(field_bit(f) for f in g.get("requires", []))
+            rules = []
+            for r in g["rules"]:
+                rule = _Rule()
+                rule.id, rule.group, rule.kind = r["id"], g["name"], g.get("kind", "vital")
+                rule.level = r.get("level", "info")
+                if rule.level not in levels:
+                    raise ValueError(f"rule {rule.id}: unknown level {rule.level!r}")
+                rule.severity, rule.comment = levels[rule.level], r["comment"]
+                rule.any = "any" in r
+                rule.gender = set(r["gender"]) if "gender" in r else None
+                rule.age = r.get("age")
+                rule.mask = 0
+                conds = r.get("any") or r.get("when") or {}
+                for f, iv in conds.items():
+                    field_bit(f)
+                    b = cond_bit(("num", f, json.dumps(iv, sort_keys=True)))
+                    if (iv, b) not in self.numeric.setdefault(f, []):
+                        self.numeric[f].append((iv, b))
+                    rule.mask |= b
+                for f, values in r.get("answer", {}).items():
+                    field_bit(f)
+                    b = cond_bit(("ans", f, tuple(sorted(values))))
+                    for a in values:
+                        self.answers.setdefault(f, {})
+                        self.answers[f][a] = self.answers[f].get(a, 0) | b
+                    rule.mask |= b
+                for f, values in r.get("answer_prefix", {}).items():
+                    field_bit(f)
+                    b = cond_bit(("pre", f, tuple(sorted(values))))
+                    self.answers.setdefault(f, {})
+                    self.prefixes.setdefault(f, []).extend((p, b) for p in values)
+                    rule.mask |= b
+                if not rule.mask:
+                    raise ValueError(f"rule {rule.id} has no conditions")
+                rules.append(rule)
+                self.rules.append(rule)
+            self.groups.append((g["name"], g.get("kind", "vital"), requires, rules))
+        if len({r.id for r in self.rules}) != len(self.rules):
+            raise ValueError("rule ids must be unique")
+        self.n_conditions = len(bits)
+        self.numeric = {f: _segment_table(ivs) for f, ivs in self.numeric.items()}
+        # contexts: gender (those named by rules, else None) x age segment
+        self.genders = sorted({g for r in self.rules if r.gender for g in r.gender})
+        self.age_bounds = interval_bounds([r.age for r in self.rules if r.age])
+        reps = [-math.inf] + self.age_bounds
+        self.contexts = {}
+        for gender in self.genders + [None]:
+            for seg, age in enumerate(reps):
+                self.contexts[(gender, seg)] = [
+                    (name, requires, [r for r in rules
+                                      if (r.gender is None or gender in r.gender)
+                                      and (r.age is None or (age != -math.inf and interval_holds(r.age, age)))])
+                    for name, kind, requires, rules in self.groups]
+        self._answer_cache_lock = threading.Lock()
+
+    def _answer_bits(self, field, answer):
+        table = self.answers[field]
+        bits = table.get(answer)
+        if bits is None:  # first sight of this answer: resolve prefix rules once and remember
+            bits = sum(b for p, b in self.prefixes.get(field, []) if answer.startswith(p))
+            with self._answer_cache_lock:
+                table[answer] = bits
+        return bits
+
+    def _context(self, record):
+        gender = record.get("patient_gender")
+        age = number(record.get("patient_age"))
+        seg = bisect.bisect_right(self.age_bounds, age) if age is not None else 0
+        return self.contexts[(gender if gender in self.genders else None, seg)]
+
+    def evaluate(self, record):
+        """Findings for one record (a dict shaped like the submit form's data), in rule-file order."""
+        conds = present = 0
+        for f, (bounds, masks) in self.numeric.items():
+            v = number(record.get(f))
+            if v is not None:
+                conds |= masks[bisect.bisect_right(bounds, v)]
+                present |= self.fields[f]
+        for f in self.answers:
+            a = record.get(f)
+            if a:
+                conds |= self._answer_bits(f, a)
+                present |= self.fields[f]
+        out = []
+        for name, requires, rules in self._context(record):
+            if requires & ~present:
+                continue
+            for r in rules:
+                if (conds & r.mask) if r.any else (conds & r.mask) == r.mask:
+                    comment = r.comment.format_map(_Values(record)) if "{" in r.comment else r.comment
+                    out.append(Finding(r.id, r.group, r.kind, r.level, r.severity, comment))
+                    break
+        return out
+
+    def evaluate_many(self, records):
+        """evaluate() for a list of record dicts, vectorized through match_matrix()."""
+        if len(records) < 64:
+            return [self.evaluate(r) for r in records]
+        import pandas as pd
+        hit = self.match_matrix(pd.DataFrame.from_records(records))
+        out = [[] for _ in records]
+        for i, j in zip(*hit.nonzero()):  # row-major, so each row's findings stay in rule order
+            r = self.rules[j]
+            comment = r.comment.format_map(_Values(records[i])) if "{" in r.comment else r.comment
+            out[i].append(Finding(r.id, r.group, r.kind, r.level, r.severity, comment))
+        return out
+
+    def match_matrix(self, df):
+        """
+        Batch evaluation over a pandas DataFrame with the record columns:
+        a (rows x rules) boolean NumPy array, columns in self.rules order.
+        Vectorized with one uint64 condition word per row.
+        """
+        import numpy as np
+        import pandas as pd
+        n = len(df)
+        hit = np.zeros((n, len(self.rules)), dtype=bool)
+        if self.n_conditions > 64 or len(self.fields) > 64:
+            for i, rec in enumerate(df.to_dict("records")):
+                ids = {f.rule for f in self.evaluate(rec)}
+                hit[i] = [r.id in ids for r in self.rules]
+            return hit
+        conds = np.zeros(n, dtype=np.uint64)
+        present = np.zeros(n, dtype=np.uint64)
+        for f, (bounds, masks) in self.numeric.items():
+            if f not in df:
+                continue
+            col = df[f]
+            if col.dtype == object:
+                col = col.map(number)
+            v = pd.to_numeric(col, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+            ok = ~np.isnan(v) & (v != 0)
+            seg = np.searchsorted(np.asarray(bounds), v[ok], side="right")
+            conds[ok] |= np.asarray(masks, dtype=np.uint64)[seg]
+            present[ok] |= np.uint64(self.fields[f])
+        for f in self.answers:
+            if f not in df:
+                continue
+            codes, uniques = pd.factorize(df[f], use_na_sentinel=True)
+            lut = np.array([self._answer_bits(f, a) if a else 0 for a in uniques] + [0], dtype=np.uint64)
+            ok = codes >= 0
+            conds |= lut[codes]  # code -1 (missing) reads the trailing 0
+            present[ok & np.array([bool(a) for a in uniques] + [False])[codes]] |= np.uint64(self.fields[f])
+        gender = df["patient_gender"] if "patient_gender" in df else pd.Series([None] * n)
+        gkey = gender.where(gender.isin(self.genders), None).to_numpy(dtype=object)
+        age = (pd.to_numeric(df["patient_age"], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+               if "patient_age" in df else np.full(n, np.nan))
+        ok = ~np.isnan(age) & (age != 0)
+        aseg = np.zeros(n, dtype=np.int64)
+        aseg[ok] = np.searchsorted(np.asarray(self.age_bounds), age[ok], side="right")
+        index = {r.id: j for j, r in enumerate(self.rules)}
+        for (g, seg), groups in self.contexts.items():
+            rows = np.flatnonzero((gkey == g) & (aseg == seg)) if g is not None else \
+                np.flatnonzero(pd.isna(gkey) & (aseg == seg))
+            if not len(rows):
+                continue
+            c, p = conds[rows], present[rows]
+            for name, requires, rules in groups:
+                open_ = (p & np.uint64(requires)) == np.uint64(requires)
+                for r in rules:
+                    m = np.uint64(r.mask)
+                    match = open_ & (((c & m) != 0) if r.any else ((c & m) == m))
+                    hit[rows[match], index[r.id]] = True
+                    open_ &= ~match
+        return hit
+
+
+class _Values(dict):
+    """format_map source: record values, blank for missing keys."""
+
+    def __init__(self, record):
+        super().__init__(record)
+
+    def __missing__(self, key):
+        return ""
+
+
+def load(path=RULES_PATH):
+    with open(path, "rb") as f:
+        raw = f.read()
+    return RuleSet(json.loads(raw), hashlib.sha256(raw).hexdigest()[:12])
+
+
+# ── Hot reload ──
+_lock = threading.Lock()
+_current = None      # (signature, RuleSet)
+_checked = 0.0
+_failed_sig = None   # signature of a file that did not compile; not retried until it changes
+
+
+def current(path=RULES_PATH, log=print):
+    """
+    The compiled rules for `path`, recompiled when the file changes (its mtime
+    is checked at most every CHECK_EVERY seconds). A file that does not compile
+    is reported and the previous rules stay in use.
+    """
+    global _current, _checked, _failed_sig
+    cur = _current
+    if cur is not None and time.monotonic() - _checked < CHECK_EVERY:
+        return cur[1]
+    with _lock:
+        cur = _current
+        try:
+            st = os.stat(path)
+            sig = (path, st.st_mtime_ns, st.st_size)
+        except OSError:
+            if cur is None:
+                raise
+            sig = cur[0]
+        if cur is None or (sig != cur[0] and sig != _failed_sig):
+            try:
+                _current = (sig, load(path))
+                if log and cur is not None:
+                    log(f"rules: reloaded {path} (version {_current[1].version}, {_current[1].digest})")
+            except Exception as e:
+                if cur is None:
+                    raise
+                _failed_sig = sig
+                if log:
+                    log(f"rules: keeping version {cur[1].version}; {path} does not compile: {e}")
+        _checked = time.monotonic()
+        return _current[1]
+
+
+if __name__ == "__main__":
+    rs = load(sys.argv[1] if len(sys.argv) > 1 else RULES_PATH)
+    sample = {"bmi": 31.2, "systolic_blood_pressure": 135, "diastolic_blood_pressure": 85, "temperature": 98.6,
+              "o2_level": 97, "pulse_rate": 72, "hemoglobin_level": 11.2, "patient_gender": "Female",
+              "patient_age": 42, "hair_loss": "No", "nail_changes": "No", "urine_color": "Pale yellow",
+              "oral_health": "Bleeding gums"}
+    n = 20000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        rs.evaluate(sample)
+    us = (time.perf_counter() - t0) / n * 1e6
+    print(f"version {rs.version} ({rs.digest}): {len(rs.rules)} rules, {rs.n_conditions} conditions, "
+          f"{len(rs.contexts)} contexts; {us:.1f} us per record")
+    for f in rs.evaluate(sample):
+        print(f"  [{f.level}] {f.comment}")
@@ -0,0 +1,150 @@
+import html
+import io
+import os
+import sys
+import time
+
+import psycopg2
+from psycopg2.extras import NamedTupleCursor
+
+import dbstream
+
+# -------------------------
+# Full-text search over notes and attachments (see migrations/007_search.sql)
+# -------------------------
+# Notes are indexed by Postgres as they are written. Uploaded PDFs are read
+# by an "extract" job after the report is delivered: the worker fetches the
+# upload from the archive, pulls its text with PyPDF2 and stores it once per
+# blob hash. search() ranks visits by notes and attachment matches together;
+# an attachment belongs to the visit it was archived with (archive_entries.
+# response_id, migration 020), never to another visit sharing its report_id.
+#
+#   python search.py "query"        ranked matches
+#   python search.py --backfill     extract archived uploads that have no text yet
+
+MAX_CHARS = 200_000  # text kept per attachment; lab reports are far shorter
+MARK = ("\x02", "\x03")  # ts_headline match delimiters, turned into <mark> after escaping
+
+
+def extract_text(pdf_bytes, max_chars=MAX_CHARS):
+    """(page count, text) of a PDF. Pages that fail to parse are skipped."""
+    from PyPDF2 import PdfReader
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    parts, size = [], 0
+    for page in reader.pages:
+        try:
+            t = page.extract_text() or ""
+        except Exception:
+            continue
+        parts.append(t)
+        size += len(t)
+        if size >= max_chars:
+            break
+    text = "\n".join(parts)[:max_chars].replace("\x00", "")  # NUL cannot be stored in TEXT
+    return len(reader.pages), text
+
+
+def index_upload(conn, arc, response_id):
+    """Extract and store the text of a visit's archived upload. Returns True when text was added."""
+    cur = conn.cursor()
+    cur.execute("SELECT e.hash, t.hash IS NOT NULL FROM archive_entries e "
+                "LEFT JOIN attachment_text t USING (hash) WHERE e.response_id = %s AND e.role = 'upload'",
+                (response_id,))
+    row = cur.fetchone()
+    conn.rollback()
+    if row is None or row[1]:  # no upload, or the same file was already read for another visit
+        return False
+    pdf = arc.get(response_id, "upload")
+    if pdf is None:
+        return False
+    pages, text = extract_text(pdf)
+    cur.execute("INSERT INTO attachment_text (hash, pages, body) VALUES (%s, %s, %s) "
+                "ON CONFLICT (hash) DO NOTHING", (row[0], pages, text))
+    conn.commit()
+    return True
+
+
+def search(conn, query, limit=50):
+    """
+    Visits matching `query` (web-search syntax: words, "phrases", -not, or),
+    best first: [(id, report_id, collection_date, patient_name, rank, note, attachment)].
+    note/attachment are HTML-escaped snippets with matches in <mark>, or None.
+    """
+    opts = f"StartSel={MARK[0]}, StopSel={MARK[1]}, MaxFragments=2, MaxWords=20, MinWords=6"
+    cur = conn.cursor(cursor_factory=NamedTupleCursor)
+    cur.execute("""
+        WITH q AS (SELECT websearch_to_tsquery('english', %(q)s) AS q),
+        hits AS (
+            SELECT r.id, ts_rank_cd(r.notes_tsv, q.q) AS rank
+            FROM responses_compact r, q WHERE r.notes_tsv @@ q.q
+            UNION ALL
+            SELECT r.id, ts_rank_cd(t.tsv, q.q)
+            FROM attachment_text t CROSS JOIN q
+            JOIN archive_entries e ON e.hash = t.hash AND e.role = 'upload'
+            JOIN responses_compact r ON r.id = e.response_id
+            WHERE t.tsv @@ q.q
+        ),
+        top AS (SELECT id, sum(rank) AS rank FROM hits GROUP BY id ORDER BY rank DESC, id DESC LIMIT %(limit)s)
+        SELECT r.id, r.report_id, r.collection_date, r.patient_name, top.rank,
+               CASE WHEN r.notes_tsv @@ q.q THEN ts_headline('english', r.disabilities, q.q, %(opts)s) END AS note,
+               (SELECT ts_headline('english', t.body, q.q, %(opts)s)
+                FROM archive_entries e JOIN attachment_text t USING (hash)
+                WHERE e.response_id = r.id AND e.role = 'upload' AND t.tsv @@ q.q) AS attachment
+        FROM top JOIN responses_compact r USING (id) CROSS JOIN q
+        ORDER BY top.rank DESC, r.id DESC""", {"q": query, "limit": limit, "opts": opts})
+    rows = cur.fetchall()
+    conn.rollback()
+    return [r._replace(note=_snippet(r.note), attachment=_snippet(r.attachment)) for r in rows]
+
+
+def _snippet(text):
+    if text is None:
+        return None
+    text = html.escape(" ".join(text.split()))
+    return text.replace(MARK[0], "<mark>").replace(MARK[1], "</mark>")
+
+
+def backfill(connect, arc, log=print):
+    """Extract every archived upload without text. Returns (added, failed)."""
+    added = failed = 0
+    t0 = time.perf_counter()
+    conn, stream = connect(), connect()  # the stream's transaction stays open while conn commits
+    try:
+        todo = dbstream.stream(stream, """
+            SELECT DISTINCT ON (e.hash) e.response_id FROM archive_entries e
+            WHERE e.role = 'upload' AND NOT EXISTS (SELECT 1 FROM attachment_text t WHERE t.hash = e.hash)
+            ORDER BY e.hash""")
+        for rec in todo:
+            try:
+                added += index_upload(conn, arc, rec.response_id)
+            except Exception as e:
+                conn.rollback()
+                failed += 1
+                if log:
+                    log(f"visit {rec.response_id}: {e}")
+    finally:
+        stream.close()
+        conn.close()
+    if log:
+        log(f"{added} attachments in {time.perf_counter() - t0:.1f} s")
+    return added, failed
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    dsn = os.environ["DATABASE_URL"]
+    connect = lambda: psycopg2.connect(dsn)  # noqa: E731
+    args = sys.argv[1:]
+    if "--backfill" in args:
+        import archive
+        import shared_store
+        spec = os.environ.get("SHARED_STORE") or "dir:generated_files/archive"
+        print("added: %s, failed: %s" % backfill(connect, archive.Archive(shared_store.open_store(spec, connect), connect)))
+    else:
+        t0 = time.perf_counter()
+        rows = search(connect(), " ".join(args))
+        for r in rows:
+            print(f"{r.rank:6.3f}  {r.report_id}  {r.collection_date}  {r.patient_name}  "
+                  f"{r.note or ''} {r.attachment or ''}")
+        print(f"{len(rows)} matches in {(time.perf_counter() - t0) * 1000:.1f} ms")
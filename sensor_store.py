@@ -0,0 +1,154 @@
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+# -------------------------
+# Raw sensor capture storage
+# -------------------------
+# Each capture (one sensor channel of one visit) is a single file:
+#
+#   [64-byte header][n_samples little-endian values]
+#
+# Header (little-endian):
+#   magic      4s   b"MRSC"
+#   version    u8
+#   dtype      u8   index into DTYPE_CODES
+#   reserved   u16
+#   report_id  u32
+#   sample_rate f64 (Hz)
+#   n_samples  u64
+#   start_time f64 (unix seconds, 0 if unknown)
+#   padding up to HEADER_SIZE so the payload stays 64-byte aligned
+#
+# Files live next to the visit under CAPTURE_DIR/<report_id>/<channel>.msc and
+# are opened with np.memmap, so reading a capture never copies the samples.
+# With several app replicas the same bytes go to the shared object store
+# instead (put_capture/get_capture, key captures/<report_id>/<channel>.msc).
+
+CAPTURE_DIR = os.path.join("generated_files", "captures")
+CAPTURE_EXT = ".msc"
+MAGIC = b"MRSC"
+VERSION = 1
+HEADER_SIZE = 64
+_HEADER = struct.Struct("<4sBBHIdQd")
+
+DTYPE_CODES = ["<u1", "<i2", "<u2", "<i4", "<u4", "<f4", "<f8"]
+
+# Default on-disk type per known channel. PPG comes off the ADC as counts,
+# cuff pressure (mmHg) and temperature (°F) are stored as float32.
+CHANNEL_DTYPES = {
+    "ppg": "<i2",
+    "cuff_pressure": "<f4",
+    "temperature": "<f4",
+}
+
+Capture = namedtuple("Capture", ["report_id", "channel", "sample_rate", "start_time", "samples"])
+
+
+def capture_path(report_id, channel, root=CAPTURE_DIR):
+    return os.path.join(root, str(int(report_id)), f"{channel}{CAPTURE_EXT}")
+
+
+def capture_key(report_id, channel):
+    """Object-store key of a capture (shared_store)."""
+    return f"captures/{int(report_id)}/{channel}{CAPTURE_EXT}"
+
+
+def _encode(report_id, channel, samples, sample_rate, start_time, dtype):
+    """(padded header, samples array) of a capture."""
+    dtype = np.dtype(dtype or CHANNEL_DTYPES.get(channel, "<f4")).newbyteorder("<")
+    key = "<" + dtype.str[1:]  # single-byte types report "|u1"
+    if key not in DTYPE_CODES:
+        raise ValueError(f"Unsupported capture dtype: {dtype}")
+    code = DTYPE_CODES.index(key)
+    arr = np.ascontiguousarray(samples, dtype=dtype).ravel()
+    header = _HEADER.pack(MAGIC, VERSION, code, 0, int(report_id),
+                          float(sample_rate), arr.size, float(start_time))
+    return header.ljust(HEADER_SIZE, b"\0"), arr
+
+
+def attach_capture(report_id, channel, samples, sample_rate, start_time=0.0, dtype=None, root=CAPTURE_DIR):
+    """Write one channel of raw samples for a report. Returns the file path."""
+    header, arr = _encode(report_id, channel, samples, sample_rate, start_time, dtype)
+    path = capture_path(report_id, channel, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(arr.tobytes())
+    os.replace(tmp, path)  # readers never see a half-written capture
+    return path
+
+
+def put_capture(store, report_id, channel, samples, sample_rate, start_time=0.0, dtype=None):
+    """attach_capture() into a shared_store object store. Returns the key."""
+    header, arr = _encode(report_id, channel, samples, sample_rate, start_time, dtype)
+    key = capture_key(report_id, channel)
+    store.put(key, header + arr.tobytes(), "application/octet-stream")
+    return key
+
+
+def get_capture(store, report_id, channel):
+    """A capture from an object store (samples are a view of the fetched bytes), or None."""
+    raw = store.get(capture_key(report_id, channel))
+    return capture_from_bytes(raw, channel) if raw is not None else None
+
+
+def read_header(path):
+    """Return (report_id, dtype, sample_rate, n_samples, start_time) for a capture file."""
+    with open(path, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError(f"Truncated capture header: {path}")
+    magic, version, code, _, report_id, sample_rate, n, start_time = _HEADER.unpack_from(raw)
+    if magic != MAGIC:
+        raise ValueError(f"Not a sensor capture file: {path}")
+    if version != VERSION:
+        raise ValueError(f"Unsupported capture version {version}: {path}")
+    return report_id, np.dtype(DTYPE_CODES[code]), sample_rate, n, start_time
+
+
+def load_capture(report_id, channel, root=CAPTURE_DIR, mode="r"):
+    """Open a capture as a read-only memory map (zero-copy)."""
+    path = capture_path(report_id, channel, root)
+    rid, dtype, sample_rate, n, start_time = read_header(path)
+    if n:
+        samples = np.memmap(path, dtype=dtype, mode=mode, offset=HEADER_SIZE, shape=(n,))
+    else:
+        samples = np.empty(0, dtype=dtype)
+    return Capture(rid, channel, sample_rate, start_time, samples)
+
+
+def list_captures(report_id, root=CAPTURE_DIR):
+    """Channel names stored for a report."""
+    folder = os.path.join(root, str(int(report_id)))
+    if not os.path.isdir(folder):
+        return []
+    return sorted(f[:-len(CAPTURE_EXT)] for f in os.listdir(folder) if f.endswith(CAPTURE_EXT))
+
+
+def load_visit(report_id, root=CAPTURE_DIR):
+    """All captures of a visit keyed by channel."""
+    return {ch: load_capture(report_id, ch, root) for ch in list_captures(report_id, root)}
+
+
+def delete_captures(report_id, root=CAPTURE_DIR):
+    folder = os.path.join(root, str(int(report_id)))
+    for ch in list_captures(report_id, root):
+        os.remove(capture_path(report_id, ch, root))
+    if os.path.isdir(folder) and not os.listdir(folder):
+        os.rmdir(folder)
+
+
+def capture_from_bytes(buf, channel="upload"):
+    """Parse a capture file already in memory (e.g. a Streamlit upload) without copying samples."""
+    raw = memoryview(buf)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError("Truncated capture header")
+    magic, version, code, _, report_id, sample_rate, n, start_time = _HEADER.unpack_from(raw)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a sensor capture file")
+    samples = np.frombuffer(raw, dtype=DTYPE_CODES[code], count=n, offset=HEADER_SIZE)
+    return Capture(report_id, channel, sample_rate, start_time, samples)
@@ -0,0 +1,248 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+
+# -------------------------
+# Shared state for running several app replicas (migrations/004_shared_state.sql)
+# -------------------------
+# With SHARED_STORE set, nothing a later request depends on stays in one
+# process or on one disk: report PDFs and submitted data go to an object
+# store, Sheets sync and e-mail become jobs any replica's worker can run, and
+# report/patient IDs are reserved from database sequences per browser session.
+#
+#   SHARED_STORE=postgres        objects in the artifacts table (bytea)
+#   SHARED_STORE=dir:/mnt/share  objects as files under a directory every
+#                                replica mounts (NFS, a volume, or local for tests)
+
+KEY_RE = re.compile(r"^[A-Za-z0-9_.-]+(/[A-Za-z0-9_.-]+)*$")
+
+
+def _check(key):
+    if not KEY_RE.match(key) or ".." in key:
+        raise ValueError(f"bad object key {key!r}")
+    return key
+
+
+# ── Object stores ──
+class DirStore:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *_check(key).split("/"))
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # readers see the old object or the new one, never a partial file
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class PgStore:
+    """Objects in the artifacts table; `connect` returns a new DB-API connection."""
+
+    def __init__(self, connect):
+        self.connect = connect
+
+    def put(self, key, data, content_type=None):
+        conn = self.connect()
+        try:
+            conn.cursor().execute(
+                "INSERT INTO artifacts (key, content_type, data) VALUES (%s, %s, %s) "
+                "ON CONFLICT (key) DO UPDATE SET content_type = EXCLUDED.content_type, "
+                "data = EXCLUDED.data, created_at = CURRENT_TIMESTAMP",
+                (_check(key), content_type, data))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, key):
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT data FROM artifacts WHERE key = %s", (_check(key),))
+            row = cur.fetchone()
+            return bytes(row[0]) if row else None
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        conn = self.connect()
+        try:
+            conn.cursor().execute("DELETE FROM artifacts WHERE key = %s", (_check(key),))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def open_store(spec, connect):
+    """Store for a SHARED_STORE value: "postgres" or "dir:<path>"."""
+    if spec == "postgres":
+        return PgStore(connect)
+    if spec.startswith("dir:"):
+        return DirStore(spec[4:])
+    raise ValueError(f"unknown SHARED_STORE {spec!r} (use 'postgres' or 'dir:<path>')")
+
+
+def put_json(store, key, obj):
+    store.put(key, json.dumps(obj, default=str).encode(), "application/json")
+
+
+def get_json(store, key):
+    raw = store.get(key)
+    return json.loads(raw) if raw is not None else None
+
+
+# ── ID reservations ──
+def sync_sequences(conn):
+    """Move the ID sequences past rows written by MAX()+1 (e.g. before SHARED_STORE was set)."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT setval('report_id_seq', GREATEST(r.last_value + r.is_called::int, COALESCE(m.rid, 0) + 1, 1001), false),
+               setval('patient_id_seq', GREATEST(p.last_value + p.is_called::int, COALESCE(m.pid, 0) + 1), false)
+        FROM report_id_seq r, patient_id_seq p,
+             (SELECT MAX(report_id) AS rid, MAX(patient_id) AS pid FROM responses) m""")
+    conn.commit()
+
+
+def reserve_ids(cur, session_key):
+    """
+    The session's open (report_id, patient_id) reservation, making one if it
+    has none. Idempotent, so every rerun on every replica shows the same IDs.
+    Runs in the caller's transaction.
+    """
+    cur.execute("SELECT report_id, patient_id FROM id_reservations "
+                "WHERE session_key = %s AND used_at IS NULL", (session_key,))
+    row = cur.fetchone()
+    if row:
+        return row
+    cur.execute("""
+        INSERT INTO id_reservations (report_id, patient_id, session_key)
+        VALUES (nextval('report_id_seq'), nextval('patient_id_seq'), %s)
+        ON CONFLICT (session_key) WHERE used_at IS NULL DO NOTHING
+        RETURNING report_id, patient_id""", (session_key,))
+    row = cur.fetchone()
+    if row is None:  # made concurrently by another rerun of this session
+        cur.execute("SELECT report_id, patient_id FROM id_reservations "
+                    "WHERE session_key = %s AND used_at IS NULL", (session_key,))
+        row = cur.fetchone()
+    return row
+
+
+def take_ids(cur, session_key):
+    """Reserve-or-get and mark used, in the caller's (saving) transaction."""
+    rid, pid = reserve_ids(cur, session_key)
+    cur.execute("UPDATE id_reservations SET used_at = CURRENT_TIMESTAMP WHERE report_id = %s", (rid,))
+    return rid, pid
+
+
+# ── Jobs ──
+def enqueue(conn, kind, payload, delay=0):
+    cur = conn.cursor()
+    cur.execute("INSERT INTO jobs (kind, payload, run_after) "
+                "VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second') RETURNING id",
+                (kind, json.dumps(payload, default=str), delay))
+    job_id = cur.fetchone()[0]
+    conn.commit()
+    return job_id
+
+
+def claim(conn, worker, kinds):
+    """Lock the oldest ready job of the given kinds. Returns (id, kind, payload, attempts) or None."""
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE jobs SET status = 'running', locked_by = %s, locked_at = CURRENT_TIMESTAMP,
+                        attempts = attempts + 1
+        WHERE id = (SELECT id FROM jobs
+                    WHERE status = 'pending' AND run_after <= CURRENT_TIMESTAMP AND kind = ANY(%s)
+                    ORDER BY run_after LIMIT 1 FOR UPDATE SKIP LOCKED)
+        RETURNING id, kind, payload, attempts""", (worker, list(kinds)))
+    row = cur.fetchone()
+    conn.commit()
+    return row
+
+
+def complete(conn, job_id):
+    conn.cursor().execute("UPDATE jobs SET status = 'done', last_error = NULL WHERE id = %s", (job_id,))
+    conn.commit()
+
+
+def fail(conn, job_id, attempts, error, max_attempts=5):
+    """Retry with exponential backoff, or give up after max_attempts."""
+    cur = conn.cursor()
+    if attempts >= max_attempts:
+        cur.execute("UPDATE jobs SET status = 'failed', last_error = %s WHERE id = %s", (error, job_id))
+    else:
+        cur.execute("UPDATE jobs SET status = 'pending', last_error = %s, locked_by = NULL, "
+                    "run_after = CURRENT_TIMESTAMP + %s * INTERVAL '1 second' WHERE id = %s",
+                    (error, 2 ** attempts * 5, job_id))
+    conn.commit()
+
+
+def requeue_stale(conn, older_than=600):
+    """Jobs left 'running' by a replica that died go back to the queue."""
+    cur = conn.cursor()
+    cur.execute("UPDATE jobs SET status = 'pending', locked_by = NULL WHERE status = 'running' "
+                "AND locked_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'", (older_than,))
+    conn.commit()
+    return cur.rowcount
+
+
+def _stderr(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def run_worker(connect, handlers, worker, poll=2.0, stop=None, log=_stderr):
+    """Run jobs until `stop` (a threading.Event) is set. handlers: kind -> fn(payload). Logs to stderr."""
+    stop = stop or threading.Event()
+    conn = None
+    while not stop.is_set():
+        try:
+            if conn is None or conn.closed:
+                conn = connect()
+                requeue_stale(conn)
+            job = claim(conn, worker, handlers)
+            if job is None:
+                stop.wait(poll)
+                continue
+            job_id, kind, payload, attempts = job
+            try:
+                handlers[kind](payload)
+                complete(conn, job_id)
+            except Exception as e:
+                fail(conn, job_id, attempts, "".join(traceback.format_exception_only(e)).strip())
+                if log:
+                    log(f"jobs: {kind} #{job_id} failed (attempt {attempts}): {e}")
+        except Exception as e:  # lost the database; reconnect after a pause
+            if log:
+                log(f"jobs: worker error: {e}")
+            conn = None
+            time.sleep(poll)
+    if conn is not None:
+        conn.close()
+
+
+def start_worker(connect, handlers, worker, poll=2.0, log=_stderr):
+    stop = threading.Event()
+    threading.Thread(target=run_worker, args=(connect, handlers, worker, poll, stop, log),
+                     name="jobs", daemon=True).start()
+    return stop
@@ -0,0 +1,326 @@
+import json
+import os
+import sys
+import time
+import uuid
+
+import psycopg2
+
+import dbstream
+
+# -------------------------
+# Columnar snapshot of responses for ad-hoc analysis
+# -------------------------
+# Instead of `SELECT * FROM responses` over the remote connection into client
+# memory, rows are streamed through a server-side cursor (dbstream) into Arrow IPC
+# files: one part per refresh, written batch by batch, plus manifest.json.
+# Every change of a visit is logged in snapshot_log with its transaction id
+# (migrations/021), and each export records its database snapshot in
+# snapshot_exports. A refresh re-exports the logged visits the last snapshot
+# could not see, however late they committed, into a new part, with their ids
+# in a drop file: those rows of earlier parts are superseded (or deleted).
+# Parts are uncompressed so load() can memory-map them and hand pandas
+# Arrow-backed columns without copying.
+#
+# The ten categorical answers stay as their answer_codes SMALLINT codes and
+# become Arrow dictionary columns over the answer_codes table.
+#
+#   python snapshot.py [--dir snapshots/responses] [--full] [--compact]
+
+DEFAULT_DIR = os.path.join("snapshots", "responses")
+BATCH = 50_000  # rows per fetch and per record batch
+EXPORT_LOCK = 727006  # pg_try_advisory_lock key: one export at a time, so pruning the log sees every export
+KEEP = "7 days"       # a directory not refreshed for this long is dropped from snapshot_exports (and rebuilt)
+
+# (output column, SQL expression over responses_compact, Arrow type name)
+COLUMNS = [
+    ("id", "id", "int32"), ("patient_id", "patient_id", "int32"), ("report_id", "report_id", "int32"),
+    ("collection_date", "collection_date", "date32"), ("report_date", "report_date", "date32"),
+    ("patient_name", "patient_name", "string"), ("patient_age", "patient_age", "int16"),
+    ("patient_gender", "gender_code", "answer"), ("patient_referee", "patient_referee", "string"),
+    ("patient_phone", "patient_phone", "string"),
+    ("weight", "weight", "float32"), ("height", "height", "float32"), ("bmi", "bmi", "float32"),
+    ("pulse_rate", "pulse_rate", "int16"),
+    ("systolic_blood_pressure", "systolic_blood_pressure", "int16"),
+    ("diastolic_blood_pressure", "diastolic_blood_pressure", "int16"),
+    ("o2_level", "o2_level", "int16"), ("temperature", "temperature", "float32"),
+    ("vision", "vision_code", "answer"), ("breathing", "breathing_code", "answer"),
+    ("hearing", "hearing_code", "answer"), ("skin_condition", "skin_condition_code", "answer"),
+    ("oral_health", "oral_health_code", "answer"), ("urine_color", "urine_color_code", "answer"),
+    ("hair_loss", "hair_loss_code", "answer"), ("nail_changes", "nail_changes_code", "answer"),
+    ("cataract", "cataract_code", "answer"), ("disabilities", "disabilities", "string"),
+    ("hemoglobin_level", "hemoglobin_level", "float32"), ("created_at", "created_at", "timestamp"),
+]
+
+
+def _pa():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        raise RuntimeError("snapshots need pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+def schema():
+    pa = _pa()
+    types = {"int16": pa.int16(), "int32": pa.int32(), "float32": pa.float32(), "string": pa.string(),
+             "date32": pa.date32(), "timestamp": pa.timestamp("us"),
+             "answer": pa.dictionary(pa.int16(), pa.string())}
+    return pa.schema([(name, types[t]) for name, _, t in COLUMNS])
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"snapshot": None, "exported_at": None, "rows": 0, "parts": []}
+
+
+def _write_manifest(path, manifest):
+    tmp = os.path.join(path, f"manifest.json.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(path, "manifest.json"))
+
+
+def _answers(cur):
+    """Arrow string array indexed by answer code (codes are unique across questions)."""
+    pa = _pa()
+    cur.execute("SELECT code, answer FROM answer_codes")
+    rows = cur.fetchall()
+    values = [None] * (max((c for c, _ in rows), default=0) + 1)
+    for code, answer in rows:
+        values[code] = answer
+    return pa.array(values, pa.string())
+
+
+def _record_batch(rows, sch, answers):
+    pa = _pa()
+    cols = list(zip(*rows))
+    arrays = []
+    for (name, _, kind), field, values in zip(COLUMNS, sch, cols):
+        if kind == "answer":
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(values, pa.int16()), answers))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=sch)
+
+
+def _write_part(path, sch, batches, prefix="part"):
+    """Write record batches to a new part file. Returns (file name, rows); (None, 0) when there were none."""
+    pa = _pa()
+    name = f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.arrow"
+    tmp = os.path.join(path, name + ".tmp")
+    rows = 0
+    try:
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, sch) as writer:
+            for b in batches:
+                writer.write_batch(b)
+                rows += b.num_rows
+    except BaseException:
+        _remove(path, name + ".tmp")
+        raise
+    if not rows:
+        _remove(path, name + ".tmp")
+        return None, 0
+    os.replace(tmp, os.path.join(path, name))
+    return name, rows
+
+
+def export(conn, path, since=None, batch=BATCH):
+    """
+    Stream every row (since=None) or the rows of the visits logged since the
+    `since` snapshot into a new part file, and those visits' ids into a drop
+    file. Returns (part or None, rows, drop file or None, dropped ids,
+    snapshot, export time, rows in responses_compact).
+    """
+    pa = _pa()
+    sch = schema()
+    os.makedirs(path, exist_ok=True)
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)  # answers, log and rows from one snapshot
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_current_snapshot()::text, LOCALTIMESTAMP, (SELECT count(*) FROM responses_compact)")
+        snap, at, total = cur.fetchone()
+        answers = _answers(cur)
+        sql = f"SELECT {', '.join(expr for _, expr, _ in COLUMNS)} FROM responses_compact"
+        drop, dropped = None, 0
+        if since is not None:
+            cur.execute("SELECT DISTINCT id FROM snapshot_log WHERE NOT pg_visible_in_snapshot(xid, %s::pg_snapshot)",
+                        (since,))
+            ids = [r[0] for r in cur.fetchall()]
+            ids_schema = pa.schema([("id", pa.int32())])
+            drop, dropped = _write_part(path, ids_schema, (pa.record_batch([pa.array(ids[i:i + batch], pa.int32())],
+                                                                           schema=ids_schema)
+                                                           for i in range(0, len(ids), batch)), "drop")
+            sql += " WHERE id = ANY(%s)"
+            params = (ids,)
+        else:
+            params = None
+        chunks = dbstream.batches(conn, sql, params, size=batch) if since is None or dropped else ()
+        try:
+            name, rows = _write_part(path, sch, (_record_batch(c, sch, answers) for c in chunks))
+        except BaseException:
+            if drop:
+                _remove(path, drop)
+            raise
+    finally:
+        conn.rollback()
+        conn.set_session(isolation_level="DEFAULT", readonly=False)
+    return name, rows, drop, dropped, snap, at, total
+
+
+def refresh(conn, path=DEFAULT_DIR, full=False):
+    """
+    Bring the snapshot up to date. Returns (rows written, ids dropped, export
+    time), or None when another export holds the lock. A first run, --full,
+    or a directory whose last export is no longer registered exports every row.
+    """
+    key = os.path.abspath(path)
+    cur = conn.cursor()
+    cur.execute("SELECT pg_try_advisory_lock(%s)", (EXPORT_LOCK,))
+    if not cur.fetchone()[0]:
+        conn.rollback()
+        return None
+    try:
+        cur.execute("SELECT snap::text FROM snapshot_exports WHERE path = %s", (key,))
+        row = cur.fetchone()
+        conn.rollback()
+        manifest = read_manifest(path)
+        if full or row is None or manifest.get("snapshot") != row[0]:
+            old, manifest = manifest["parts"], {"snapshot": None, "exported_at": None, "rows": 0, "parts": []}
+        else:
+            old = []
+        name, rows, drop, dropped, snap, at, total = export(conn, path, manifest["snapshot"])
+        if name or drop:
+            manifest["parts"].append({"file": name, "rows": rows, "drop": drop, "dropped": dropped,
+                                      "exported_at": at.isoformat()})
+        manifest.update(snapshot=snap, exported_at=at.isoformat(), rows=total)
+        _write_manifest(path, manifest)
+        for p in old:  # a full rebuild replaces every earlier part
+            _remove_part(path, p)
+        # register this export, forget directories gone quiet, and drop what every export has seen
+        cur.execute("""INSERT INTO snapshot_exports (path, snap, exported_at) VALUES (%s, %s::pg_snapshot, %s)
+                       ON CONFLICT (path) DO UPDATE SET snap = EXCLUDED.snap, exported_at = EXCLUDED.exported_at""",
+                    (key, snap, at))
+        cur.execute("DELETE FROM snapshot_exports WHERE exported_at < LOCALTIMESTAMP - %s::interval", (KEEP,))
+        cur.execute("""DELETE FROM snapshot_log l WHERE NOT EXISTS (
+                           SELECT 1 FROM snapshot_exports e WHERE NOT pg_visible_in_snapshot(l.xid, e.snap))""")
+        conn.commit()
+    finally:
+        conn.rollback()
+        cur.execute("SELECT pg_advisory_unlock(%s)", (EXPORT_LOCK,))
+        conn.commit()
+    return rows, dropped, at.isoformat()
+
+
+def compact(path=DEFAULT_DIR):
+    """
+    Rewrite all parts as one, without the rows later parts superseded (fewer
+    files to map after many small refreshes). Returns the part count merged.
+    """
+    manifest = read_manifest(path)
+    if len(manifest["parts"]) < 2:
+        return 0
+    table = _one_dictionary(open_table(path))
+    name, rows = _write_part(path, table.schema, table.to_batches(max_chunksize=BATCH))
+    del table  # release the maps before the old parts go
+    old = manifest["parts"]
+    manifest["parts"] = [{"file": name, "rows": rows, "drop": None, "dropped": 0,
+                          "exported_at": manifest["exported_at"]}] if name else []
+    _write_manifest(path, manifest)
+    for p in old:
+        _remove_part(path, p)
+    return len(old)
+
+
+def _one_dictionary(table):
+    """
+    Give every chunk of the answer columns the same dictionary (an IPC file
+    holds one per column). Each part's dictionary is answer_codes indexed by
+    code as of its export, so the longest one covers every earlier part.
+    """
+    pa = _pa()
+    for i, (name, _, kind) in enumerate(COLUMNS):
+        if kind != "answer":
+            continue
+        col = table.column(i)
+        answers = max((c.dictionary for c in col.chunks), key=len, default=None)
+        if answers is None:
+            continue
+        chunks = [pa.DictionaryArray.from_arrays(c.indices, answers) for c in col.chunks]
+        table = table.set_column(i, name, pa.chunked_array(chunks, col.type))
+    return table
+
+
+def _remove(path, name):
+    try:
+        os.remove(os.path.join(path, name))
+    except FileNotFoundError:
+        pass
+
+
+def _remove_part(path, part):
+    for name in (part.get("file"), part.get("drop")):
+        if name:
+            _remove(path, name)
+
+
+def _read(path, name):
+    pa = _pa()
+    return pa.ipc.open_file(pa.memory_map(os.path.join(path, name), "r")).read_all()
+
+
+def open_table(path=DEFAULT_DIR, columns=None):
+    """
+    The snapshot as a pyarrow Table over memory-mapped parts (no data is read
+    until used). Rows whose visit a later part dropped are filtered out, which
+    copies that part; compact() folds them away.
+    """
+    pa = _pa()
+    import pyarrow.compute as pc
+    tables, dropped = [], None  # ids dropped by the parts after the one being read
+    for p in reversed(read_manifest(path)["parts"]):
+        if p.get("file"):
+            t = _read(path, p["file"])
+            if dropped is not None:
+                keep = pc.invert(pc.is_in(t.column("id"), value_set=dropped))
+                if not pc.all(keep).as_py():
+                    t = t.filter(keep)
+            tables.append(t.select(columns) if columns else t)
+        if p.get("drop"):
+            ids = _read(path, p["drop"]).column("id").combine_chunks()
+            dropped = ids if dropped is None else pa.concat_arrays([dropped, ids])
+    if not tables:
+        return schema().empty_table().select(columns) if columns else schema().empty_table()
+    return pa.concat_tables(reversed(tables))
+
+
+def load(path=DEFAULT_DIR, columns=None):
+    """
+    The snapshot as a pandas DataFrame. Columns are pandas ArrowDtype views of
+    the memory-mapped buffers, so loading copies no row data (but for parts
+    with superseded rows, see open_table).
+    """
+    import pandas as pd
+    return open_table(path, columns).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    args = sys.argv[1:]
+    path = args[args.index("--dir") + 1] if "--dir" in args else DEFAULT_DIR
+    if "--compact" in args:
+        print("parts merged: %s" % compact(path))
+    else:
+        conn = psycopg2.connect(os.environ["DATABASE_URL"])
+        t0 = time.perf_counter()
+        done = refresh(conn, path, full="--full" in args)
+        if done is None:
+            print("another export is running")
+        else:
+            print("rows written: %s, visits replaced or removed: %s, as of %s (%.1f s)"
+                  % (*done, time.perf_counter() - t0))
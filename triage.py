@@ -0,0 +1,178 @@
+import bisect
+import os
+import select
+import sys
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import NamedTupleCursor
+
+# -------------------------
+# Urgent-findings worklist (table in migrations/009_triage.sql)
+# -------------------------
+# push() adds a visit to triage_queue when its findings include an urgent
+# one. Worklist keeps the open items of the queue in memory, ordered by
+# score then wait, and follows changes with LISTEN triage: each notification
+# fetches only the rows whose seq is past the last one seen, so the triage
+# page reads memory, and the table is read in full once per FULL_RELOAD.
+#
+#   python triage.py        follow the worklist in the terminal
+
+CHANNEL = "triage"
+LOOKBACK = 200        # seqs re-read on each fetch, for transactions that commit out of seq order
+FULL_RELOAD = 300.0   # seconds between full reloads (also after a lost connection)
+
+
+def score(found):
+    """Priority of a visit's findings: the sum of their severities."""
+    return sum(f.severity for f in found)
+
+
+def push(cur, response_id, found, patient_name=None):
+    """Queue the visit (in the caller's transaction) if any finding is urgent. Returns True when queued."""
+    urgent = [f for f in found if f.level == "urgent"]
+    if not urgent:
+        return False
+    summary = "; ".join(f.comment for f in sorted(found, key=lambda f: -f.severity))
+    cur.execute("INSERT INTO triage_queue (response_id, score, summary, patient_name) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (response_id) DO NOTHING", (response_id, score(found), summary, patient_name))
+    return True
+
+
+def claim(conn, response_id, user):
+    """Mark an open item as being looked at by `user`. Returns False if someone else has it."""
+    cur = conn.cursor()
+    cur.execute("UPDATE triage_queue SET claimed_by = %s, claimed_at = CURRENT_TIMESTAMP "
+                "WHERE response_id = %s AND resolved_at IS NULL AND (claimed_by IS NULL OR claimed_by = %s)",
+                (user, response_id, user))
+    conn.commit()
+    return cur.rowcount == 1
+
+
+def resolve(conn, response_id, user):
+    cur = conn.cursor()
+    cur.execute("UPDATE triage_queue SET resolved_by = %s, resolved_at = CURRENT_TIMESTAMP "
+                "WHERE response_id = %s AND resolved_at IS NULL", (user, response_id))
+    conn.commit()
+    return cur.rowcount == 1
+
+
+_COLS = ("response_id, score, summary, patient_name, queued_at, claimed_by, claimed_at, resolved_at, seq, "
+         "EXTRACT(EPOCH FROM LOCALTIMESTAMP - queued_at)::float8 AS age")  # seconds waited, on the database's clock
+
+
+class Worklist:
+    """
+    The open triage items of one database, kept current by a listener
+    thread. items() and count are read without touching the database.
+    """
+
+    def __init__(self, connect, log=print):
+        self.connect, self.log = connect, log
+        self.lock = threading.Lock()
+        self.by_id = {}     # response_id -> row
+        self.order = []     # sorted [(-score, queued_at, response_id)]
+        self.last_seq = 0
+        self.version = 0    # bumped on every change, so a page can skip redrawing
+        self.since = {}     # response_id -> time.monotonic() when it was queued
+        self.stop = threading.Event()
+        self.loaded = threading.Event()
+
+    def start(self, wait=5.0):
+        """Start the listener, waiting up to `wait` seconds for the first load."""
+        threading.Thread(target=self._run, name="triage", daemon=True).start()
+        self.loaded.wait(wait)
+        return self
+
+    @property
+    def count(self):
+        return len(self.order)
+
+    def items(self, limit=50):
+        """The first `limit` open items, highest score and longest wait first."""
+        with self.lock:
+            return [self.by_id[k[2]] for k in self.order[:limit]]
+
+    def waited(self, row):
+        """Seconds the item has been waiting."""
+        return max(0.0, time.monotonic() - self.since.get(row.response_id, time.monotonic() - row.age))
+
+    def _apply(self, rows, full=False):
+        with self.lock:
+            if full:
+                self.by_id, self.order, self.since = {}, [], {}
+            now = time.monotonic()
+            for r in rows:
+                old = self.by_id.pop(r.response_id, None)
+                self.since.pop(r.response_id, None)
+                if old is not None:
+                    del self.order[bisect.bisect_left(self.order, (-old.score, old.queued_at, old.response_id))]
+                if r.resolved_at is None:
+                    self.by_id[r.response_id] = r
+                    self.since[r.response_id] = now - r.age
+                    bisect.insort(self.order, (-r.score, r.queued_at, r.response_id))
+                self.last_seq = max(self.last_seq, r.seq)
+            if rows or full:
+                self.version += 1
+
+    def _load(self, cur):
+        cur.execute(f"SELECT {_COLS} FROM triage_queue WHERE resolved_at IS NULL ORDER BY seq")
+        rows = cur.fetchall()
+        cur.execute("SELECT last_value FROM triage_seq")
+        seq = cur.fetchone()[0]
+        self._apply(rows, full=True)
+        self.last_seq = max(self.last_seq, seq)
+        self.loaded.set()
+
+    def _fetch(self, cur):
+        cur.execute(f"SELECT {_COLS} FROM triage_queue WHERE seq > %s ORDER BY seq",
+                    (self.last_seq - LOOKBACK,))
+        self._apply(cur.fetchall())
+
+    def _run(self):
+        conn = None
+        while not self.stop.is_set():
+            try:
+                conn = self.connect()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor(cursor_factory=NamedTupleCursor)
+                cur.execute(f"LISTEN {CHANNEL}")
+                self._load(cur)
+                loaded = time.monotonic()
+                while not self.stop.is_set():
+                    if select.select([conn], [], [], 5.0) != ([], [], []):
+                        conn.poll()
+                        if conn.notifies:
+                            conn.notifies.clear()  # one read covers every change so far
+                            self._fetch(cur)
+                    if time.monotonic() - loaded > FULL_RELOAD:
+                        self._load(cur)
+                        loaded = time.monotonic()
+            except Exception as e:  # lost the database; reload everything once it is back
+                if self.log:
+                    self.log(f"triage: {e}")
+                time.sleep(2.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+                    conn = None
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    dsn = os.environ["DATABASE_URL"]
+    wl = Worklist(lambda: psycopg2.connect(dsn)).start()
+    seen = -1
+    try:
+        while True:
+            if wl.version != seen:
+                seen = wl.version
+                print(f"\n{wl.count} open")
+                for r in wl.items(int(sys.argv[1]) if len(sys.argv) > 1 else 10):
+                    print(f"  {r.score:>3}  {wl.waited(r) / 60:6.1f} min  {r.patient_name or '—'}: {r.summary}")
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass